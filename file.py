@@ -1,8 +1,8 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import mysql.connector
 from PIL import Image
-import random
 import hashlib
 import re
 from datetime import datetime, timedelta
@@ -10,27 +10,164 @@ import streamlit.components.v1 as components
 from streamlit_lottie import st_lottie
 import requests
 import time
+import random
+import threading
+import sys
+import os
+import argparse
+from contextlib import contextmanager
+from itertools import groupby
+import bisect
+import struct
+import math
 
 
 class DatabaseManager:
-    def __init__(self, host, user, password, database):
+    def __init__(self, host, user, password, database, pool_size=None, pool_timeout=30, ping_interval=60):
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self.connection = None
+        # pool_size=None keeps the legacy single shared connection; any positive
+        # value leases one connection per script thread out of a bounded pool.
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.ping_interval = ping_interval
+        self._connection = None
+        self._local = threading.local()
+        self._pool_cond = threading.Condition()
+        self._idle = []  # stack of (connection, last_used)
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    @property
+    def connection(self):
+        if not self.pool_size:
+            return self._connection
+        return getattr(self._local, 'connection', None)
+
+    def _new_connection(self):
+        return mysql.connector.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            autocommit=False
+        )
+
+    def _checkout(self):
+        reuse = None
+        wait_start = None
+        with self._pool_cond:
+            deadline = time.monotonic() + self.pool_timeout
+            while True:
+                if self._idle:
+                    reuse = self._idle.pop()
+                    break
+                if self._created < self.pool_size:
+                    self._created += 1
+                    break
+                if wait_start is None:
+                    wait_start = time.perf_counter()
+                    self._waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._pool_cond.wait(remaining):
+                    self._wait_time += time.perf_counter() - wait_start
+                    raise mysql.connector.errors.PoolError(
+                        f"No database connection available after {self.pool_timeout}s "
+                        f"(pool size {self.pool_size})")
+            if wait_start is not None:
+                self._wait_time += time.perf_counter() - wait_start
+            self._in_use += 1
+            self._checkouts += 1
+
+        try:
+            if reuse is None:
+                return self._new_connection()
+            conn, last_used = reuse
+            # Only ping connections that sat idle long enough to have been dropped
+            if time.monotonic() - last_used > self.ping_interval:
+                conn.ping(reconnect=True, attempts=1)
+            return conn
+        except mysql.connector.Error:
+            with self._pool_cond:
+                self._created -= 1
+                self._in_use -= 1
+                self._pool_cond.notify()
+            raise
+
+    def _checkin(self, conn):
+        healthy = True
+        try:
+            # Never hand a half-finished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+        except mysql.connector.Error:
+            healthy = False
+        with self._pool_cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._created -= 1
+            self._pool_cond.notify()
+        if not healthy:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+    @contextmanager
+    def lease(self):
+        """Check a connection out of the pool for the duration of the block."""
+        if not self.pool_size:
+            yield self.connect()
+            return
+        conn = self.connection
+        if conn is not None:
+            # Already leased by this thread, nested leases share it
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.connection = conn
+        try:
+            yield conn
+        finally:
+            self._local.connection = None
+            self._checkin(conn)
+
+    def release(self):
+        conn = self.connection if self.pool_size else None
+        if conn is not None:
+            self._local.connection = None
+            self._checkin(conn)
+
+    def pool_stats(self):
+        with self._pool_cond:
+            return {
+                'pool_size': self.pool_size or 1,
+                'open': self._created if self.pool_size else int(self._connection is not None),
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_ms': round(self._wait_time * 1000, 2),
+            }
 
     def connect(self):
         try:
-            if self.connection is None or not self.connection.is_connected():
-                self.connection = mysql.connector.connect(
-                    host=self.host,
-                    user=self.user,
-                    password=self.password,
-                    database=self.database,
-                    autocommit=False
-                )
-            return self.connection
+            if self.pool_size:
+                conn = self.connection
+                if conn is None:
+                    conn = self._checkout()
+                    self._local.connection = conn
+                return conn
+            if self._connection is None or not self._connection.is_connected():
+                self._connection = self._new_connection()
+            return self._connection
         except mysql.connector.Error as err:
             st.error(f"Database connection error: {err}")
             return None
@@ -46,26 +183,164 @@ class DatabaseManager:
         return None
 
     def commit(self):
-        if self.connection and self.connection.is_connected():
+        conn = self.connection
+        if conn and (self.pool_size or conn.is_connected()):
             try:
-                self.connection.commit()
+                conn.commit()
             except mysql.connector.Error as err:
                 st.error(f"Commit error: {err}")
-                self.connection.rollback()
+                conn.rollback()
 
     def close(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+        if self.pool_size:
+            # Pooled connections outlive the script run, just hand ours back
+            self.release()
+        elif self._connection and self._connection.is_connected():
+            self._connection.close()
+
+    def shutdown(self):
+        self.close()
+        with self._pool_cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+
+class OrderIdGenerator:
+    """Time-ordered 64-bit IDs: 41 bits of milliseconds, 10 bits of worker, 12 bits of sequence."""
+    EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+
+    def __init__(self, worker_id):
+        if not 0 <= worker_id < (1 << self.WORKER_BITS):
+            raise ValueError(f"worker_id must be between 0 and {(1 << self.WORKER_BITS) - 1}")
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000) - self.EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # Same millisecond or the clock stepped back: keep counting from the
+                # last timestamp so IDs never repeat or go backwards
+                self._sequence += 1
+                if self._sequence >> self.SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return ((self._last_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                    | (self.worker_id << self.SEQUENCE_BITS)
+                    | self._sequence)
+
+class WorkerIdLease:
+    """Leases an OrderIdGenerator worker id from the database.
+
+    Each id is a MySQL named lock held on a connection of its own, so no two
+    live processes hold the same one and a crashed process frees its id along
+    with its session. A heartbeat keeps the connection alive and, if it was
+    lost, takes a lock again and moves the generator to it.
+    """
+    LOCK_PREFIX = "pharmacy_order_worker_"
+
+    def __init__(self, db, generator=None, heartbeat=10):
+        self.db = db
+        self.generator = generator
+        self.heartbeat = heartbeat
+        self.worker_id = None
+        self._conn = None
+        self._acquire()
+        threading.Thread(target=self._keep_alive, daemon=True).start()
+
+    def _acquire(self, preferred=None):
+        workers = 1 << OrderIdGenerator.WORKER_BITS
+        # Start at a random id so processes starting together rarely probe the same locks
+        start = random.randrange(workers)
+        candidates = [(start + i) % workers for i in range(workers)]
+        if preferred is not None:
+            candidates.insert(0, preferred)
+        conn = self.db._new_connection()
+        try:
+            cursor = conn.cursor()
+            for worker_id in candidates:
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (f"{self.LOCK_PREFIX}{worker_id}",))
+                if cursor.fetchone()[0] == 1:
+                    cursor.close()
+                    self._conn, self.worker_id = conn, worker_id
+                    return worker_id
+            raise mysql.connector.errors.DatabaseError(f"All {workers} order worker ids are leased")
+        except mysql.connector.Error:
+            conn.close()
+            raise
+
+    def _held(self):
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()",
+                           (f"{self.LOCK_PREFIX}{self.worker_id}",))
+            held = cursor.fetchone()[0] == 1
+            cursor.close()
+            return held
+        except mysql.connector.Error:
+            return False
+
+    def _keep_alive(self):
+        while True:
+            time.sleep(self.heartbeat)
+            if self._held():
+                continue
+            try:
+                self._conn.close()
+            except mysql.connector.Error:
+                pass
+            try:
+                worker_id = self._acquire(preferred=self.worker_id)
+            except mysql.connector.Error:
+                continue  # Database still unreachable, retry on the next beat
+            if self.generator is not None:
+                with self.generator._lock:
+                    self.generator.worker_id = worker_id
+
+# One generator per server process. PHARMACY_WORKER_ID pins the worker id
+# (0-1023, distinct per process sharing a database); without it one is leased
+# from the database for the life of the process.
+@st.cache_resource
+def get_order_id_generator():
+    worker_id = os.environ.get("PHARMACY_WORKER_ID")
+    if worker_id:
+        return OrderIdGenerator(int(worker_id))
+    lease = WorkerIdLease(db_manager)
+    generator = OrderIdGenerator(lease.worker_id)
+    lease.generator = generator
+    return generator
+
+def next_order_id():
+    return get_order_id_generator().next_id()
 
 #Here u need to update your database to run this pharmacymangaement sucessfully
 
-try:
-    db_manager = DatabaseManager(
+# Streamlit re-executes this file on every rerun, so the manager (and its pool)
+# is cached for the lifetime of the server process. PHARMACY_DB_POOL_SIZE sets
+# the pool size; 0 keeps a single shared connection.
+@st.cache_resource
+def get_db_manager():
+    return DatabaseManager(
         host="localhost",
         user="root",
         password="your database password",
-        database="name database name as pharmacymanagement or any other ur wish"
+        database="name database name as pharmacymanagement or any other ur wish",
+        pool_size=int(os.environ.get("PHARMACY_DB_POOL_SIZE", "10")) or None
     )
+
+try:
+    db_manager = get_db_manager()
     
     if not db_manager.connect():
         st.error("Failed to connect to database. Please check your MySQL server and credentials.")
@@ -119,137 +394,139 @@ def validate_bike_number(bike_number):
     return True
 
 
-def create_tables():
-    try:
-        cursor = db_manager.get_cursor()
-        if not cursor:
-            return
-
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Insurance(
-            InsuranceID INT PRIMARY KEY AUTO_INCREMENT,
-            CompName VARCHAR(100) NOT NULL,
-            Coverage DECIMAL(5,2) NOT NULL
-        )''')
+def _create_base_tables(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Insurance(
+        InsuranceID INT PRIMARY KEY AUTO_INCREMENT,
+        CompName VARCHAR(100) NOT NULL,
+        Coverage DECIMAL(5,2) NOT NULL
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Customers(
-            C_Name VARCHAR(50) NOT NULL,
-            C_Password VARCHAR(100) NOT NULL,
-            C_Email VARCHAR(50) PRIMARY KEY NOT NULL,
-            C_State VARCHAR(50) NOT NULL,
-            C_Number VARCHAR(15) NOT NULL,
-            C_SSN VARCHAR(20) UNIQUE,
-            InsuranceID INT,
-            FOREIGN KEY (InsuranceID) REFERENCES Insurance(InsuranceID) ON DELETE SET NULL
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Customers(
+        C_Name VARCHAR(50) NOT NULL,
+        C_Password VARCHAR(100) NOT NULL,
+        C_Email VARCHAR(50) PRIMARY KEY NOT NULL,
+        C_State VARCHAR(50) NOT NULL,
+        C_Number VARCHAR(15) NOT NULL,
+        C_SSN VARCHAR(20) UNIQUE,
+        InsuranceID INT,
+        FOREIGN KEY (InsuranceID) REFERENCES Insurance(InsuranceID) ON DELETE SET NULL
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Drugs(
-            D_Name VARCHAR(50) NOT NULL,
-            D_ExpDate DATE NOT NULL,
-            D_Use VARCHAR(50) NOT NULL,
-            D_Qty INT NOT NULL,
-            D_id INT PRIMARY KEY NOT NULL
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Drugs(
+        D_Name VARCHAR(50) NOT NULL,
+        D_ExpDate DATE NOT NULL,
+        D_Use VARCHAR(50) NOT NULL,
+        D_Qty INT NOT NULL,
+        D_id INT PRIMARY KEY NOT NULL
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Drug_Pricing(
-            DrugID INT PRIMARY KEY,
-            PricePerUnit DECIMAL(10,2) NOT NULL,
-            FOREIGN KEY (DrugID) REFERENCES Drugs(D_id) ON DELETE CASCADE
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Drug_Pricing(
+        DrugID INT PRIMARY KEY,
+        PricePerUnit DECIMAL(10,2) NOT NULL,
+        FOREIGN KEY (DrugID) REFERENCES Drugs(D_id) ON DELETE CASCADE
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Prescription(
-            PrespID INT PRIMARY KEY AUTO_INCREMENT,
-            SSN VARCHAR(20),
-            DocID INT NOT NULL,
-            PrespDate DATE NOT NULL,
-            FOREIGN KEY (SSN) REFERENCES Customers(C_SSN) ON DELETE CASCADE
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Prescription(
+        PrespID INT PRIMARY KEY AUTO_INCREMENT,
+        SSN VARCHAR(20),
+        DocID INT NOT NULL,
+        PrespDate DATE NOT NULL,
+        FOREIGN KEY (SSN) REFERENCES Customers(C_SSN) ON DELETE CASCADE
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Prescription_Drug(
-            PrespID INT,
-            DrugName VARCHAR(100) NOT NULL,
-            PrespQty INT NOT NULL,
-            RefillLimit INT NOT NULL,
-            PRIMARY KEY (PrespID, DrugName),
-            FOREIGN KEY (PrespID) REFERENCES Prescription(PrespID) ON DELETE CASCADE
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Prescription_Drug(
+        PrespID INT,
+        DrugName VARCHAR(100) NOT NULL,
+        PrespQty INT NOT NULL,
+        RefillLimit INT NOT NULL,
+        PRIMARY KEY (PrespID, DrugName),
+        FOREIGN KEY (PrespID) REFERENCES Prescription(PrespID) ON DELETE CASCADE
+    )''')
 
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Orders(
+        O_Name VARCHAR(100) NOT NULL,
+        O_Items VARCHAR(100) NOT NULL,
+        O_Qty INT NOT NULL,
+        O_id VARCHAR(100) PRIMARY KEY NOT NULL,
+        Status VARCHAR(20) DEFAULT 'Placed',
+        OrderDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        DeliveryAddress TEXT,
+        PaymentMethod VARCHAR(50),
+        ContactNumber VARCHAR(15),
+        DeliveryAgentName VARCHAR(50),
+        DeliveryAgentPhone VARCHAR(15),
+        DeliveryAgentBike VARCHAR(20)
+    )''')
+    
+    
+    cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentName'")
+    if not cursor.fetchone():
+        cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentName VARCHAR(50) AFTER ContactNumber")
         
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Orders(
-            O_Name VARCHAR(100) NOT NULL,
-            O_Items VARCHAR(100) NOT NULL,
-            O_Qty INT NOT NULL,
-            O_id VARCHAR(100) PRIMARY KEY NOT NULL,
-            Status VARCHAR(20) DEFAULT 'Placed',
-            OrderDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-            DeliveryAddress TEXT,
-            PaymentMethod VARCHAR(50),
-            ContactNumber VARCHAR(15),
-            DeliveryAgentName VARCHAR(50),
-            DeliveryAgentPhone VARCHAR(15),
-            DeliveryAgentBike VARCHAR(20)
-        )''')
+    cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentPhone'")
+    if not cursor.fetchone():
+        cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentPhone VARCHAR(15) AFTER DeliveryAgentName")
         
+    cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentBike'")
+    if not cursor.fetchone():
+        cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentBike VARCHAR(20) AFTER DeliveryAgentPhone")
         
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentName'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentName VARCHAR(50) AFTER ContactNumber")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentPhone'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentPhone VARCHAR(15) AFTER DeliveryAgentName")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAgentBike'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAgentBike VARCHAR(20) AFTER DeliveryAgentPhone")
-            
+
+    cursor.execute("SHOW COLUMNS FROM Orders LIKE 'StatusUpdateTime'")
+    if not cursor.fetchone():
+        cursor.execute("ALTER TABLE Orders ADD COLUMN StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER OrderDate")
     
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'StatusUpdateTime'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER OrderDate")
-        
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Billing(
-            BillID INT PRIMARY KEY AUTO_INCREMENT,
-            CustomerPhone VARCHAR(15) NOT NULL,
-            BillDate DATETIME NOT NULL,
-            TotalAmount DECIMAL(10,2) NOT NULL
-        )''')
+    
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Billing(
+        BillID INT PRIMARY KEY AUTO_INCREMENT,
+        CustomerPhone VARCHAR(15) NOT NULL,
+        BillDate DATETIME NOT NULL,
+        TotalAmount DECIMAL(10,2) NOT NULL
+    )''')
+
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS Bill_Items(
+        BillItemID INT PRIMARY KEY AUTO_INCREMENT,
+        BillID INT NOT NULL,
+        DrugID INT NOT NULL,
+        DrugName VARCHAR(50) NOT NULL,
+        Quantity INT NOT NULL,
+        UnitPrice DECIMAL(10,2) NOT NULL,
+        Subtotal DECIMAL(10,2) NOT NULL,
+        FOREIGN KEY (BillID) REFERENCES Billing(BillID) ON DELETE CASCADE,
+        FOREIGN KEY (DrugID) REFERENCES Drugs(D_id) ON DELETE CASCADE
+    )''')
 
     
-        cursor.execute('''CREATE TABLE IF NOT EXISTS Bill_Items(
-            BillItemID INT PRIMARY KEY AUTO_INCREMENT,
-            BillID INT NOT NULL,
-            DrugID INT NOT NULL,
-            DrugName VARCHAR(50) NOT NULL,
-            Quantity INT NOT NULL,
-            UnitPrice DECIMAL(10,2) NOT NULL,
-            Subtotal DECIMAL(10,2) NOT NULL,
-            FOREIGN KEY (BillID) REFERENCES Billing(BillID) ON DELETE CASCADE,
-            FOREIGN KEY (DrugID) REFERENCES Drugs(D_id) ON DELETE CASCADE
-        )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS DeliveryAgents(
+        DA_Name VARCHAR(50) NOT NULL,
+        DA_Phone VARCHAR(15) PRIMARY KEY NOT NULL,
+        DA_Password VARCHAR(100) NOT NULL,
+        DA_Address TEXT NOT NULL,
+        DA_BikeNumber VARCHAR(20),
+        DA_Status VARCHAR(20) DEFAULT 'Available'
+    )''')
 
-        
-        cursor.execute('''CREATE TABLE IF NOT EXISTS DeliveryAgents(
-            DA_Name VARCHAR(50) NOT NULL,
-            DA_Phone VARCHAR(15) PRIMARY KEY NOT NULL,
-            DA_Password VARCHAR(100) NOT NULL,
-            DA_Address TEXT NOT NULL,
-            DA_BikeNumber VARCHAR(20),
-            DA_Status VARCHAR(20) DEFAULT 'Available'
-        )''')
+    
+    cursor.execute("SHOW COLUMNS FROM DeliveryAgents LIKE 'DA_BikeNumber'")
+    if not cursor.fetchone():
+        cursor.execute("ALTER TABLE DeliveryAgents ADD COLUMN DA_BikeNumber VARCHAR(20) NOT NULL AFTER DA_Address")
 
-        
-        cursor.execute("SHOW COLUMNS FROM DeliveryAgents LIKE 'DA_BikeNumber'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE DeliveryAgents ADD COLUMN DA_BikeNumber VARCHAR(20) NOT NULL AFTER DA_Address")
 
+def create_tables():
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return
+
+        _create_base_tables(cursor)
         db_manager.commit()
         st.success("Tables created successfully!")
 
@@ -257,26 +534,30 @@ def create_tables():
         st.error(f"Error creating tables: {err}")
         db_manager.connection.rollback()
 
+def _seed_insurance(cursor):
+    cursor.execute("SELECT COUNT(*) FROM Insurance")
+    count = cursor.fetchone()[0]
+    
+    if count == 0:
+        
+        insurances = [
+            ("Blue Cross", 80.00),
+            ("Aetna", 75.00),
+            ("United Healthcare", 85.00),
+            ("Medicare", 90.00)
+        ]
+        
+        cursor.executemany("INSERT INTO Insurance (CompName, Coverage) VALUES (%s, %s)", insurances)
+        return True
+    return False
+
 def initialize_sample_data():
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
             return False
 
-        
-        cursor.execute("SELECT COUNT(*) FROM Insurance")
-        count = cursor.fetchone()[0]
-        
-        if count == 0:
-            
-            insurances = [
-                ("Blue Cross", 80.00),
-                ("Aetna", 75.00),
-                ("United Healthcare", 85.00),
-                ("Medicare", 90.00)
-            ]
-            
-            cursor.executemany("INSERT INTO Insurance (CompName, Coverage) VALUES (%s, %s)", insurances)
+        if _seed_insurance(cursor):
             db_manager.commit()
             return True
         return False
@@ -284,6 +565,440 @@ def initialize_sample_data():
         st.error(f"Error initializing sample data: {err}")
         return False
 
+# Schema migrations
+# Each entry runs exactly once per database and is recorded in schema_version.
+# Append new migrations to the end, never edit one that has shipped.
+# MySQL commits every DDL statement implicitly, so a migration that fails
+# partway keeps the schema changes it made so far without being recorded, and
+# runs again from the top next time. Every migration must therefore be safe to
+# re-run: guard DDL with IF NOT EXISTS or the information_schema checks below.
+# Data changes made after a migration's last DDL statement commit together with
+# its schema_version row, so they need no guard.
+def _table_exists(cursor, table):
+    cursor.execute('''SELECT 1 FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s''', (table,))
+    return cursor.fetchone() is not None
+
+def _column_exists(cursor, table, column):
+    cursor.execute('''SELECT 1 FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s''',
+                   (table, column))
+    return cursor.fetchone() is not None
+
+def _index_exists(cursor, table, index_name):
+    cursor.execute('''SELECT 1 FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+                    LIMIT 1''', (table, index_name))
+    return cursor.fetchone() is not None
+
+def _migration_001_baseline(cursor):
+    _create_base_tables(cursor)
+    _seed_insurance(cursor)
+
+def _migration_002_order_columns(cursor):
+    # Databases created before these columns existed used to be patched on
+    # every order insert; do it once here instead.
+    order_columns = [
+        ("Status", "VARCHAR(20) DEFAULT 'Placed'"),
+        ("DeliveryAddress", "TEXT"),
+        ("ContactNumber", "VARCHAR(15)"),
+        ("PaymentMethod", "VARCHAR(50)"),
+        ("OrderDate", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+        ("StatusUpdateTime", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"),
+    ]
+    for column, definition in order_columns:
+        cursor.execute(f"SHOW COLUMNS FROM Orders LIKE '{column}'")
+        if not cursor.fetchone():
+            cursor.execute(f"ALTER TABLE Orders ADD COLUMN {column} {definition}")
+
+# (table, index name, columns) for every hot lookup column
+HOT_LOOKUP_INDEXES = [
+    ("Orders", "idx_orders_customer", "O_Name, OrderDate"),
+    ("Orders", "idx_orders_status_date", "Status, OrderDate"),
+    ("Orders", "idx_orders_agent_status", "DeliveryAgentPhone, Status"),
+    ("Drugs", "idx_drugs_name", "D_Name"),
+    ("Customers", "idx_customers_name", "C_Name"),
+    ("Customers", "idx_customers_number", "C_Number"),
+    ("Billing", "idx_billing_date", "BillDate"),
+    ("Billing", "idx_billing_customer_date", "CustomerPhone, BillDate"),
+]
+
+def _ensure_indexes(cursor, indexes):
+    for table, index_name, columns in indexes:
+        if not _index_exists(cursor, table, index_name):
+            cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+
+def _migration_003_hot_lookup_indexes(cursor):
+    _ensure_indexes(cursor, HOT_LOOKUP_INDEXES)
+
+ORDER_HEADER_INDEXES = [
+    ("OrderHeader", "idx_order_header_customer", "O_Name, OrderDate"),
+    ("OrderHeader", "idx_order_header_status_date", "Status, OrderDate"),
+    ("OrderHeader", "idx_order_header_agent_status", "DeliveryAgentPhone, Status"),
+]
+
+def _legacy_base_order_id(order_id):
+    # Cart orders were stored as "<username>_<timestamp>_<rand>_<drug id>"
+    order_id_parts = order_id.split('_')
+    return '_'.join(order_id_parts[:-1]) if len(order_id_parts) > 2 else order_id
+
+def _migration_004_order_header_lines(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS OrderHeader(
+        OrderID BIGINT PRIMARY KEY AUTO_INCREMENT,
+        O_Name VARCHAR(100) NOT NULL,
+        Status VARCHAR(20) NOT NULL DEFAULT 'Placed',
+        OrderDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        DeliveryAddress TEXT,
+        PaymentMethod VARCHAR(50),
+        ContactNumber VARCHAR(15),
+        DeliveryAgentName VARCHAR(50),
+        DeliveryAgentPhone VARCHAR(15),
+        DeliveryAgentBike VARCHAR(20),
+        LegacyOrderRef VARCHAR(100)
+    )''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS OrderLine(
+        OrderLineID BIGINT PRIMARY KEY AUTO_INCREMENT,
+        OrderID BIGINT NOT NULL,
+        D_id INT,
+        Quantity INT NOT NULL,
+        FOREIGN KEY (OrderID) REFERENCES OrderHeader(OrderID) ON DELETE CASCADE,
+        FOREIGN KEY (D_id) REFERENCES Drugs(D_id) ON DELETE SET NULL
+    )''')
+    _ensure_indexes(cursor, ORDER_HEADER_INDEXES)
+
+    # Orders is renamed or dropped as the last step, so if it is gone the
+    # backfill already finished. Otherwise drop what an earlier failed attempt
+    # had copied (its lines cascade) and copy again.
+    if not _table_exists(cursor, "Orders"):
+        return
+    cursor.execute('DELETE FROM OrderHeader WHERE LegacyOrderRef IS NOT NULL')
+
+    # Backfill: one header per legacy base order ID, one line per legacy row
+    cursor.execute('''SELECT O_Name, O_Items, O_Qty, O_id, Status, OrderDate, StatusUpdateTime,
+                             DeliveryAddress, PaymentMethod, ContactNumber,
+                             DeliveryAgentName, DeliveryAgentPhone, DeliveryAgentBike
+                      FROM Orders
+                      ORDER BY OrderDate, O_id''')
+    legacy_rows = cursor.fetchall()
+
+    if legacy_rows:
+        cursor.execute('SELECT D_Name, D_id FROM Drugs')
+        drug_ids = {}
+        for drug_name, drug_id in cursor.fetchall():
+            drug_ids.setdefault(drug_name, drug_id)
+
+        header_ids = {}
+        lines = []
+        for row in legacy_rows:
+            base_order_id = _legacy_base_order_id(row[3])
+            if base_order_id not in header_ids:
+                cursor.execute('''INSERT INTO OrderHeader (O_Name, Status, OrderDate, StatusUpdateTime,
+                                    DeliveryAddress, PaymentMethod, ContactNumber,
+                                    DeliveryAgentName, DeliveryAgentPhone, DeliveryAgentBike, LegacyOrderRef)
+                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                               (row[0], row[4] or 'Placed', row[5], row[6], row[7], row[8], row[9],
+                                row[10], row[11], row[12], base_order_id))
+                header_ids[base_order_id] = cursor.lastrowid
+            lines.append((header_ids[base_order_id], drug_ids.get(row[1]), row[2]))
+        cursor.executemany('INSERT INTO OrderLine (OrderID, D_id, Quantity) VALUES (%s, %s, %s)', lines)
+        cursor.execute('RENAME TABLE Orders TO Orders_Archive')
+    else:
+        cursor.execute('DROP TABLE Orders')
+
+def _migration_005_prescription_drug_ids(cursor):
+    # Prescription lines referenced drugs by name; key them by D_id instead.
+    # DrugName is kept (nullable) only for lines whose drug no longer exists.
+    if not _column_exists(cursor, "Prescription_Drug", "D_id"):
+        cursor.execute("ALTER TABLE Prescription_Drug ADD COLUMN D_id INT AFTER PrespID")
+    # The re-key below is a single (atomic) ALTER, so the unique key marks it done
+    if _index_exists(cursor, "Prescription_Drug", "uq_prescription_drug"):
+        return
+    cursor.execute('''UPDATE Prescription_Drug pd
+                      JOIN (SELECT D_Name, MIN(D_id) AS D_id FROM Drugs GROUP BY D_Name) d
+                        ON d.D_Name = pd.DrugName
+                      SET pd.D_id = d.D_id''')
+    cursor.execute('''ALTER TABLE Prescription_Drug
+                      DROP PRIMARY KEY,
+                      MODIFY DrugName VARCHAR(100) NULL,
+                      ADD UNIQUE KEY uq_prescription_drug (PrespID, D_id),
+                      ADD FOREIGN KEY (D_id) REFERENCES Drugs(D_id) ON DELETE SET NULL''')
+
+def _migration_006_order_line_prices(cursor):
+    # Snapshot the price at checkout so totals survive later price changes.
+    # Existing lines are backfilled with the current price, the best available.
+    if not _column_exists(cursor, "OrderLine", "UnitPrice"):
+        cursor.execute('''ALTER TABLE OrderLine
+                      ADD COLUMN UnitPrice DECIMAL(10,2) NOT NULL DEFAULT 0,
+                      ADD COLUMN Subtotal DECIMAL(10,2) NOT NULL DEFAULT 0''')
+    cursor.execute('''UPDATE OrderLine l
+                      JOIN Drug_Pricing dp ON dp.DrugID = l.D_id
+                      SET l.UnitPrice = dp.PricePerUnit, l.Subtotal = l.Quantity * dp.PricePerUnit''')
+
+CUSTOMER_ORDER_INDEXES = [
+    ("OrderHeader", "idx_order_header_customer_status", "O_Name, Status, OrderDate"),
+]
+
+def _migration_007_customer_order_index(cursor):
+    _ensure_indexes(cursor, CUSTOMER_ORDER_INDEXES)
+
+REORDER_INDEXES = [
+    ("Drugs", "idx_drugs_stock_gap", "StockGap"),
+]
+
+def _migration_008_reorder_points(cursor):
+    # Per-drug reorder threshold (the old hard-coded 50 as default). StockGap is
+    # how far stock is below it; indexing it lets "StockGap > 0" use a range scan.
+    if not _column_exists(cursor, "Drugs", "ReorderPoint"):
+        cursor.execute('''ALTER TABLE Drugs
+                      ADD COLUMN ReorderPoint INT NOT NULL DEFAULT 50,
+                      ADD COLUMN StockGap INT AS (ReorderPoint - D_Qty) STORED''')
+    _ensure_indexes(cursor, REORDER_INDEXES)
+
+DRUG_LOT_INDEXES = [
+    ("DrugLot", "idx_drug_lot_fefo", "D_id, ExpDate, LotID"),
+    ("DrugLot", "idx_drug_lot_expiry", "ExpDate, Qty"),
+]
+
+def _migration_009_drug_lots(cursor):
+    # Stock is held in lots, each with its own expiry. Drugs.D_Qty stays the
+    # total across lots and D_ExpDate the earliest expiry still in stock.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS DrugLot(
+        LotID BIGINT PRIMARY KEY AUTO_INCREMENT,
+        D_id INT NOT NULL,
+        LotNumber VARCHAR(50) NOT NULL,
+        ExpDate DATE NOT NULL,
+        Qty INT NOT NULL,
+        ReceivedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (D_id) REFERENCES Drugs(D_id) ON DELETE CASCADE
+    )''')
+    _ensure_indexes(cursor, DRUG_LOT_INDEXES)
+    cursor.execute('''INSERT INTO DrugLot (D_id, LotNumber, ExpDate, Qty)
+                      SELECT D_id, 'OPENING', D_ExpDate, D_Qty FROM Drugs WHERE D_Qty > 0''')
+
+SALES_ROLLUP_INDEXES = [
+    ("SalesByDrug", "idx_sales_by_drug_revenue", "DeliveredRevenue"),
+    ("CustomerOrderStats", "idx_customer_stats_last_order", "LastOrderDate"),
+    ("CustomerOrderStats", "idx_customer_stats_order_count", "OrderCount"),
+]
+
+def _migration_010_sales_rollups(cursor):
+    # Incrementally maintained aggregates for the dashboards. The backfill is a
+    # frozen copy of rebuild_sales_rollups() as of this migration, which keeps
+    # the migration fixed when that function changes.
+    cursor.execute('''CREATE TABLE IF NOT EXISTS SalesDaily(
+        SalesDate DATE PRIMARY KEY,
+        BillCount INT NOT NULL DEFAULT 0,
+        BillRevenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        OrderCount INT NOT NULL DEFAULT 0,
+        OrderRevenue DECIMAL(14,2) NOT NULL DEFAULT 0
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS SalesDailyDrug(
+        SalesDate DATE NOT NULL,
+        D_id INT NOT NULL,
+        Quantity INT NOT NULL DEFAULT 0,
+        Revenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (SalesDate, D_id),
+        FOREIGN KEY (D_id) REFERENCES Drugs(D_id) ON DELETE CASCADE
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS SalesByDrug(
+        D_id INT PRIMARY KEY,
+        DeliveredOrders INT NOT NULL DEFAULT 0,
+        DeliveredQuantity INT NOT NULL DEFAULT 0,
+        DeliveredRevenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        FOREIGN KEY (D_id) REFERENCES Drugs(D_id) ON DELETE CASCADE
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS CustomerOrderStats(
+        O_Name VARCHAR(100) PRIMARY KEY,
+        OrderCount INT NOT NULL,
+        LastOrderDate TIMESTAMP NULL
+    )''')
+    _ensure_indexes(cursor, SALES_ROLLUP_INDEXES)
+    for table in ("SalesDaily", "SalesDailyDrug", "SalesByDrug", "CustomerOrderStats"):
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, BillCount, BillRevenue)
+                      SELECT DATE(BillDate), COUNT(*), COALESCE(SUM(TotalAmount), 0)
+                      FROM Billing
+                      GROUP BY DATE(BillDate)''')
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, OrderCount, OrderRevenue)
+                      SELECT DATE(h.OrderDate), COUNT(DISTINCT h.OrderID), COALESCE(SUM(l.Subtotal), 0)
+                      FROM OrderHeader h
+                      LEFT JOIN OrderLine l ON l.OrderID = h.OrderID
+                      GROUP BY DATE(h.OrderDate)
+                      ON DUPLICATE KEY UPDATE OrderCount = VALUES(OrderCount),
+                                              OrderRevenue = VALUES(OrderRevenue)''')
+    cursor.execute('''INSERT INTO SalesDailyDrug (SalesDate, D_id, Quantity, Revenue)
+                      SELECT DATE(h.OrderDate), l.D_id, SUM(l.Quantity), SUM(l.Subtotal)
+                      FROM OrderHeader h
+                      JOIN OrderLine l ON l.OrderID = h.OrderID
+                      WHERE h.Status <> 'Cancelled' AND l.D_id IS NOT NULL
+                      GROUP BY DATE(h.OrderDate), l.D_id''')
+    cursor.execute('''INSERT INTO SalesByDrug (D_id, DeliveredOrders, DeliveredQuantity, DeliveredRevenue)
+                      SELECT l.D_id, COUNT(DISTINCT h.OrderID), SUM(l.Quantity), SUM(l.Subtotal)
+                      FROM OrderHeader h
+                      JOIN OrderLine l ON l.OrderID = h.OrderID
+                      WHERE h.Status = 'Delivered' AND l.D_id IS NOT NULL
+                      GROUP BY l.D_id''')
+    cursor.execute('''INSERT INTO CustomerOrderStats (O_Name, OrderCount, LastOrderDate)
+                      SELECT O_Name, COUNT(*), MAX(OrderDate) FROM OrderHeader
+                      GROUP BY O_Name''')
+
+def _migration_011_data_versions(cursor):
+    # Change counters the UI polls to skip reloading data that has not changed
+    cursor.execute('''CREATE TABLE IF NOT EXISTS DataVersion(
+        Scope VARCHAR(50) PRIMARY KEY,
+        Version BIGINT NOT NULL DEFAULT 0
+    )''')
+    cursor.execute("INSERT IGNORE INTO DataVersion (Scope) VALUES ('delivery_agents')")
+
+def _migration_012_delivery_agent_stats(cursor):
+    # Per-agent counters kept up to date by update_order_status(), backfilled
+    # here from the orders each agent has been assigned
+    cursor.execute('''CREATE TABLE IF NOT EXISTS DeliveryAgentStats(
+        DA_Phone VARCHAR(15) PRIMARY KEY,
+        TotalOrders INT NOT NULL DEFAULT 0,
+        ActiveOrders INT NOT NULL DEFAULT 0,
+        DeliveredOrders INT NOT NULL DEFAULT 0,
+        CancelledOrders INT NOT NULL DEFAULT 0,
+        DeliveryMinutes BIGINT NOT NULL DEFAULT 0,
+        DeliveredRevenue DECIMAL(14,2) NOT NULL DEFAULT 0,
+        FOREIGN KEY (DA_Phone) REFERENCES DeliveryAgents(DA_Phone) ON DELETE CASCADE
+    )''')
+    cursor.execute('''INSERT INTO DeliveryAgentStats (DA_Phone, TotalOrders, ActiveOrders, DeliveredOrders,
+                                                    CancelledOrders, DeliveryMinutes, DeliveredRevenue)
+                      SELECT da.DA_Phone,
+                             COUNT(h.OrderID),
+                             COUNT(CASE WHEN h.Status IN ('Placed', 'Confirmed', 'Shipped') THEN 1 END),
+                             COUNT(CASE WHEN h.Status = 'Delivered' THEN 1 END),
+                             COUNT(CASE WHEN h.Status = 'Cancelled' THEN 1 END),
+                             COALESCE(SUM(CASE WHEN h.Status = 'Delivered'
+                                               THEN TIMESTAMPDIFF(MINUTE, h.OrderDate, h.StatusUpdateTime) END), 0),
+                             COALESCE(SUM(CASE WHEN h.Status = 'Delivered' THEN t.Revenue END), 0)
+                      FROM DeliveryAgents da
+                      LEFT JOIN OrderHeader h ON h.DeliveryAgentPhone = da.DA_Phone
+                      LEFT JOIN (SELECT OrderID, SUM(Subtotal) AS Revenue FROM OrderLine GROUP BY OrderID) t
+                        ON t.OrderID = h.OrderID
+                      GROUP BY da.DA_Phone''')
+
+def _migration_013_delivery_time_sketches(cursor):
+    # One t-digest of delivery minutes per agent phone ('' for orders delivered
+    # without an agent), backfilled from the delivered orders
+    cursor.execute('''CREATE TABLE IF NOT EXISTS DeliveryTimeSketch(
+        Scope VARCHAR(15) PRIMARY KEY,
+        Deliveries BIGINT NOT NULL,
+        Digest BLOB NOT NULL
+    )''')
+    cursor.execute('''SELECT COALESCE(DeliveryAgentPhone, ''), TIMESTAMPDIFF(SECOND, OrderDate, StatusUpdateTime) / 60
+                      FROM OrderHeader
+                      WHERE Status = 'Delivered'
+                      ORDER BY 1''')
+    rows = []
+    for scope, deliveries in groupby(cursor.fetchall(), key=lambda row: row[0]):
+        digest = TDigest()
+        for _, minutes in deliveries:
+            digest.add(float(minutes))
+        rows.append((scope, int(digest.count), digest.to_bytes()))
+    cursor.executemany('INSERT INTO DeliveryTimeSketch (Scope, Deliveries, Digest) VALUES (%s, %s, %s)', rows)
+
+ORDER_STATUS_EVENT_INDEXES = [
+    ("OrderStatusEvent", "idx_order_status_event_order", "OrderID, EventID"),
+]
+
+def _migration_014_order_status_events(cursor):
+    # Append-only log of order status changes, seeded with every order's current
+    # status as of when it entered it, plus the per-stage aggregates
+    # consume_status_events() maintains from it and the queue of events it has
+    # yet to consume
+    cursor.execute('''CREATE TABLE IF NOT EXISTS OrderStatusEvent(
+        EventID BIGINT PRIMARY KEY AUTO_INCREMENT,
+        OrderID BIGINT NOT NULL,
+        FromStatus VARCHAR(20),
+        ToStatus VARCHAR(20) NOT NULL,
+        EventTime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )''')
+    _ensure_indexes(cursor, ORDER_STATUS_EVENT_INDEXES)
+    cursor.execute('''CREATE TABLE IF NOT EXISTS StageLatency(
+        FromStatus VARCHAR(20) NOT NULL,
+        ToStatus VARCHAR(20) NOT NULL,
+        Transitions BIGINT NOT NULL,
+        TotalSeconds BIGINT NOT NULL,
+        MaxSeconds BIGINT NOT NULL,
+        Digest BLOB NOT NULL,
+        PRIMARY KEY (FromStatus, ToStatus)
+    )''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS StageLatencyQueue(
+        EventID BIGINT PRIMARY KEY
+    )''')
+    cursor.execute('SELECT 1 FROM OrderStatusEvent LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute('''INSERT INTO OrderStatusEvent (OrderID, ToStatus, EventTime)
+                          SELECT OrderID, Status, StatusUpdateTime FROM OrderHeader
+                          ORDER BY OrderID''')
+        cursor.execute('INSERT INTO StageLatencyQueue (EventID) SELECT EventID FROM OrderStatusEvent')
+
+MIGRATIONS = [
+    (1, "Baseline schema and sample insurance providers", _migration_001_baseline),
+    (2, "Guarantee Orders status, delivery and timestamp columns", _migration_002_order_columns),
+    (3, "Secondary indexes for hot lookup columns", _migration_003_hot_lookup_indexes),
+    (4, "Split Orders into OrderHeader and OrderLine with integer keys", _migration_004_order_header_lines),
+    (5, "Reference prescription drugs by D_id", _migration_005_prescription_drug_ids),
+    (6, "Snapshot unit price and subtotal on order lines", _migration_006_order_line_prices),
+    (7, "Index customer orders by status and date", _migration_007_customer_order_index),
+    (8, "Per-drug reorder points with an indexed stock gap", _migration_008_reorder_points),
+    (9, "Stock lots with their own expiry dates", _migration_009_drug_lots),
+    (10, "Daily, per-drug and per-customer sales rollups", _migration_010_sales_rollups),
+    (11, "Data version counters for change polling", _migration_011_data_versions),
+    (12, "Per-agent delivery counters", _migration_012_delivery_agent_stats),
+    (13, "Per-agent delivery time sketches", _migration_013_delivery_time_sketches),
+    (14, "Order status event log and stage latency aggregates", _migration_014_order_status_events),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def apply_migrations():
+    """Bring the database up to SCHEMA_VERSION, returns the versions applied."""
+    cursor = db_manager.get_cursor()
+    if not cursor:
+        raise mysql.connector.errors.InterfaceError("No database connection available")
+
+    # Serialize concurrent migrators (several app processes starting at once)
+    cursor.execute("SELECT GET_LOCK('pharmacy_schema_migration', 60)")
+    if cursor.fetchone()[0] != 1:
+        raise mysql.connector.errors.DatabaseError("Timed out waiting for the schema migration lock")
+
+    applied = []
+    try:
+        cursor.execute('''CREATE TABLE IF NOT EXISTS schema_version(
+            version INT PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current_version = cursor.fetchone()[0]
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current_version:
+                continue
+            migrate(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                           (version, description))
+            db_manager.commit()
+            applied.append(version)
+    except mysql.connector.Error:
+        db_manager.connection.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('pharmacy_schema_migration')")
+        cursor.fetchall()
+    return applied
+
+# Cached for the lifetime of the process so reruns skip all DDL and metadata
+# round trips. A failed attempt raises and is therefore retried on the next run.
+@st.cache_resource
+def ensure_schema():
+    return apply_migrations()
+
 
 def customer_add_data(Cname, Cpass, Cemail, Cstate, Cnumber, Cssn=None, InsuranceID=None):
     try:
@@ -332,7 +1047,531 @@ def customer_view_all_data():
         return []
 
 # Drug functions
-def drug_add_data(Dname, Dexpdate, Duse, Dqty, Did, price=None):
+class DrugCatalog:
+    """Process-wide copy of the drug catalog, in drug_view_all_data() row shape.
+
+    Rows are (D_Name, D_ExpDate, D_Use, D_Qty, D_id, PricePerUnit) keyed by D_id.
+    The catalog reloads after `ttl` seconds or an invalidate(), and the drug
+    write functions patch it in place. `version` increases on every change so
+    derived structures can tell when to refresh.
+    """
+    FIELDS = {'name': 0, 'exp_date': 1, 'use': 2, 'qty': 3, 'price': 5}
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.version = 0
+        self._lock = threading.RLock()
+        self._rows = None
+        self._loaded_at = 0
+        self._listeners = []
+
+    def subscribe(self, listener):
+        # listener(drug_id, row) is called after a row changes (row is None when
+        # it was removed) and with (None, None) after a full reload
+        self._listeners.append(listener)
+
+    def _notify(self, drug_id, row):
+        for listener in self._listeners:
+            listener(drug_id, row)
+
+    def _load(self):
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return None
+        cursor.execute('''SELECT d.D_Name, d.D_ExpDate, d.D_Use, d.D_Qty, d.D_id, dp.PricePerUnit 
+                        FROM Drugs d
+                        LEFT JOIN Drug_Pricing dp ON d.D_id = dp.DrugID
+                        ORDER BY d.D_id''')
+        return {row[4]: row for row in cursor.fetchall()}
+
+    def _current(self):
+        with self._lock:
+            if self._rows is None or time.monotonic() - self._loaded_at > self.ttl:
+                rows = self._load()
+                if rows is None:
+                    return {}
+                self._rows = rows
+                self._loaded_at = time.monotonic()
+                self.version += 1
+                self._notify(None, None)
+            return self._rows
+
+    def all(self):
+        with self._lock:
+            return list(self._current().values())
+
+    def snapshot(self):
+        # A copy of the {D_id: row} mapping, taken under the lock because
+        # patch(), upsert() and remove() change the live one from other sessions
+        with self._lock:
+            return dict(self._current())
+
+    def get(self, drug_id):
+        return self._current().get(drug_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self.version += 1
+
+    def patch(self, drug_id, **fields):
+        with self._lock:
+            if self._rows is None:
+                return
+            row = self._rows.get(drug_id)
+            if row is None:
+                # Not cached yet, let the next read pick it up from the database
+                self._rows = None
+            else:
+                row = list(row)
+                for field, value in fields.items():
+                    row[self.FIELDS[field]] = value
+                row = self._rows[drug_id] = tuple(row)
+                self._notify(drug_id, row)
+            self.version += 1
+
+    def adjust_quantity(self, drug_id, delta):
+        with self._lock:
+            row = self._rows.get(drug_id) if self._rows is not None else None
+            if row is not None:
+                self.patch(drug_id, qty=row[3] + delta)
+
+    def remove(self, drug_id):
+        with self._lock:
+            if self._rows is not None:
+                self._rows.pop(drug_id, None)
+                self._notify(drug_id, None)
+            self.version += 1
+
+@st.cache_resource
+def get_drug_catalog():
+    return DrugCatalog()
+
+class DrugSearchIndex:
+    """Ranked search over drug name and use, kept in step with a DrugCatalog.
+
+    Results are ordered by tier, then by name: exact name, name prefix, every
+    query word starting a word of the name, every word starting a word of the
+    name or use, and finally plain substring matches (narrowed by a trigram
+    index, or a scan of the names when every query word is shorter than three
+    characters).
+    Postings are walked in name order, so each tier stops as soon as `limit`
+    results are collected.
+    """
+    PREFIX_LEN = 3
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.RLock()
+        self._stale = True
+        self._reset()
+        catalog.subscribe(self._on_catalog_change)
+
+    def _reset(self):
+        self._docs = {}
+        self._sorted = []
+        # kind -> key -> set of drug ids: prefixes of name words, prefixes of
+        # name or use words, and trigrams of the name and use text
+        self._postings = {'name': {}, 'word': {}, 'gram': {}}
+        # (kind, key) -> posting sorted by name, built on first use
+        self._ordered = {}
+
+    def _keys(self, doc):
+        name, use, name_words, use_words, text = doc
+        return (('name', {word[:n] for word in name_words for n in range(1, self.PREFIX_LEN + 1)}),
+                ('word', {word[:n] for word in name_words + use_words for n in range(1, self.PREFIX_LEN + 1)}),
+                ('gram', {text[i:i + 3] for i in range(len(text) - 2)}))
+
+    def _add(self, row, keep_sorted=True):
+        name, use = (row[0] or "").lower(), (row[2] or "").lower()
+        doc = (name, use, tuple(name.split()), tuple(use.split()), f"{name} {use}")
+        drug_id = row[4]
+        self._docs[drug_id] = doc
+        if keep_sorted:
+            bisect.insort(self._sorted, (name, drug_id))
+        else:
+            self._sorted.append((name, drug_id))
+        for kind, keys in self._keys(doc):
+            postings = self._postings[kind]
+            for key in keys:
+                postings.setdefault(key, set()).add(drug_id)
+                self._ordered.pop((kind, key), None)
+
+    def _discard(self, drug_id):
+        doc = self._docs.pop(drug_id, None)
+        if doc is None:
+            return
+        position = bisect.bisect_left(self._sorted, (doc[0], drug_id))
+        if position < len(self._sorted) and self._sorted[position] == (doc[0], drug_id):
+            del self._sorted[position]
+        for kind, keys in self._keys(doc):
+            postings = self._postings[kind]
+            for key in keys:
+                ids = postings.get(key)
+                if ids is not None:
+                    ids.discard(drug_id)
+                    if not ids:
+                        del postings[key]
+                self._ordered.pop((kind, key), None)
+
+    def _on_catalog_change(self, drug_id, row):
+        with self._lock:
+            if drug_id is None:
+                self._stale = True
+                return
+            doc = self._docs.get(drug_id)
+            if row is not None and doc is not None and doc[:2] == ((row[0] or "").lower(), (row[2] or "").lower()):
+                return  # stock or price change, nothing indexed moved
+            self._discard(drug_id)
+            if row is not None:
+                self._add(row)
+
+    def _rebuild(self, rows):
+        self._reset()
+        for row in rows.values():
+            self._add(row, keep_sorted=False)
+        self._sorted.sort()
+        self._stale = False
+
+    def _in_name_order(self, kind, key):
+        ordered = self._ordered.get((kind, key))
+        if ordered is None:
+            ids = self._postings[kind].get(key, ())
+            ordered = self._ordered[(kind, key)] = sorted((self._docs[drug_id][0], drug_id) for drug_id in ids)
+        return ordered
+
+    def _collect(self, candidates, ordered, matches, need, seen, results):
+        # Walks `candidates` in name order: sorted directly when it is a small
+        # part of the `ordered` posting it came from, else by filtering that posting
+        if len(candidates) * 16 < len(ordered):
+            ordered = sorted((self._docs[drug_id][0], drug_id) for drug_id in candidates)
+        for name, drug_id in ordered:
+            if len(results) >= need:
+                return
+            if drug_id in candidates and drug_id not in seen and matches(self._docs[drug_id]):
+                seen.add(drug_id)
+                results.append(drug_id)
+
+    @staticmethod
+    def _intersect(sets):
+        sets = sorted(sets, key=len)
+        if len(sets) == 1:
+            return sets[0]
+        result = sets[0] & sets[1]
+        for ids in sets[2:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def search(self, term, limit=50):
+        """Catalog rows matching every word of `term`, best matches first."""
+        rows = self.catalog.snapshot()
+        with self._lock:
+            if self._stale:
+                self._rebuild(rows)
+
+            query = " ".join(term.lower().split())
+            words = query.split()
+            if not words:
+                return []
+            need = limit or len(self._docs)
+            results, seen = [], set()
+
+            def starts_words(doc_words):
+                return all(any(doc_word.startswith(word) for doc_word in doc_words) for word in words)
+
+            # Exact name, then name prefix: a contiguous run of the sorted names
+            position = bisect.bisect_left(self._sorted, (query,))
+            prefixed = []
+            while position < len(self._sorted) and self._sorted[position][0].startswith(query):
+                if len(prefixed) >= need and self._sorted[position][0] != query:
+                    break
+                prefixed.append(self._sorted[position])
+                position += 1
+            for name, drug_id in sorted(prefixed, key=lambda item: (item[0] != query, item)):
+                if len(results) >= need:
+                    break
+                seen.add(drug_id)
+                results.append(drug_id)
+
+            # Word prefixes in the name, then in name or use, then substrings anywhere
+            prefixes = {word[:self.PREFIX_LEN] for word in words}
+            grams = {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+            substring = lambda doc: all(word in doc[4] for word in words)
+            tiers = [('name', prefixes, lambda doc: starts_words(doc[2])),
+                     ('word', prefixes, lambda doc: starts_words(doc[2] + doc[3]))]
+            if grams:
+                # Words too short for a trigram are still checked by `substring`
+                tiers.append(('gram', grams, substring))
+            for kind, keys, matches in tiers:
+                if len(results) >= need:
+                    break
+                postings = self._postings[kind]
+                lead = min(keys, key=lambda key: len(postings.get(key, ())))
+                if lead not in postings:
+                    continue
+                candidates = self._intersect([postings[key] for key in keys if key in postings]) \
+                    if all(key in postings for key in keys) else set()
+                self._collect(candidates, self._in_name_order(kind, lead), matches, need, seen, results)
+            if not grams and len(results) < need:
+                self._collect(self._docs, self._sorted, substring, need, seen, results)
+            return [rows[drug_id] for drug_id in results if drug_id in rows]
+
+@st.cache_resource
+def get_drug_search_index():
+    return DrugSearchIndex(get_drug_catalog())
+
+def search_drugs(term, limit=50):
+    return get_drug_search_index().search(term, limit)
+
+def _edit_pattern(word):
+    # Per-character match masks used by _edit_distance
+    masks = {}
+    for i, char in enumerate(word):
+        masks[char] = masks.get(char, 0) | (1 << i)
+    return masks, len(word)
+
+def _edit_distance(pattern, text):
+    """Levenshtein distance between a prepared pattern and `text`.
+
+    Bit-parallel (Myers/Hyyro): one column of the DP matrix per character of
+    `text`, held in two bit vectors, instead of a Python loop per cell.
+    """
+    masks, length = pattern
+    if not length:
+        return len(text)
+    full, high = (1 << length) - 1, 1 << (length - 1)
+    positive, negative, score = full, 0, length
+    for char in text:
+        eq = masks.get(char, 0)
+        vertical = eq | negative
+        horizontal = (((eq & positive) + positive) ^ positive) | eq
+        h_positive = negative | (~(horizontal | positive) & full)
+        h_negative = positive & horizontal
+        if h_positive & high:
+            score += 1
+        elif h_negative & high:
+            score -= 1
+        h_positive = ((h_positive << 1) | 1) & full
+        h_negative = (h_negative << 1) & full
+        positive = h_negative | (~(vertical | h_positive) & full)
+        negative = h_positive & vertical
+    return score
+
+def edit_distance(a, b):
+    return _edit_distance(_edit_pattern(a), b)
+
+class DrugNameMatcher:
+    """BK-trees over the words of drug names for typo-tolerant lookups.
+
+    Every node holds one lowercased word, the drug ids whose name contains it,
+    and its children keyed by edit distance, so a query only visits subtrees
+    whose distance band can still contain a match. Words are split into one
+    tree per length, and a query only searches the lengths within its distance.
+    Kept in step with a DrugCatalog.
+    """
+    MIN_WORD_LEN = 3
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.RLock()
+        self._roots = {}
+        self._names = {}
+        self._stale = True
+        catalog.subscribe(self._on_catalog_change)
+
+    @classmethod
+    def _words(cls, text):
+        words = (text or "").lower().split()
+        return {word for word in words if len(word) >= cls.MIN_WORD_LEN} or set(words)
+
+    def _add(self, word, drug_id):
+        node = self._roots.get(len(word))
+        if node is None:
+            self._roots[len(word)] = [word, {drug_id}, {}]
+            return
+        pattern = _edit_pattern(word)
+        while True:
+            distance = _edit_distance(pattern, node[0])
+            if distance == 0:
+                node[1].add(drug_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [word, {drug_id}, {}]
+                return
+            node = child
+
+    def _discard(self, word, drug_id):
+        # Nodes stay in the tree (they route other words), only the id goes
+        pattern = _edit_pattern(word)
+        node = self._roots.get(len(word))
+        while node is not None:
+            distance = _edit_distance(pattern, node[0])
+            if distance == 0:
+                node[1].discard(drug_id)
+                return
+            node = node[2].get(distance)
+
+    def _index(self, drug_id, name):
+        self._names[drug_id] = name
+        for word in self._words(name):
+            self._add(word, drug_id)
+
+    def _unindex(self, drug_id):
+        name = self._names.pop(drug_id, None)
+        if name is not None:
+            for word in self._words(name):
+                self._discard(word, drug_id)
+
+    def _on_catalog_change(self, drug_id, row):
+        with self._lock:
+            if drug_id is None:
+                self._stale = True
+                return
+            if row is not None and self._names.get(drug_id) == row[0]:
+                return
+            self._unindex(drug_id)
+            if row is not None:
+                self._index(drug_id, row[0])
+
+    def _rebuild(self, rows):
+        self._roots = {}
+        self._names = {}
+        for drug_id, row in rows.items():
+            self._index(drug_id, row[0])
+        self._stale = False
+
+    def _within(self, word, max_distance):
+        # {drug_id: distance} for every indexed word within max_distance of `word`
+        pattern = _edit_pattern(word)
+        found = {}
+        pending = [self._roots[length] for length in range(len(word) - max_distance, len(word) + max_distance + 1)
+                   if length in self._roots]
+        while pending:
+            key, ids, children = pending.pop()
+            distance = _edit_distance(pattern, key)
+            if distance <= max_distance:
+                for drug_id in ids:
+                    if distance < found.get(drug_id, max_distance + 1):
+                        found[drug_id] = distance
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        return found
+
+    def lookup(self, term, max_distance=None, limit=5):
+        """Closest catalog rows to `term`, as [(distance, row)].
+
+        Every word of `term` must be within `max_distance` (by default 1, or 2
+        for words of six or more characters) of some word of the drug name;
+        rows are ranked by the summed distance.
+        """
+        rows = self.catalog.snapshot()
+        words = self._words(term)
+        if not words:
+            return []
+        with self._lock:
+            if self._stale:
+                self._rebuild(rows)
+            scores = None
+            for word in words:
+                allowed = max_distance if max_distance is not None else 1 if len(word) <= 5 else 2
+                found = self._within(word, allowed)
+                if scores is None:
+                    scores = found
+                else:
+                    scores = {drug_id: scores[drug_id] + distance
+                              for drug_id, distance in found.items() if drug_id in scores}
+                if not scores:
+                    return []
+        ranked = sorted((distance, rows[drug_id][0] or "", drug_id)
+                        for drug_id, distance in scores.items() if drug_id in rows)
+        return [(distance, rows[drug_id]) for distance, _, drug_id in ranked[:limit]]
+
+@st.cache_resource
+def get_drug_name_matcher():
+    return DrugNameMatcher(get_drug_catalog())
+
+def fuzzy_find_drugs(term, max_distance=None, limit=5):
+    """Catalog rows whose name (or a word of it) is within edit distance of `term`."""
+    return [row for _, row in get_drug_name_matcher().lookup(term, max_distance, limit)]
+
+# Stock lots
+# Every change to a drug's stock also changes its DrugLot rows in the same
+# transaction. Writers update the Drugs row first, so its row lock serializes
+# everyone touching that drug's lots.
+def _lot_number():
+    return f"LOT-{datetime.now():%Y%m%d}"
+
+def _allocate_lots_statement(drug_count):
+    """The _allocate_lots UPDATE for a cart of `drug_count` drugs.
+
+    Params: D_id, quantity for each drug.
+    """
+    cart = " UNION ALL ".join(["SELECT %s AS D_id, %s AS Qty"] * drug_count)
+    return f'''
+        UPDATE DrugLot l
+        JOIN (
+            SELECT lot.LotID,
+                   LEAST(lot.Qty, cart.Qty - (SUM(lot.Qty) OVER fefo - lot.Qty)) AS Taken
+            FROM DrugLot lot
+            JOIN ({cart}) cart ON cart.D_id = lot.D_id
+            WHERE lot.Qty > 0
+            WINDOW fefo AS (PARTITION BY lot.D_id ORDER BY lot.ExpDate, lot.LotID)
+        ) allocation ON allocation.LotID = l.LotID
+        SET l.Qty = l.Qty - allocation.Taken
+        WHERE allocation.Taken > 0'''
+
+def _allocate_lots(cursor, quantities):
+    """Take {drug_id: quantity} from each drug's earliest-expiring lots (FEFO).
+
+    One statement for the whole cart: a running total over the lots in expiry
+    order gives how much each lot still has to cover. Raises DataError when a
+    drug's lots hold less than its quantity, so the caller rolls back.
+    """
+    # The lots must cover the whole quantity, which they only fail to do when
+    # they have drifted from Drugs.D_Qty. Locks the lots the UPDATE takes from.
+    placeholders = ", ".join(["%s"] * len(quantities))
+    cursor.execute(f'''SELECT D_id, SUM(Qty) FROM DrugLot
+                     WHERE D_id IN ({placeholders}) AND Qty > 0
+                     GROUP BY D_id
+                     FOR UPDATE''', tuple(sorted(quantities)))
+    available = dict(cursor.fetchall())
+    for drug_id, quantity in sorted(quantities.items()):
+        if available.get(drug_id, 0) < quantity:
+            raise mysql.connector.errors.DataError(
+                f"Stock lots of drug {drug_id} hold {available.get(drug_id, 0)} units, {quantity} needed")
+    cursor.execute(_allocate_lots_statement(len(quantities)),
+                   [value for item in sorted(quantities.items()) for value in item])
+
+def _refresh_lot_expiry(cursor, drug_ids):
+    """Set D_ExpDate to the earliest expiry still in stock, returns {D_id: D_ExpDate}."""
+    placeholders = ", ".join(["%s"] * len(drug_ids))
+    cursor.execute(f'''UPDATE Drugs d
+                       JOIN (SELECT D_id, MIN(ExpDate) AS ExpDate FROM DrugLot
+                             WHERE D_id IN ({placeholders}) AND Qty > 0
+                             GROUP BY D_id) lot ON lot.D_id = d.D_id
+                       SET d.D_ExpDate = lot.ExpDate''', tuple(drug_ids))
+    cursor.execute(f'SELECT D_id, D_ExpDate FROM Drugs WHERE D_id IN ({placeholders})', tuple(drug_ids))
+    return dict(cursor.fetchall())
+
+def get_drug_lots(drug_id):
+    """(LotID, LotNumber, ExpDate, Qty, ReceivedAt) of a drug's lots in stock, FEFO order."""
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return []
+        cursor.execute('''SELECT LotID, LotNumber, ExpDate, Qty, ReceivedAt FROM DrugLot
+                        WHERE D_id = %s AND Qty > 0
+                        ORDER BY ExpDate, LotID''', (drug_id,))
+        return cursor.fetchall()
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving drug lots: {err}")
+        return []
+
+def drug_add_data(Dname, Dexpdate, Duse, Dqty, Did, price=None, reorder_point=50, lot_number=None):
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
@@ -343,8 +1582,12 @@ def drug_add_data(Dname, Dexpdate, Duse, Dqty, Did, price=None):
         
         try:
             # Add drug to Drugs table
-            cursor.execute('INSERT INTO Drugs VALUES (%s, %s, %s, %s, %s)', 
-                         (Dname, Dexpdate, Duse, Dqty, Did))
+            cursor.execute('''INSERT INTO Drugs (D_Name, D_ExpDate, D_Use, D_Qty, D_id, ReorderPoint)
+                            VALUES (%s, %s, %s, %s, %s, %s)''', 
+                         (Dname, Dexpdate, Duse, Dqty, Did, reorder_point))
+            if Dqty > 0:
+                cursor.execute('INSERT INTO DrugLot (D_id, LotNumber, ExpDate, Qty) VALUES (%s, %s, %s, %s)',
+                               (Did, lot_number or _lot_number(), Dexpdate, Dqty))
             
             # Add pricing if provided
             if price is not None:
@@ -352,6 +1595,7 @@ def drug_add_data(Dname, Dexpdate, Duse, Dqty, Did, price=None):
             
             # Commit transaction
             db_manager.commit()
+            get_drug_catalog().invalidate()
             return True
             
         except mysql.connector.Error as err:
@@ -365,26 +1609,45 @@ def drug_add_data(Dname, Dexpdate, Duse, Dqty, Did, price=None):
         return False
 
 def drug_view_all_data():
+    try:
+        return get_drug_catalog().all()
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving drug data: {err}")
+        return []
+
+def get_drug(drug_id):
+    """One drug by primary key, in drug_view_all_data() row shape, or None."""
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
-            return []
+            return None
         cursor.execute('''SELECT d.D_Name, d.D_ExpDate, d.D_Use, d.D_Qty, d.D_id, dp.PricePerUnit 
                         FROM Drugs d
-                        LEFT JOIN Drug_Pricing dp ON d.D_id = dp.DrugID''')
-        return cursor.fetchall() or []
+                        LEFT JOIN Drug_Pricing dp ON d.D_id = dp.DrugID
+                        WHERE d.D_id = %s''', (drug_id,))
+        return cursor.fetchone()
     except mysql.connector.Error as err:
-        st.error(f"Error retrieving drug data: {err}")
-        return []
+        st.error(f"Error retrieving drug: {err}")
+        return None
 
-def get_drug_price(drug_id):
+def get_drug_id_page(after_id=0, limit=20):
+    """(D_id, D_Name) pairs after `after_id` in ID order, plus whether more follow."""
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
-            return 0
-        cursor.execute('SELECT PricePerUnit FROM Drug_Pricing WHERE DrugID = %s', (drug_id,))
-        result = cursor.fetchone()
-        return float(result[0]) if result and result[0] is not None else 0
+            return [], False
+        cursor.execute('SELECT D_id, D_Name FROM Drugs WHERE D_id > %s ORDER BY D_id LIMIT %s',
+                       (after_id, limit + 1))
+        rows = cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving drug IDs: {err}")
+        return [], False
+
+def get_drug_price(drug_id):
+    try:
+        drug = get_drug_catalog().get(drug_id)
+        return float(drug[5]) if drug and drug[5] is not None else 0
     except mysql.connector.Error as err:
         st.error(f"Error getting drug price: {err}")
         return 0
@@ -399,6 +1662,7 @@ def update_drug_price(drug_id, new_price):
                         ON DUPLICATE KEY UPDATE PricePerUnit = %s''',
                      (drug_id, new_price, new_price))
         db_manager.commit()
+        get_drug_catalog().patch(drug_id, price=new_price)
         return True
     except mysql.connector.Error as err:
         st.error(f"Error updating drug price: {err}")
@@ -416,6 +1680,7 @@ def drug_update(Duse, Did):
         try:
             cursor.execute('UPDATE Drugs SET D_Use = %s WHERE D_id = %s', (Duse, Did))
             db_manager.commit()
+            get_drug_catalog().patch(Did, use=Duse)
             return True
             
         except mysql.connector.Error as err:
@@ -439,15 +1704,25 @@ def update_drug_quantity(drug_id, new_quantity):
         
         try:
             # Check if drug exists
-            cursor.execute('SELECT D_Name FROM Drugs WHERE D_id = %s', (drug_id,))
+            cursor.execute('SELECT D_Qty, D_ExpDate FROM Drugs WHERE D_id = %s FOR UPDATE', (drug_id,))
             drug = cursor.fetchone()
             if not drug:
+                db_manager.connection.rollback()
                 st.error("Drug not found")
                 return False
                 
-            # Update quantity
+            # Update quantity, a count correction comes out of the earliest lots
+            # and a surplus is booked as a lot at the current earliest expiry
             cursor.execute('UPDATE Drugs SET D_Qty = %s WHERE D_id = %s', (new_quantity, drug_id))
+            delta = new_quantity - drug[0]
+            if delta < 0:
+                _allocate_lots(cursor, {drug_id: -delta})
+            elif delta > 0:
+                cursor.execute('INSERT INTO DrugLot (D_id, LotNumber, ExpDate, Qty) VALUES (%s, %s, %s, %s)',
+                               (drug_id, "ADJUSTMENT", drug[1], delta))
+            expiry = _refresh_lot_expiry(cursor, [drug_id])
             db_manager.commit()
+            get_drug_catalog().patch(drug_id, qty=new_quantity, exp_date=expiry[drug_id])
             return True
             
         except mysql.connector.Error as err:
@@ -460,6 +1735,198 @@ def update_drug_quantity(drug_id, new_quantity):
         st.error(f"Database error: {err}")
         return False
 
+# Range scan on idx_drugs_stock_gap, keyset on (StockGap, D_id)
+LOW_STOCK_FIRST_PAGE_QUERY = '''
+    SELECT d.D_Name, d.D_Qty, d.ReorderPoint, d.D_id, dp.PricePerUnit, d.StockGap
+    FROM Drugs d
+    LEFT JOIN Drug_Pricing dp ON dp.DrugID = d.D_id
+    WHERE d.StockGap > 0
+    ORDER BY d.StockGap DESC, d.D_id DESC
+    LIMIT %s
+'''
+LOW_STOCK_NEXT_PAGE_QUERY = '''
+    SELECT d.D_Name, d.D_Qty, d.ReorderPoint, d.D_id, dp.PricePerUnit, d.StockGap
+    FROM Drugs d
+    LEFT JOIN Drug_Pricing dp ON dp.DrugID = d.D_id
+    WHERE d.StockGap > 0
+      AND (d.StockGap < %s OR (d.StockGap = %s AND d.D_id < %s))
+    ORDER BY d.StockGap DESC, d.D_id DESC
+    LIMIT %s
+'''
+
+def get_low_stock_drugs(cursor=None, limit=20):
+    """One page of drugs below their reorder point, largest shortfall first.
+
+    `cursor` is the (StockGap, D_id) of the last row of the previous page.
+    Returns (rows, next_cursor) with rows of
+    (D_Name, D_Qty, ReorderPoint, D_id, PricePerUnit, StockGap).
+    """
+    try:
+        db_cursor = db_manager.get_cursor()
+        if not db_cursor:
+            return [], None
+        if cursor:
+            db_cursor.execute(LOW_STOCK_NEXT_PAGE_QUERY, (cursor[0], cursor[0], cursor[1], limit + 1))
+        else:
+            db_cursor.execute(LOW_STOCK_FIRST_PAGE_QUERY, (limit + 1,))
+        rows = db_cursor.fetchall()
+        next_cursor = (rows[limit - 1][5], rows[limit - 1][3]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving low stock drugs: {err}")
+        return [], None
+
+def restock_drugs(updates):
+    """Apply [(drug_id, added_quantity, reorder_point, lot_expiry)] in one transaction.
+
+    Each added quantity is received as a new lot expiring on `lot_expiry`.
+    """
+    if not updates:
+        return True
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return False
+        cursor.execute("START TRANSACTION")
+        try:
+            updates = sorted(updates)
+            cursor.executemany('UPDATE Drugs SET D_Qty = D_Qty + %s, ReorderPoint = %s WHERE D_id = %s',
+                               [(added, reorder_point, drug_id) for drug_id, added, reorder_point, _ in updates])
+            lots = [(drug_id, _lot_number(), expiry, added) for drug_id, added, _, expiry in updates if added > 0]
+            expiry_dates = {}
+            if lots:
+                cursor.executemany('INSERT INTO DrugLot (D_id, LotNumber, ExpDate, Qty) VALUES (%s, %s, %s, %s)', lots)
+                expiry_dates = _refresh_lot_expiry(cursor, [lot[0] for lot in lots])
+            db_manager.commit()
+        except mysql.connector.Error as err:
+            db_manager.connection.rollback()
+            st.error(f"Error restocking drugs: {err}")
+            return False
+        catalog = get_drug_catalog()
+        for drug_id, added, _, _ in updates:
+            catalog.adjust_quantity(drug_id, added)
+        for drug_id, expiry in expiry_dates.items():
+            catalog.patch(drug_id, exp_date=expiry)
+        return True
+    except mysql.connector.Error as err:
+        st.error(f"Database error: {err}")
+        return False
+
+# Demand forecasting
+# Demand comes from non-cancelled order lines. Velocity is an exponentially
+# weighted daily mean, weekly seasonality is a day-of-week factor shrunk toward
+# the catalog-wide pattern, and safety stock covers demand noise over the lead
+# time plus review period at the configured service level.
+FORECAST_HISTORY_DAYS = 90
+FORECAST_HALF_LIFE_DAYS = 14
+FORECAST_LEAD_TIME_DAYS = 7
+FORECAST_REVIEW_DAYS = 7
+FORECAST_SERVICE_Z = 1.65  # ~95% cycle service level
+# Units of history a drug needs before its own weekday pattern outweighs the catalog's
+FORECAST_SEASONALITY_PRIOR = 28
+
+# Daily units per drug net of cancellations, a range of the SalesDailyDrug primary key
+FORECAST_DEMAND_QUERY = '''
+    SELECT D_id, SalesDate, Quantity
+    FROM SalesDailyDrug
+    WHERE SalesDate >= %s AND Quantity > 0
+'''
+
+def forecast_demand(demand, drug_ids, today, history_days=FORECAST_HISTORY_DAYS,
+                    lead_time_days=FORECAST_LEAD_TIME_DAYS, review_days=FORECAST_REVIEW_DAYS,
+                    service_z=FORECAST_SERVICE_Z):
+    """Forecast demand for every drug in one vectorized pass.
+
+    `demand` is a DataFrame of (D_id, day, qty) daily totals. Returns a DataFrame
+    indexed by D_id with velocity (units/day), forecast (units over lead time
+    plus review period), safety_stock and order_up_to.
+    """
+    days = pd.date_range(end=pd.Timestamp(today), periods=history_days, freq='D')
+    index = pd.Index(drug_ids, name='D_id')
+    
+    # drugs x days matrix of units sold, zero on days without sales
+    matrix = np.zeros((len(index), history_days))
+    if len(demand):
+        rows = index.get_indexer(demand['D_id'])
+        cols = days.get_indexer(pd.to_datetime(demand['day']))
+        known = (rows >= 0) & (cols >= 0)
+        np.add.at(matrix, (rows[known], cols[known]), demand['qty'].to_numpy(dtype=float)[known])
+    
+    age = np.arange(history_days - 1, -1, -1, dtype=float)
+    weights = 0.5 ** (age / FORECAST_HALF_LIFE_DAYS)
+    velocity = matrix @ weights / weights.sum()
+    
+    # Day-of-week factors: mean demand per weekday relative to the overall mean
+    weekday = np.zeros((history_days, 7))
+    weekday[np.arange(history_days), days.dayofweek] = 1
+    weekday_counts = weekday.sum(axis=0)
+    mean = matrix.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        own = (matrix @ weekday / weekday_counts) / mean[:, None]
+        pooled = (matrix.sum(axis=0) @ weekday / weekday_counts) / mean.sum()
+    own = np.where(mean[:, None] > 0, own, 1.0)
+    pooled = np.nan_to_num(pooled, nan=1.0)
+    totals = matrix.sum(axis=1)[:, None]
+    trust = totals / (totals + FORECAST_SEASONALITY_PRIOR)
+    seasonality = trust * own + (1 - trust) * pooled
+    
+    # Weekdays covered by the horizon starting tomorrow
+    horizon = lead_time_days + review_days
+    upcoming = pd.date_range(pd.Timestamp(today) + pd.Timedelta(days=1), periods=horizon, freq='D')
+    horizon_weekdays = np.bincount(upcoming.dayofweek, minlength=7)
+    forecast = velocity * (seasonality @ horizon_weekdays)
+    
+    safety_stock = service_z * matrix.std(axis=1, ddof=1) * np.sqrt(horizon)
+    return pd.DataFrame({
+        'velocity': velocity,
+        'forecast': forecast,
+        'safety_stock': safety_stock,
+        'order_up_to': np.ceil(forecast + safety_stock),
+    }, index=index)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def get_demand_forecast(history_days=FORECAST_HISTORY_DAYS):
+    """Cached forecast_demand() over the whole catalog, or None on error."""
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return None
+        # SalesDailyDrug days are the server's, so "today" must be too
+        cursor.execute('SELECT CURDATE()')
+        today = cursor.fetchone()[0]
+        cursor.execute(FORECAST_DEMAND_QUERY, (today - timedelta(days=history_days - 1),))
+        demand = pd.DataFrame(cursor.fetchall(), columns=['D_id', 'day', 'qty'])
+        demand['qty'] = demand['qty'].astype(float)
+        drug_ids = sorted(get_drug_catalog().snapshot())
+        return forecast_demand(demand, drug_ids, today, history_days)
+    except mysql.connector.Error as err:
+        st.error(f"Error forecasting demand: {err}")
+        return None
+
+def reorder_suggestions(forecast=None):
+    """Suggested reorder quantity and days of cover against current stock.
+
+    Stock is read from the drug catalog on every call, so restocks show up
+    without waiting for the cached forecast to expire. Returns a DataFrame
+    indexed by D_id with D_Name, D_Qty, velocity, forecast, safety_stock,
+    reorder_qty and days_of_cover, most urgent first, or None.
+    """
+    if forecast is None:
+        forecast = get_demand_forecast()
+    if forecast is None:
+        return None
+    rows = get_drug_catalog().all()
+    stock = pd.DataFrame([(row[4], row[0], row[3]) for row in rows],
+                         columns=['D_id', 'D_Name', 'D_Qty']).set_index('D_id')
+    result = stock.join(forecast, how='inner')
+    qty = result['D_Qty'].to_numpy(dtype=float)
+    velocity = result['velocity'].to_numpy()
+    result['reorder_qty'] = np.maximum(result['order_up_to'].to_numpy() - qty, 0).astype(int)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['days_of_cover'] = np.where(velocity > 0, qty / velocity, np.inf)
+    return result.drop(columns='order_up_to').sort_values(['days_of_cover', 'reorder_qty'],
+                                                          ascending=[True, False])
+
 def drug_delete(Did):
     try:
         cursor = db_manager.get_cursor()
@@ -467,159 +1934,550 @@ def drug_delete(Did):
             return False
         cursor.execute('DELETE FROM Drugs WHERE D_id = %s', (Did,))
         db_manager.commit()
+        get_drug_catalog().remove(Did)
         return True
     except mysql.connector.Error as err:
         st.error(f"Error deleting drug: {err}")
         return False
 
-# Order functions
-# Modify the order_add_data function to fix the Status column issue
-# Updated order_add_data function
-def order_add_data(O_Name, O_Items, O_Qty, O_id, status="Placed", address="", payment_method="", contact_number=""):
+# Change counters
+# Writers bump a scope's DataVersion in their own transaction; pages poll it
+# with a primary-key lookup and reload only when it moved.
+DELIVERY_AGENTS_SCOPE = "delivery_agents"
+
+def bump_data_version(cursor, scope):
+    cursor.execute('UPDATE DataVersion SET Version = Version + 1 WHERE Scope = %s', (scope,))
+
+def get_data_version(scope):
+    """Current version of `scope`, or None if it cannot be read."""
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
-            return False
-        
-        # Check if order ID already exists
-        cursor.execute('SELECT O_id FROM Orders WHERE O_id = %s', (O_id,))
-        if cursor.fetchone():
-            st.error("Order ID already exists. Please try again.")
-            return False
-        
-        # Check if the Status column exists in the Orders table
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'Status'")
-        status_column_exists = cursor.fetchone()
-        
-        if not status_column_exists:
-            # Add the Status column if it doesn't exist
-            cursor.execute("ALTER TABLE Orders ADD COLUMN Status VARCHAR(20) DEFAULT 'Placed'")
+            return None
+        cursor.execute('SELECT Version FROM DataVersion WHERE Scope = %s', (scope,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    except mysql.connector.Error:
+        return None
+
+# Sales rollups
+# SalesDaily      bills and orders per day (orders of every status, as placed)
+# SalesDailyDrug  units and revenue per day x drug, net of cancelled orders
+# SalesByDrug     delivered orders, units and revenue per drug
+# CustomerOrderStats  order count and latest order per customer
+# Writers apply their delta in the same transaction as the change itself. The
+# day's SalesDaily row is shared by every checkout, so the delta goes in last,
+# just before the commit, to keep its row lock short.
+def _rollup_order_demand(cursor, order_id, sign=1):
+    """Add (sign=1) or remove (sign=-1) an order's lines in SalesDailyDrug."""
+    cursor.execute('''INSERT INTO SalesDailyDrug (SalesDate, D_id, Quantity, Revenue)
+                    SELECT DATE(h.OrderDate), l.D_id, %s * l.Quantity, %s * l.Subtotal
+                    FROM OrderHeader h
+                    JOIN OrderLine l ON l.OrderID = h.OrderID
+                    WHERE h.OrderID = %s AND l.D_id IS NOT NULL
+                    ON DUPLICATE KEY UPDATE Quantity = Quantity + VALUES(Quantity),
+                                            Revenue = Revenue + VALUES(Revenue)''',
+                   (sign, sign, order_id))
+
+def _rollup_order_counts(cursor, order_id, sign=1):
+    """Add (sign=1) or remove (sign=-1) an order in SalesDaily."""
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, OrderCount, OrderRevenue)
+                    SELECT DATE(h.OrderDate), %s, %s * COALESCE(SUM(l.Subtotal), 0)
+                    FROM OrderHeader h
+                    LEFT JOIN OrderLine l ON l.OrderID = h.OrderID
+                    WHERE h.OrderID = %s
+                    GROUP BY h.OrderID
+                    ON DUPLICATE KEY UPDATE OrderCount = OrderCount + VALUES(OrderCount),
+                                            OrderRevenue = OrderRevenue + VALUES(OrderRevenue)''',
+                   (sign, sign, order_id))
+
+def _rollup_order_delivered(cursor, order_id):
+    cursor.execute('''INSERT INTO SalesByDrug (D_id, DeliveredOrders, DeliveredQuantity, DeliveredRevenue)
+                    SELECT D_id, 1, Quantity, Subtotal FROM OrderLine
+                    WHERE OrderID = %s AND D_id IS NOT NULL
+                    ON DUPLICATE KEY UPDATE DeliveredOrders = DeliveredOrders + 1,
+                                            DeliveredQuantity = DeliveredQuantity + VALUES(DeliveredQuantity),
+                                            DeliveredRevenue = DeliveredRevenue + VALUES(DeliveredRevenue)''',
+                   (order_id,))
+
+# Change to (TotalOrders, ActiveOrders, DeliveredOrders, CancelledOrders) of the
+# assigned agent when an order moves to the status. Delivered also adds its
+# delivery minutes and revenue. An agent is only assigned on Shipped, so every
+# order an agent holds is active until it is delivered or cancelled.
+AGENT_STATS_DELTAS = {
+    "Shipped": (1, 1, 0, 0),
+    "Delivered": (0, -1, 1, 0),
+    "Cancelled": (0, -1, 0, 1),
+    "Deleted": (-1, 0, 0, -1),  # only cancelled orders with an agent can be deleted
+}
+
+def _record_agent_transition(cursor, order_id, status):
+    """Apply AGENT_STATS_DELTAS[status] for the order's agent, if it has one."""
+    total, active, delivered, cancelled = AGENT_STATS_DELTAS[status]
+    cursor.execute('''INSERT INTO DeliveryAgentStats (DA_Phone, TotalOrders, ActiveOrders, DeliveredOrders,
+                                                    CancelledOrders, DeliveryMinutes, DeliveredRevenue)
+                    SELECT h.DeliveryAgentPhone, %s, %s, %s, %s,
+                           %s * TIMESTAMPDIFF(MINUTE, h.OrderDate, h.StatusUpdateTime),
+                           %s * COALESCE((SELECT SUM(l.Subtotal) FROM OrderLine l WHERE l.OrderID = h.OrderID), 0)
+                    FROM OrderHeader h
+                    WHERE h.OrderID = %s AND h.DeliveryAgentPhone IS NOT NULL
+                    ON DUPLICATE KEY UPDATE TotalOrders = TotalOrders + VALUES(TotalOrders),
+                                            ActiveOrders = ActiveOrders + VALUES(ActiveOrders),
+                                            DeliveredOrders = DeliveredOrders + VALUES(DeliveredOrders),
+                                            CancelledOrders = CancelledOrders + VALUES(CancelledOrders),
+                                            DeliveryMinutes = DeliveryMinutes + VALUES(DeliveryMinutes),
+                                            DeliveredRevenue = DeliveredRevenue + VALUES(DeliveredRevenue)''',
+                   (total, active, delivered, cancelled, delivered, delivered, order_id))
+
+def _rollup_bill(cursor, total_amount):
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, BillCount, BillRevenue)
+                    VALUES (CURDATE(), 1, %s)
+                    ON DUPLICATE KEY UPDATE BillCount = BillCount + 1,
+                                            BillRevenue = BillRevenue + VALUES(BillRevenue)''',
+                   (total_amount,))
+
+def _rollup_customer_order(cursor, order_id, sign=1):
+    """Add (sign=1) or remove (sign=-1) an order in CustomerOrderStats."""
+    if sign > 0:
+        cursor.execute('''INSERT INTO CustomerOrderStats (O_Name, OrderCount, LastOrderDate)
+                        SELECT O_Name, 1, OrderDate FROM OrderHeader WHERE OrderID = %s
+                        ON DUPLICATE KEY UPDATE OrderCount = OrderCount + 1,
+                                                LastOrderDate = GREATEST(COALESCE(LastOrderDate, VALUES(LastOrderDate)),
+                                                                         VALUES(LastOrderDate))''',
+                       (order_id,))
+        return
+    # LastOrderDate only moves when it was this order's, and then falls back to
+    # the customer's latest other order, one idx_order_header_customer lookup
+    cursor.execute('''UPDATE CustomerOrderStats s
+                    JOIN OrderHeader h ON h.OrderID = %s AND h.O_Name = s.O_Name
+                    SET s.OrderCount = s.OrderCount - 1,
+                        s.LastOrderDate = CASE WHEN s.LastOrderDate = h.OrderDate
+                                               THEN (SELECT MAX(o.OrderDate) FROM OrderHeader o
+                                                     WHERE o.O_Name = h.O_Name AND o.OrderID <> h.OrderID)
+                                               ELSE s.LastOrderDate END''', (order_id,))
+    cursor.execute('''DELETE s FROM CustomerOrderStats s
+                    JOIN OrderHeader h ON h.OrderID = %s AND h.O_Name = s.O_Name
+                    WHERE s.OrderCount <= 0''', (order_id,))
+
+def rebuild_sales_rollups(cursor):
+    """Recompute every rollup table from Billing, OrderHeader and OrderLine.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    for table in ("SalesDaily", "SalesDailyDrug", "SalesByDrug", "CustomerOrderStats"):
+        cursor.execute(f"DELETE FROM {table}")
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, BillCount, BillRevenue)
+                    SELECT DATE(BillDate), COUNT(*), COALESCE(SUM(TotalAmount), 0)
+                    FROM Billing
+                    GROUP BY DATE(BillDate)''')
+    cursor.execute('''INSERT INTO SalesDaily (SalesDate, OrderCount, OrderRevenue)
+                    SELECT DATE(h.OrderDate), COUNT(DISTINCT h.OrderID), COALESCE(SUM(l.Subtotal), 0)
+                    FROM OrderHeader h
+                    LEFT JOIN OrderLine l ON l.OrderID = h.OrderID
+                    GROUP BY DATE(h.OrderDate)
+                    ON DUPLICATE KEY UPDATE OrderCount = VALUES(OrderCount),
+                                            OrderRevenue = VALUES(OrderRevenue)''')
+    cursor.execute('''INSERT INTO SalesDailyDrug (SalesDate, D_id, Quantity, Revenue)
+                    SELECT DATE(h.OrderDate), l.D_id, SUM(l.Quantity), SUM(l.Subtotal)
+                    FROM OrderHeader h
+                    JOIN OrderLine l ON l.OrderID = h.OrderID
+                    WHERE h.Status <> 'Cancelled' AND l.D_id IS NOT NULL
+                    GROUP BY DATE(h.OrderDate), l.D_id''')
+    cursor.execute('''INSERT INTO SalesByDrug (D_id, DeliveredOrders, DeliveredQuantity, DeliveredRevenue)
+                    SELECT l.D_id, COUNT(DISTINCT h.OrderID), SUM(l.Quantity), SUM(l.Subtotal)
+                    FROM OrderHeader h
+                    JOIN OrderLine l ON l.OrderID = h.OrderID
+                    WHERE h.Status = 'Delivered' AND l.D_id IS NOT NULL
+                    GROUP BY l.D_id''')
+    cursor.execute('''INSERT INTO CustomerOrderStats (O_Name, OrderCount, LastOrderDate)
+                    SELECT O_Name, COUNT(*), MAX(OrderDate) FROM OrderHeader
+                    GROUP BY O_Name''')
+
+# Delivery time percentiles
+# Each agent's delivery times (minutes from order to delivery) are kept in a
+# t-digest, a mergeable quantile sketch, updated as orders are delivered.
+# Percentiles across all agents merge the per-agent digests at read time.
+DELIVERY_PERCENTILES = (0.5, 0.9, 0.99)
+
+class TDigest:
+    """Merging t-digest: a few kilobytes per scope, p99 within about 1%.
+
+    Points are buffered and merged into centroids whose weight is bounded by
+    4 * n * q * (1 - q) / compression, so centroids stay small in the tails
+    where the interesting percentiles are.
+    """
+    HEADER = struct.Struct('<ddI')
+
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self._centroids = []  # sorted (mean, weight)
+        self._buffer = []
+
+    def add(self, value, weight=1):
+        self._buffer.append((value, weight))
+        self.count += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other):
+        other._compress()
+        self._buffer.extend(other._centroids)
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer)
+        self._buffer = []
+        total = self.count
+        centroids = []
+        mean, weight = points[0]
+        before = 0  # weight of the centroids already emitted
+        for point_mean, point_weight in points[1:]:
+            merged = weight + point_weight
+            q = (before + merged / 2) / total
+            if merged <= max(1, 4 * total * q * (1 - q) / self.compression):
+                mean += (point_mean - mean) * point_weight / merged
+                weight = merged
+            else:
+                centroids.append((mean, weight))
+                before += weight
+                mean, weight = point_mean, point_weight
+        centroids.append((mean, weight))
+        self._centroids = centroids
+
+    def quantile(self, q):
+        """Estimated value at quantile `q` (0-1), or None when empty."""
+        self._compress()
+        centroids = self._centroids
+        if not centroids:
+            return None
+        if len(centroids) == 1:
+            return centroids[0][0]
+        target = q * self.count
+        # Interpolate between centroid centres, and out to min/max at the ends
+        first_mean, first_weight = centroids[0]
+        if target < first_weight / 2:
+            return self.min + (first_mean - self.min) * target / (first_weight / 2)
+        last_mean, last_weight = centroids[-1]
+        if target > self.count - last_weight / 2:
+            tail = last_weight / 2
+            return last_mean + (self.max - last_mean) * (target - (self.count - tail)) / tail
+        position = first_weight / 2
+        for (mean, weight), (next_mean, next_weight) in zip(centroids, centroids[1:]):
+            step = (weight + next_weight) / 2
+            if position + step >= target:
+                return mean + (next_mean - mean) * (target - position) / step
+            position += step
+        return last_mean
+
+    def to_bytes(self):
+        self._compress()
+        values = [value for centroid in self._centroids for value in centroid]
+        return (self.HEADER.pack(self.min, self.max, len(self._centroids))
+                + struct.pack(f'<{len(values)}f', *values))
+
+    @classmethod
+    def from_bytes(cls, data, compression=100):
+        digest = cls(compression)
+        digest.min, digest.max, size = cls.HEADER.unpack_from(data)
+        values = struct.unpack_from(f'<{2 * size}f', data, cls.HEADER.size)
+        digest._centroids = list(zip(values[::2], values[1::2]))
+        digest.count = sum(values[1::2])
+        return digest
+
+def _record_delivery_time(cursor, order_id):
+    # Called once the order is Delivered; orders shipped without an agent go
+    # under the '' scope so they still count towards the overall percentiles
+    cursor.execute('''SELECT COALESCE(DeliveryAgentPhone, ''), TIMESTAMPDIFF(SECOND, OrderDate, StatusUpdateTime) / 60
+                    FROM OrderHeader WHERE OrderID = %s''', (order_id,))
+    scope, minutes = cursor.fetchone()
+    # Make sure the scope's row exists before locking it: a locking read of a
+    # missing row only takes a gap lock, and two first deliveries holding it
+    # deadlock on their inserts. The no-op upsert locks an existing row
+    # exclusively straight away (INSERT IGNORE would only share it).
+    cursor.execute('''INSERT INTO DeliveryTimeSketch (Scope, Deliveries, Digest) VALUES (%s, 0, %s)
+                    ON DUPLICATE KEY UPDATE Scope = Scope''', (scope, TDigest().to_bytes()))
+    cursor.execute('SELECT Digest FROM DeliveryTimeSketch WHERE Scope = %s FOR UPDATE', (scope,))
+    digest = TDigest.from_bytes(cursor.fetchone()[0])
+    digest.add(float(minutes))
+    cursor.execute('UPDATE DeliveryTimeSketch SET Deliveries = %s, Digest = %s WHERE Scope = %s',
+                   (int(digest.count), digest.to_bytes(), scope))
+
+def get_delivery_time_percentiles(cursor):
+    """{scope: (deliveries, [p50, p90, p99])} per agent phone, plus None for all agents."""
+    cursor.execute('SELECT Scope, Digest FROM DeliveryTimeSketch')
+    overall = TDigest()
+    percentiles = {}
+    for scope, data in cursor.fetchall():
+        digest = TDigest.from_bytes(data)
+        percentiles[scope] = (int(digest.count), [digest.quantile(q) for q in DELIVERY_PERCENTILES])
+        overall.merge(digest)
+    percentiles[None] = (int(overall.count), [overall.quantile(q) for q in DELIVERY_PERCENTILES])
+    return percentiles
+
+# Exact nearest-rank percentiles recomputed from OrderHeader, for comparison.
+# Params: each of DELIVERY_PERCENTILES.
+EXACT_DELIVERY_PERCENTILES_QUERY = '''
+    SELECT MIN(CASE WHEN rn >= CEIL(%s * n) THEN minutes END),
+           MIN(CASE WHEN rn >= CEIL(%s * n) THEN minutes END),
+           MIN(CASE WHEN rn >= CEIL(%s * n) THEN minutes END),
+           MAX(n)
+    FROM (SELECT TIMESTAMPDIFF(SECOND, OrderDate, StatusUpdateTime) / 60 AS minutes,
+                 ROW_NUMBER() OVER (ORDER BY TIMESTAMPDIFF(SECOND, OrderDate, StatusUpdateTime)) AS rn,
+                 COUNT(*) OVER () AS n
+          FROM OrderHeader
+          WHERE Status = 'Delivered') delivered
+'''
+
+# Order status events
+# Every status an order enters is appended to OrderStatusEvent in the same
+# transaction as the change, together with a StageLatencyQueue row naming the
+# event. The consumer folds queued events into StageLatency and deletes their
+# queue rows in the same commit, so every event is applied exactly once however
+# out of order EventIDs commit, and no history is rescanned.
+ORDER_STATUSES = ("Placed", "Confirmed", "Shipped", "Delivered", "Cancelled")
+STAGE_LATENCY_LOCK = "pharmacy_stage_latency_consumer"
+
+def _record_status_event(cursor, order_id, from_status=None):
+    cursor.execute('''INSERT INTO OrderStatusEvent (OrderID, FromStatus, ToStatus, EventTime)
+                    SELECT OrderID, %s, Status, StatusUpdateTime FROM OrderHeader WHERE OrderID = %s''',
+                   (from_status, order_id))
+    cursor.execute('INSERT INTO StageLatencyQueue (EventID) VALUES (LAST_INSERT_ID())')
+
+# Params: (batch size). Queued events with the seconds since the order's
+# previous event, NULL for its first one. An order's transitions are serialized
+# on its OrderHeader row, so the previous event always committed first.
+STATUS_EVENT_BATCH_QUERY = '''
+    SELECT q.EventID, e.FromStatus, e.ToStatus,
+           TIMESTAMPDIFF(SECOND, (SELECT p.EventTime FROM OrderStatusEvent p
+                                  WHERE p.OrderID = e.OrderID AND p.EventID < e.EventID
+                                  ORDER BY p.EventID DESC LIMIT 1), e.EventTime)
+    FROM StageLatencyQueue q
+    JOIN OrderStatusEvent e ON e.EventID = q.EventID
+    ORDER BY q.EventID
+    LIMIT %s
+'''
+
+def consume_status_events(cursor, batch_size=1000):
+    """Fold queued OrderStatusEvent rows into StageLatency, returns how many were consumed.
+
+    Commits after every batch. Returns 0 straight away when another consumer is
+    already running.
+    """
+    # One consumer at a time, so the digests read below are not rewritten underneath it
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (STAGE_LATENCY_LOCK,))
+    if cursor.fetchone()[0] != 1:
+        return 0
+    consumed = 0
+    try:
+        while True:
+            cursor.execute(STATUS_EVENT_BATCH_QUERY, (batch_size,))
+            events = cursor.fetchall()
+            if not events:
+                break
+
+            stages = {}
+            for _, from_status, to_status, seconds in events:
+                if from_status is None or seconds is None:
+                    continue
+                stage = stages.setdefault((from_status, to_status), [0, 0, 0, TDigest()])
+                stage[0] += 1
+                stage[1] += seconds
+                stage[2] = max(stage[2], seconds)
+                stage[3].add(seconds / 60)
+
+            for (from_status, to_status), (transitions, total, longest, digest) in stages.items():
+                cursor.execute('SELECT Digest FROM StageLatency WHERE FromStatus = %s AND ToStatus = %s',
+                               (from_status, to_status))
+                stored = cursor.fetchone()
+                if stored:
+                    digest.merge(TDigest.from_bytes(stored[0]))
+                cursor.execute('''INSERT INTO StageLatency (FromStatus, ToStatus, Transitions, TotalSeconds, MaxSeconds, Digest)
+                                VALUES (%s, %s, %s, %s, %s, %s)
+                                ON DUPLICATE KEY UPDATE Transitions = Transitions + VALUES(Transitions),
+                                                        TotalSeconds = TotalSeconds + VALUES(TotalSeconds),
+                                                        MaxSeconds = GREATEST(MaxSeconds, VALUES(MaxSeconds)),
+                                                        Digest = VALUES(Digest)''',
+                               (from_status, to_status, transitions, total, longest, digest.to_bytes()))
+            placeholders = ", ".join(["%s"] * len(events))
+            cursor.execute(f'DELETE FROM StageLatencyQueue WHERE EventID IN ({placeholders})',
+                           tuple(event[0] for event in events))
             db_manager.commit()
-            
-        # Check if other columns exist and add them if they don't
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'DeliveryAddress'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN DeliveryAddress TEXT")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'ContactNumber'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN ContactNumber VARCHAR(15)")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'PaymentMethod'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN PaymentMethod VARCHAR(50)")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'OrderDate'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN OrderDate TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-            
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'StatusUpdateTime'")
-        if not cursor.fetchone():
-            cursor.execute("ALTER TABLE Orders ADD COLUMN StatusUpdateTime TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
-            
-        db_manager.commit()
-        
-        # Validate drug availability before inserting
-        cursor.execute('SELECT D_Qty FROM Drugs WHERE D_Name = %s', (O_Items,))
-        available_qty = cursor.fetchone()
-        
-        if not available_qty:
-            st.error(f"Drug {O_Items} not found in inventory")
+            consumed += len(events)
+            if len(events) < batch_size:
+                break
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (STAGE_LATENCY_LOCK,))
+        cursor.fetchone()
+    return consumed
+
+def reset_stage_latency(cursor):
+    """Empty StageLatency and queue the whole log again, so the next run replays it.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    cursor.execute('DELETE FROM StageLatency')
+    cursor.execute('INSERT IGNORE INTO StageLatencyQueue (EventID) SELECT EventID FROM OrderStatusEvent')
+
+def pending_status_events(cursor):
+    """Number of status events the consumer has not folded in yet."""
+    cursor.execute('SELECT COUNT(*) FROM StageLatencyQueue')
+    return cursor.fetchone()[0]
+
+def get_stage_latency(cursor):
+    """[(from, to, transitions, avg, p50, p90, max)] with times in minutes, in status order."""
+    cursor.execute('SELECT FromStatus, ToStatus, Transitions, TotalSeconds, MaxSeconds, Digest FROM StageLatency')
+    stages = []
+    for from_status, to_status, transitions, total, longest, data in cursor.fetchall():
+        digest = TDigest.from_bytes(data)
+        stages.append((from_status, to_status, transitions, total / transitions / 60,
+                       digest.quantile(0.5), digest.quantile(0.9), longest / 60))
+    stages.sort(key=lambda stage: (ORDER_STATUSES.index(stage[0]), ORDER_STATUSES.index(stage[1])))
+    return stages
+
+# Order functions
+# An order is one OrderHeader row (customer, status, delivery and agent details)
+# plus one OrderLine per drug, keyed by the integer OrderID.
+
+# Params: (Quantity, D_id, Quantity). Only decrements when enough stock is left.
+STOCK_DECREMENT = 'UPDATE Drugs SET D_Qty = D_Qty - %s WHERE D_id = %s AND D_Qty >= %s'
+
+# Params: (OrderID, Quantity, Quantity, D_id). Prices the line at checkout time.
+ORDER_LINE_INSERT = '''
+    INSERT INTO OrderLine (OrderID, D_id, Quantity, UnitPrice, Subtotal)
+    SELECT %s, d.D_id, %s, COALESCE(dp.PricePerUnit, 0), %s * COALESCE(dp.PricePerUnit, 0)
+    FROM Drugs d
+    LEFT JOIN Drug_Pricing dp ON dp.DrugID = d.D_id
+    WHERE d.D_id = %s
+'''
+def order_add_data(O_Name, drug_id, O_Qty, status="Placed", address="", payment_method="", contact_number=""):
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
             return False
-            
-        if available_qty[0] < O_Qty:
-            st.error(f"Not enough quantity available for {O_Items}. Available: {available_qty[0]}, Requested: {O_Qty}")
+
+        order_id = next_order_id()
+        cursor.execute('''INSERT INTO OrderHeader (OrderID, O_Name, Status, DeliveryAddress, PaymentMethod, ContactNumber)
+                      VALUES (%s, %s, %s, %s, %s, %s)''',
+                     (order_id, O_Name, status, address, payment_method, contact_number))
+
+        # Only decrement when enough stock is left, so no separate availability check is needed
+        cursor.execute(STOCK_DECREMENT, (O_Qty, drug_id, O_Qty))
+        if cursor.rowcount == 0:
+            db_manager.connection.rollback()
+            cursor.execute('SELECT D_Qty, D_Name FROM Drugs WHERE D_id = %s', (drug_id,))
+            drug_info = cursor.fetchone()
+            if not drug_info:
+                st.error(f"Drug {drug_id} not found in inventory")
+            else:
+                st.error(f"Not enough quantity available for {drug_info[1]}. Available: {drug_info[0]}, Requested: {O_Qty}")
             return False
-        
-        # Now insert the order with all parameters
-        cursor.execute('''INSERT INTO Orders (O_Name, O_Items, O_Qty, O_id, Status, DeliveryAddress, PaymentMethod, ContactNumber)
-                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
-                     (O_Name, O_Items, O_Qty, O_id, status, address, payment_method, contact_number))
-        
-        # Update drug quantity
-        cursor.execute('UPDATE Drugs SET D_Qty = D_Qty - %s WHERE D_Name = %s', (O_Qty, O_Items))
+
+        _allocate_lots(cursor, {drug_id: O_Qty})
+        expiry = _refresh_lot_expiry(cursor, [drug_id])
+        cursor.execute(ORDER_LINE_INSERT, (order_id, O_Qty, O_Qty, drug_id))
+        _rollup_order_demand(cursor, order_id)
+        _rollup_customer_order(cursor, order_id)
+        _rollup_order_counts(cursor, order_id)
+        _record_status_event(cursor, order_id)
         db_manager.commit()
-        return True
-            
+        catalog = get_drug_catalog()
+        catalog.adjust_quantity(drug_id, -O_Qty)
+        catalog.patch(drug_id, exp_date=expiry[drug_id])
+        return order_id
+
     except mysql.connector.Error as err:
         st.error(f"Error adding order: {err}")
         if db_manager.connection and db_manager.connection.is_connected():
             db_manager.connection.rollback()
         return False
 
-# Updated place order code for the shopping cart
+# Checkout runs as one transaction: every stock decrement is conditional on
+# enough stock being left, so concurrent checkouts cannot oversell, and any
+# shortfall rolls the whole order back.
 def place_order_with_cart(username, cart, delivery_address, contact_number, payment_method):
+    if not cart:
+        st.error("Your cart is empty")
+        return False
     try:
-        # Generate a unique order ID with timestamp and random component
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        random_component = random.randint(1000, 9999)
-        base_order_id = f"{username}_{timestamp}_{random_component}"
-        
         cursor = db_manager.get_cursor()
         if not cursor:
             return False
-            
-        # Check if order ID already exists
-        cursor.execute('SELECT O_id FROM Orders WHERE O_id LIKE %s', (f"{base_order_id}%",))
-        if cursor.fetchone():
-            # If ID exists, generate a new one with additional random component
-            random_component = random.randint(10000, 99999)
-            base_order_id = f"{username}_{timestamp}_{random_component}"
-            
-        # First check if all drugs are available in sufficient quantities
-        for drug_id, item in cart.items():
-            cursor.execute('SELECT D_Qty, D_Name FROM Drugs WHERE D_id = %s', (drug_id,))
-            drug_info = cursor.fetchone()
-            
-            if not drug_info:
-                st.error(f"Drug {item['name']} not found in inventory")
-                return False
-                
-            available_qty = drug_info[0]
-            if available_qty < item['quantity']:
-                st.error(f"Not enough quantity available for {item['name']}. Available: {available_qty}, Requested: {item['quantity']}")
-                return False
-        
-        # Create order records for each item in the cart
-        for drug_id, item in cart.items():
-            # Create unique order ID for each item
-            order_id = f"{base_order_id}_{drug_id}"
-            
-            # Double check if this specific order ID exists
-            cursor.execute('SELECT O_id FROM Orders WHERE O_id = %s', (order_id,))
-            if cursor.fetchone():
-                # If exists, generate a new unique ID
-                order_id = f"{base_order_id}_{drug_id}_{random.randint(1000, 9999)}"
-            
-            try:
-                # Start transaction
-                cursor.execute("START TRANSACTION")
-                
-                # Insert order record
-                cursor.execute('''
-                    INSERT INTO Orders (O_id, O_Name, O_Items, O_Qty, Status, DeliveryAddress, PaymentMethod, ContactNumber)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (order_id, username, item['name'], item['quantity'], "Placed", delivery_address, payment_method, contact_number))
-                
-                # Update drug quantity
-                cursor.execute('UPDATE Drugs SET D_Qty = D_Qty - %s WHERE D_id = %s', 
-                             (item['quantity'], drug_id))
-                
-                # Commit transaction
-                db_manager.commit()
-                
-            except mysql.connector.Error as err:
-                # Rollback transaction on error
-                db_manager.connection.rollback()
-                st.error(f"Error processing order for {item['name']}: {err}")
-                return False
-        
+
+        cursor.execute("START TRANSACTION")
+        try:
+            # Decrement in D_id order so concurrent checkouts lock rows in the same order
+            for drug_id in sorted(cart):
+                item = cart[drug_id]
+                cursor.execute(STOCK_DECREMENT, (item['quantity'], drug_id, item['quantity']))
+                if cursor.rowcount == 0:
+                    db_manager.connection.rollback()
+                    cursor.execute('SELECT D_Qty FROM Drugs WHERE D_id = %s', (drug_id,))
+                    available_qty = cursor.fetchone()
+                    if not available_qty:
+                        get_drug_catalog().remove(drug_id)
+                        st.error(f"Drug {item['name']} not found in inventory")
+                    else:
+                        # The shopper saw a stale quantity, refresh it
+                        get_drug_catalog().patch(drug_id, qty=available_qty[0])
+                        st.error(f"Not enough quantity available for {item['name']}. Available: {available_qty[0]}, Requested: {item['quantity']}")
+                    return False
+
+            # Stock is confirmed, take it from the earliest-expiring lots
+            quantities = {drug_id: item['quantity'] for drug_id, item in cart.items()}
+            _allocate_lots(cursor, quantities)
+            expiry_dates = _refresh_lot_expiry(cursor, list(quantities))
+
+            order_id = next_order_id()
+            cursor.execute('''
+                INSERT INTO OrderHeader (OrderID, O_Name, Status, DeliveryAddress, PaymentMethod, ContactNumber)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (order_id, username, "Placed", delivery_address, payment_method, contact_number))
+
+            # Price every line in one query, then insert all lines in one batch
+            placeholders = ", ".join(["%s"] * len(cart))
+            cursor.execute(f'SELECT DrugID, PricePerUnit FROM Drug_Pricing WHERE DrugID IN ({placeholders})',
+                           tuple(cart))
+            prices = dict(cursor.fetchall())
+            lines = []
+            for drug_id, item in cart.items():
+                price = prices.get(drug_id, 0)
+                lines.append((order_id, drug_id, item['quantity'], price, price * item['quantity']))
+            cursor.executemany('''
+                INSERT INTO OrderLine (OrderID, D_id, Quantity, UnitPrice, Subtotal)
+                VALUES (%s, %s, %s, %s, %s)
+            ''', lines)
+            _rollup_order_demand(cursor, order_id)
+            _rollup_customer_order(cursor, order_id)
+            _rollup_order_counts(cursor, order_id)
+            _record_status_event(cursor, order_id)
+
+            db_manager.commit()
+            catalog = get_drug_catalog()
+            for drug_id, item in cart.items():
+                catalog.adjust_quantity(drug_id, -item['quantity'])
+                catalog.patch(drug_id, exp_date=expiry_dates[drug_id])
+        except mysql.connector.Error as err:
+            db_manager.connection.rollback()
+            st.error(f"Error placing order: {err}")
+            return False
+
         return {
             'success': True,
-            'order_id': base_order_id,
+            'order_id': order_id,
             'items': [item['name'] for item in cart.values()],
             'total_qty': sum(item['quantity'] for item in cart.values()),
-            'total_amount': sum(item['quantity'] * item['price'] for item in cart.values())
+            'total_amount': sum(line[4] for line in lines)
         }
             
     except Exception as e:
@@ -628,35 +2486,125 @@ def place_order_with_cart(username, cart, delivery_address, contact_number, paym
             db_manager.connection.rollback()
         return False
     
-def order_view_all_data():
+# One row per order line:
+# (O_Name, D_Name, Quantity, OrderID, Status, DeliveryAddress, PaymentMethod,
+#  ContactNumber, OrderDate, StatusUpdateTime, D_id, UnitPrice, Subtotal)
+ORDER_LINES_SELECT = '''
+    SELECT h.O_Name, d.D_Name, l.Quantity, h.OrderID, h.Status, 
+           h.DeliveryAddress, h.PaymentMethod, h.ContactNumber, h.OrderDate, h.StatusUpdateTime, l.D_id,
+           l.UnitPrice, l.Subtotal
+    FROM OrderHeader h
+    JOIN OrderLine l ON l.OrderID = h.OrderID
+    LEFT JOIN Drugs d ON d.D_id = l.D_id
+'''
+# Served by idx_order_header_status_date
+ORDER_LINES_BY_STATUS_QUERY = ORDER_LINES_SELECT + '''
+    WHERE h.Status = %s
+    ORDER BY h.OrderDate DESC, h.OrderID DESC
+'''
+
+def order_view_all_data(status=None):
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
             return []
-            
-        # First check if StatusUpdateTime column exists
-        cursor.execute("SHOW COLUMNS FROM Orders LIKE 'StatusUpdateTime'")
-        has_status_time = cursor.fetchone() is not None
-        
-        if has_status_time:
-            cursor.execute('''
-                SELECT O_Name, O_Items, O_Qty, O_id, Status, 
-                       DeliveryAddress, PaymentMethod, ContactNumber, OrderDate, StatusUpdateTime 
-                FROM Orders
-                ORDER BY OrderDate DESC
-            ''')
+
+        if status:
+            cursor.execute(ORDER_LINES_BY_STATUS_QUERY, (status,))
         else:
             cursor.execute('''
-                SELECT O_Name, O_Items, O_Qty, O_id, Status, 
-                       DeliveryAddress, PaymentMethod, ContactNumber, OrderDate, OrderDate as StatusUpdateTime 
-                FROM Orders
-                ORDER BY OrderDate DESC
+                SELECT h.O_Name, d.D_Name, l.Quantity, h.OrderID, h.Status, 
+                       h.DeliveryAddress, h.PaymentMethod, h.ContactNumber, h.OrderDate, h.StatusUpdateTime, l.D_id,
+                       l.UnitPrice, l.Subtotal
+                FROM OrderHeader h
+                JOIN OrderLine l ON l.OrderID = h.OrderID
+                LEFT JOIN Drugs d ON d.D_id = l.D_id
+                ORDER BY h.OrderDate DESC, h.OrderID DESC
             ''')
         return cursor.fetchall() or []
     except mysql.connector.Error as err:
         st.error(f"Error retrieving order data: {err}")
         return []
 
+def _customer_orders_page_query(status=False, after=False):
+    """Keyset page of a customer's orders on (OrderDate, OrderID), served by
+    idx_order_header_customer_status / idx_order_header_customer.
+
+    Params: O_Name, [Status,] [OrderDate, OrderDate, OrderID,] limit.
+    """
+    conditions = ["O_Name = %s"]
+    if status:
+        conditions.append("Status = %s")
+    if after:
+        conditions.append("(OrderDate < %s OR (OrderDate = %s AND OrderID < %s))")
+    return f'''
+        SELECT OrderDate, OrderID
+        FROM OrderHeader
+        WHERE {" AND ".join(conditions)}
+        ORDER BY OrderDate DESC, OrderID DESC
+        LIMIT %s
+    '''
+
+def get_customer_orders(username, status=None, cursor=None, limit=10):
+    """One page of a customer's orders, newest first.
+
+    `cursor` is the (OrderDate, OrderID) of the last order on the previous page
+    (None for the first page). Returns (rows, next_cursor) where rows use the
+    order_view_all_data line layout and next_cursor is None on the last page.
+    """
+    try:
+        db_cursor = db_manager.get_cursor()
+        if not db_cursor:
+            return [], None
+
+        params = [username]
+        if status:
+            params.append(status)
+        if cursor:
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        db_cursor.execute(_customer_orders_page_query(bool(status), bool(cursor)), (*params, limit + 1))
+        page = db_cursor.fetchall()
+        next_cursor = page[limit - 1] if len(page) > limit else None
+        order_ids = [order_id for _, order_id in page[:limit]]
+        if not order_ids:
+            return [], None
+
+        placeholders = ", ".join(["%s"] * len(order_ids))
+        db_cursor.execute(f'''
+            SELECT h.O_Name, d.D_Name, l.Quantity, h.OrderID, h.Status, 
+                   h.DeliveryAddress, h.PaymentMethod, h.ContactNumber, h.OrderDate, h.StatusUpdateTime, l.D_id,
+                   l.UnitPrice, l.Subtotal
+            FROM OrderHeader h
+            JOIN OrderLine l ON l.OrderID = h.OrderID
+            LEFT JOIN Drugs d ON d.D_id = l.D_id
+            WHERE h.OrderID IN ({placeholders})
+            ORDER BY h.OrderDate DESC, h.OrderID DESC
+        ''', tuple(order_ids))
+        return db_cursor.fetchall(), next_cursor
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving order data: {err}")
+        return [], None
+
+def get_order_totals(order_ids):
+    """Order totals from the stored line subtotals, as {OrderID: total}."""
+    if not order_ids:
+        return {}
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return {}
+        placeholders = ", ".join(["%s"] * len(order_ids))
+        cursor.execute(f'''
+            SELECT OrderID, SUM(Subtotal)
+            FROM OrderLine
+            WHERE OrderID IN ({placeholders})
+            GROUP BY OrderID
+        ''', tuple(order_ids))
+        return dict(cursor.fetchall())
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving order totals: {err}")
+        return {}
+
 def order_delete(Oid):
     try:
         cursor = db_manager.get_cursor()
@@ -664,20 +2612,35 @@ def order_delete(Oid):
             st.error("Database connection error. Please try again later.")
             return False
             
-        # Check if the order exists
-        cursor.execute('SELECT Status FROM Orders WHERE O_id LIKE %s LIMIT 1', (f"{Oid}%",))
+        # Check if the order exists, locking it so a concurrent delete or status
+        # change waits and then sees this one's outcome before touching the rollups
+        cursor.execute('SELECT Status FROM OrderHeader WHERE OrderID = %s FOR UPDATE', (Oid,))
         existing_order = cursor.fetchone()
         if not existing_order:
+            db_manager.connection.rollback()
             st.error(f"Order {Oid} not found")
             return False
             
         # Check if the order can be deleted (only allow deletion of Placed or Cancelled orders)
         if existing_order[0] not in ["Placed", "Cancelled"]:
+            db_manager.connection.rollback()
             st.error(f"Cannot delete order with status: {existing_order[0]}. Only Placed or Cancelled orders can be deleted.")
             return False
             
-        # Delete the order
-        cursor.execute('DELETE FROM Orders WHERE O_id LIKE %s', (f"{Oid}%",))
+        # Take it out of the rollups (a cancelled order already left the demand
+        # rollup), then delete it, its lines go with it (ON DELETE CASCADE)
+        if existing_order[0] != "Cancelled":
+            _rollup_order_demand(cursor, Oid, sign=-1)
+        _rollup_order_counts(cursor, Oid, sign=-1)
+        _rollup_customer_order(cursor, Oid, sign=-1)
+        if existing_order[0] == "Cancelled":
+            _record_agent_transition(cursor, Oid, "Deleted")
+        cursor.execute('DELETE FROM OrderHeader WHERE OrderID = %s', (Oid,))
+        if cursor.rowcount != 1:
+            db_manager.connection.rollback()
+            st.error(f"Order {Oid} not found")
+            return False
+        bump_data_version(cursor, DELIVERY_AGENTS_SCOPE)
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
@@ -704,10 +2667,12 @@ def update_order_status(order_id, new_status, delivery_agent_phone=None):
             st.error(f"Invalid status: {new_status}. Must be one of {', '.join(valid_statuses)}")
             return False
             
-        # Check if the order exists
-        cursor.execute('SELECT Status FROM Orders WHERE O_id LIKE %s LIMIT 1', (f"{order_id}%",))
+        # Check if the order exists, locking it so concurrent transitions of the
+        # same order apply their agent counter changes one at a time
+        cursor.execute('SELECT Status FROM OrderHeader WHERE OrderID = %s FOR UPDATE', (order_id,))
         existing_order = cursor.fetchone()
         if not existing_order:
+            db_manager.connection.rollback()
             st.error(f"Order {order_id} not found")
             return False
             
@@ -723,6 +2688,7 @@ def update_order_status(order_id, new_status, delivery_agent_phone=None):
         }
         
         if new_status not in valid_transitions.get(current_status, []):
+            db_manager.connection.rollback()
             st.error(f"Cannot change status from {current_status} to {new_status}")
             return False
             
@@ -732,28 +2698,38 @@ def update_order_status(order_id, new_status, delivery_agent_phone=None):
             cursor.execute('SELECT DA_Name, DA_Phone, DA_BikeNumber FROM DeliveryAgents WHERE DA_Phone = %s', (delivery_agent_phone,))
             delivery_agent_info = cursor.fetchone()
             if not delivery_agent_info:
+                db_manager.connection.rollback()
                 st.error("Delivery agent not found")
                 return False
             
-        # Update all order items with the same base order ID
+        # Status and agent live once on the header, so this is a single-row update
         if delivery_agent_info and new_status == "Shipped":
             cursor.execute('''
-                UPDATE Orders 
+                UPDATE OrderHeader 
                 SET Status = %s, 
                     DeliveryAgentName = %s, 
                     DeliveryAgentPhone = %s, 
                     DeliveryAgentBike = %s,
                     StatusUpdateTime = CURRENT_TIMESTAMP
-                WHERE O_id LIKE %s
-            ''', (new_status, delivery_agent_info[0], delivery_agent_info[1], delivery_agent_info[2], f"{order_id}%"))
+                WHERE OrderID = %s
+            ''', (new_status, delivery_agent_info[0], delivery_agent_info[1], delivery_agent_info[2], order_id))
         else:
             cursor.execute('''
-                UPDATE Orders 
+                UPDATE OrderHeader 
                 SET Status = %s,
                     StatusUpdateTime = CURRENT_TIMESTAMP
-                WHERE O_id LIKE %s
-            ''', (new_status, f"{order_id}%"))
+                WHERE OrderID = %s
+            ''', (new_status, order_id))
             
+        if new_status == "Delivered":
+            _rollup_order_delivered(cursor, order_id)
+            _record_delivery_time(cursor, order_id)
+        elif new_status == "Cancelled":
+            _rollup_order_demand(cursor, order_id, sign=-1)
+        if new_status in AGENT_STATS_DELTAS:
+            _record_agent_transition(cursor, order_id, new_status)
+        bump_data_version(cursor, DELIVERY_AGENTS_SCOPE)
+        _record_status_event(cursor, order_id, current_status)
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
@@ -768,47 +2744,73 @@ def update_order_status(order_id, new_status, delivery_agent_phone=None):
         return False
 
 def create_bill(customer_phone, bill_items):
+    """Write a Billing header and its Bill_Items in one transaction, returns the BillID."""
     try:
         cursor = db_manager.get_cursor()
-        if cursor:
-            # Calculate total amount
-            total_amount = 0
-            for item in bill_items:
-                drug_name = item['name']
-                quantity = item['quantity']
-                cursor.execute('''
-                    SELECT PricePerUnit 
-                    FROM Drug_Pricing dp 
-                    JOIN Drugs d ON dp.DrugID = d.D_id 
-                    WHERE d.D_Name = %s
-                ''', (drug_name,))
-                price = cursor.fetchone()
-                if price:
-                    total_amount += price[0] * quantity
-
-            # Insert bill
-            cursor.execute('''INSERT INTO Billing (CustomerPhone, BillDate, TotalAmount)
-                            VALUES (%s, NOW(), %s)''', (customer_phone, total_amount))
-            db_manager.commit()
-            return True
+        if not cursor:
+            return False
+
+        quantities = {}
+        for item in bill_items:
+            quantities[item['drug_id']] = quantities.get(item['drug_id'], 0) + item['quantity']
+        if not quantities:
+            st.error("Cannot create an empty bill")
+            return False
+
+        # Resolve every price in one round trip
+        placeholders = ", ".join(["%s"] * len(quantities))
+        cursor.execute(f'''
+            SELECT d.D_id, d.D_Name, dp.PricePerUnit
+            FROM Drugs d
+            JOIN Drug_Pricing dp ON dp.DrugID = d.D_id
+            WHERE d.D_id IN ({placeholders})
+        ''', tuple(quantities))
+        prices = {drug_id: (drug_name, price) for drug_id, drug_name, price in cursor.fetchall()}
+        missing = [drug_id for drug_id in quantities if drug_id not in prices]
+        if missing:
+            st.error(f"No price found for drug ID(s): {', '.join(str(drug_id) for drug_id in missing)}")
+            return False
+
+        lines = []
+        total_amount = 0
+        for drug_id, quantity in quantities.items():
+            drug_name, price = prices[drug_id]
+            subtotal = price * quantity
+            total_amount += subtotal
+            lines.append((drug_id, drug_name, quantity, price, subtotal))
+
+        cursor.execute('''INSERT INTO Billing (CustomerPhone, BillDate, TotalAmount)
+                        VALUES (%s, NOW(), %s)''', (customer_phone, total_amount))
+        bill_id = cursor.lastrowid
+        cursor.executemany('''INSERT INTO Bill_Items (BillID, DrugID, DrugName, Quantity, UnitPrice, Subtotal)
+                            VALUES (%s, %s, %s, %s, %s, %s)''',
+                           [(bill_id, *line) for line in lines])
+        _rollup_bill(cursor, total_amount)
+        db_manager.commit()
+        return bill_id
     except mysql.connector.Error as err:
         st.error(f"Error creating bill: {err}")
+        if db_manager.connection and db_manager.connection.is_connected():
+            db_manager.connection.rollback()
         return False
     except Exception as e:
         st.error(f"An unexpected error occurred: {str(e)}")
         return False
 
+# Served by idx_billing_customer_date
+CUSTOMER_BILLS_QUERY = '''
+    SELECT b.BillID, b.CustomerPhone, b.BillDate, b.TotalAmount
+    FROM Billing b
+    WHERE b.CustomerPhone = %s
+    ORDER BY b.BillDate DESC
+'''
+
 def view_bills(customer_phone=None):
     try:
         cursor = db_manager.get_cursor()
         if cursor:
             if customer_phone:
-                cursor.execute('''
-                    SELECT b.BillID, b.CustomerPhone, b.BillDate, b.TotalAmount
-                    FROM Billing b
-                    WHERE b.CustomerPhone = %s
-                    ORDER BY b.BillDate DESC
-                ''', (customer_phone,))
+                cursor.execute(CUSTOMER_BILLS_QUERY, (customer_phone,))
             else:
                 cursor.execute('''
                     SELECT b.BillID, b.CustomerPhone, b.BillDate, b.TotalAmount
@@ -823,6 +2825,87 @@ def view_bills(customer_phone=None):
         st.error(f"An unexpected error occurred: {str(e)}")
         return []
 
+# Reporting
+# Pharmacy Performance KPIs in one round trip, read from the sales rollups. The
+# date filters are half-open ranges on indexed columns, so each subquery reads
+# only the days or customers it counts. The bounds come from the server's
+# CURDATE(), the same "today" the rollups are keyed by.
+PERFORMANCE_KPI_QUERY = '''
+    SELECT (SELECT COUNT(*) FROM Customers) AS total_customers,
+           s.total_orders,
+           (SELECT COUNT(*) FROM CustomerOrderStats
+            WHERE LastOrderDate >= CURDATE()
+              AND LastOrderDate < CURDATE() + INTERVAL 1 DAY) AS today_active,
+           (SELECT COUNT(*) FROM CustomerOrderStats
+            WHERE LastOrderDate >= LAST_DAY(CURDATE() - INTERVAL 1 MONTH) + INTERVAL 1 DAY
+              AND LastOrderDate < LAST_DAY(CURDATE()) + INTERVAL 1 DAY) AS monthly_active,
+           (SELECT COUNT(*) FROM CustomerOrderStats WHERE OrderCount > 1) AS repeat_customers,
+           s.total_revenue, s.today_revenue, s.monthly_revenue
+    FROM (
+        SELECT COALESCE(SUM(OrderCount), 0) AS total_orders,
+               COALESCE(SUM(BillRevenue), 0) AS total_revenue,
+               COALESCE(SUM(CASE WHEN SalesDate >= CURDATE() AND SalesDate < CURDATE() + INTERVAL 1 DAY
+                                 THEN BillRevenue END), 0) AS today_revenue,
+               COALESCE(SUM(CASE WHEN SalesDate >= LAST_DAY(CURDATE() - INTERVAL 1 MONTH) + INTERVAL 1 DAY
+                                  AND SalesDate < LAST_DAY(CURDATE()) + INTERVAL 1 DAY
+                                 THEN BillRevenue END), 0) AS monthly_revenue
+        FROM SalesDaily
+    ) s
+'''
+
+# Last 6 months from SalesDaily, about 180 rows
+MONTHLY_TRENDS_QUERY = '''
+    SELECT 
+        DATE_FORMAT(SalesDate, '%Y-%m') as month,
+        SUM(BillCount) as order_count,
+        SUM(BillRevenue) as revenue
+    FROM SalesDaily
+    WHERE SalesDate >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)
+    GROUP BY DATE_FORMAT(SalesDate, '%Y-%m')
+    ORDER BY month
+'''
+
+TOP_DRUGS_QUERY = '''
+    SELECT 
+        d.D_Name,
+        s.DeliveredOrders,
+        s.DeliveredQuantity,
+        s.DeliveredRevenue
+    FROM SalesByDrug s
+    JOIN Drugs d ON d.D_id = s.D_id
+    ORDER BY s.DeliveredRevenue DESC
+    LIMIT 5
+'''
+
+# Both halves are index range scans: the stock gap on Drugs and the expiry
+# date on DrugLot (lots that are nearly out of date)
+INVENTORY_ALERTS_QUERY = '''
+    SELECT D_Name, D_Qty, D_ExpDate, ReorderPoint, 'Low Stock' AS alert_type, D_id, 1 AS priority
+    FROM Drugs
+    WHERE StockGap > 0
+    UNION ALL
+    SELECT d.D_Name, d.D_Qty, lot.ExpDate, d.ReorderPoint, 'Expiring Soon', d.D_id, 2
+    FROM (SELECT D_id, MIN(ExpDate) AS ExpDate FROM DrugLot
+          WHERE ExpDate <= DATE_ADD(CURDATE(), INTERVAL 30 DAY) AND Qty > 0
+          GROUP BY D_id) lot
+    JOIN Drugs d ON d.D_id = lot.D_id
+    WHERE d.StockGap <= 0
+    ORDER BY priority, D_Qty ASC, D_ExpDate ASC
+'''
+
+def get_performance_kpis():
+    """Dashboard KPIs as a dict keyed by the PERFORMANCE_KPI_QUERY columns, or None."""
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return None
+        cursor.execute(PERFORMANCE_KPI_QUERY)
+        row = cursor.fetchone()
+        return dict(zip(cursor.column_names, row))
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving performance metrics: {err}")
+        return None
+
 # Prescription functions
 def add_prescription(ssn, doctor_id, drugs_and_qtys):
     try:
@@ -837,64 +2920,102 @@ def add_prescription(ssn, doctor_id, drugs_and_qtys):
 
         presp_id = cursor.lastrowid
 
-        for drug_name, qty, refills in drugs_and_qtys:
+        for drug_id, qty, refills in drugs_and_qtys:
             cursor.execute('''INSERT INTO Prescription_Drug 
-                           (PrespID, DrugName, PrespQty, RefillLimit) 
+                           (PrespID, D_id, PrespQty, RefillLimit) 
                            VALUES (%s, %s, %s, %s)''', 
-                         (presp_id, drug_name, qty, refills))
+                         (presp_id, drug_id, qty, refills))
         db_manager.commit()
         return presp_id
     except mysql.connector.Error as err:
         st.error(f"Database Error: {err}")
         return None
 
+# Prescriptions joined to their drug lines, one row per line, ordered so the
+# lines of each prescription are adjacent for grouping
+PRESCRIPTION_LINES_QUERY = '''
+    SELECT p.PrespID, p.SSN, p.DocID, p.PrespDate,
+           COALESCE(d.D_Name, pd.DrugName), pd.PrespQty, pd.RefillLimit
+    FROM Prescription p
+    LEFT JOIN Prescription_Drug pd ON pd.PrespID = p.PrespID
+    LEFT JOIN Drugs d ON d.D_id = pd.D_id
+    {where}
+    ORDER BY p.PrespID
+'''
+
+def _group_prescription_lines(rows, ssn=None):
+    # Folds adjacent line rows into the view_prescriptions shape:
+    # (PrespID, DocID, PrespDate, drugs) for one SSN, else (PrespID, SSN, DocID, PrespDate, drugs)
+    for presp_id, lines in groupby(rows, key=lambda row: row[0]):
+        lines = list(lines)
+        first = lines[0]
+        drug_details = ", ".join(f"{line[4]} ({line[5]} tablets, {line[6]} refills)"
+                                 for line in lines if line[5] is not None)
+        if ssn:
+            yield (presp_id, first[2], first[3], drug_details)
+        else:
+            yield (presp_id, first[1], first[2], first[3], drug_details)
+
+def _prescription_lines_query(ssn):
+    if ssn:
+        return PRESCRIPTION_LINES_QUERY.format(where="WHERE p.SSN = %s"), (ssn,)
+    return PRESCRIPTION_LINES_QUERY.format(where=""), ()
+
 def view_prescriptions(ssn=None):
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
             return []
 
-        if ssn:
-            cursor.execute('''SELECT p.PrespID, p.DocID, p.PrespDate
-                            FROM Prescription p
-                            WHERE p.SSN = %s''', (ssn,))
-            prescriptions = cursor.fetchall()
-            result = []
-            for p in prescriptions:
-                cursor.execute('''SELECT DrugName, PrespQty, RefillLimit 
-                                FROM Prescription_Drug 
-                                WHERE PrespID = %s''', (p[0],))
-                drugs = cursor.fetchall()
-                drug_details = []
-                for drug in drugs:
-                    drug_details.append(f"{drug[0]} ({drug[1]} tablets, {drug[2]} refills)")
-                result.append((p[0], p[1], p[2], ", ".join(drug_details)))
-            return result
-        else:
-            cursor.execute('SELECT PrespID, SSN, DocID, PrespDate FROM Prescription')
-            prescriptions = cursor.fetchall()
-            result = []
-            for p in prescriptions:
-                cursor.execute('''SELECT DrugName, PrespQty, RefillLimit 
-                                FROM Prescription_Drug 
-                                WHERE PrespID = %s''', (p[0],))
-                drugs = cursor.fetchall()
-                drug_details = []
-                for drug in drugs:
-                    drug_details.append(f"{drug[0]} ({drug[1]} tablets, {drug[2]} refills)")
-                result.append((p[0], p[1], p[2], p[3], ", ".join(drug_details)))
-            return result
+        query, params = _prescription_lines_query(ssn)
+        cursor.execute(query, params)
+        return list(_group_prescription_lines(cursor.fetchall(), ssn))
     except mysql.connector.Error as err:
         st.error(f"Error retrieving prescriptions: {err}")
         return []
 
+def iter_prescriptions(ssn=None, batch_size=500):
+    """Streaming view_prescriptions: same rows, read batch_size lines at a time."""
+    cursor = db_manager.get_cursor()
+    if not cursor:
+        return
+    exhausted = False
+
+    def line_rows():
+        nonlocal exhausted
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                exhausted = True
+                return
+            yield from batch
+
+    try:
+        query, params = _prescription_lines_query(ssn)
+        cursor.execute(query, params)
+        yield from _group_prescription_lines(line_rows(), ssn)
+    except mysql.connector.Error as err:
+        st.error(f"Error retrieving prescriptions: {err}")
+    finally:
+        # The cursor is unbuffered, drain it if the caller stopped early so the
+        # connection can run the next statement
+        if not exhausted:
+            try:
+                while cursor.fetchmany(batch_size):
+                    pass
+            except mysql.connector.Error:
+                pass
+        cursor.close()
+
 # Authentication
+CUSTOMER_PASSWORD_QUERY = 'SELECT C_Password FROM Customers WHERE C_Name = %s'
+
 def get_authenticate(username, password):
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
             return False
-        cursor.execute('SELECT C_Password FROM Customers WHERE C_Name = %s', (username,))
+        cursor.execute(CUSTOMER_PASSWORD_QUERY, (username,))
         cust_password = cursor.fetchone()
         if cust_password:
             hashed_input_pass = hash_password(password)
@@ -938,6 +3059,17 @@ def update_customer_profile(username, ssn=None, insurance_id=None):
         return False
 
 # Customer Dashboard
+# Delivered order lines of one customer, for the Profile page
+CUSTOMER_DELIVERED_ORDERS_QUERY = '''
+    SELECT h.OrderID, d.D_Name, l.Quantity, h.Status, h.OrderDate,
+           h.DeliveryAddress, h.PaymentMethod, h.ContactNumber, l.UnitPrice, l.Subtotal
+    FROM OrderHeader h
+    JOIN OrderLine l ON l.OrderID = h.OrderID
+    LEFT JOIN Drugs d ON d.D_id = l.D_id
+    WHERE h.O_Name = %s AND h.Status = 'Delivered'
+    ORDER BY h.OrderDate DESC, h.OrderID DESC
+'''
+
 def customer_dashboard(username):
     # Initialize session state for cart
     if 'cart' not in st.session_state:
@@ -982,66 +3114,52 @@ def customer_dashboard(username):
             key="order_status_filter"
         )
         
-        order_data = order_view_all_data()
-        filtered_orders = [order for order in order_data if order[0] == username]
+        # Stack of keyset cursors, one per page visited; reset when the filter changes
+        if st.session_state.get('order_pages_filter') != status_filter:
+            st.session_state.order_pages_filter = status_filter
+            st.session_state.order_page_cursors = [None]
+        page_cursors = st.session_state.order_page_cursors
+        
+        filtered_orders, next_cursor = get_customer_orders(
+            username, None if status_filter == "All" else status_filter, page_cursors[-1])
         
         if filtered_orders:
-            # Group orders by base order ID
+            # Group order lines by order ID
             grouped_orders = {}
             for order in filtered_orders:
-                if len(order) <= 4:
-                    continue
-                    
-                order_name = order[0]
-                item_name = order[1]
+                item_name = order[1] or "Unknown drug"
                 quantity = order[2]
                 order_id = order[3]
-                status = order[4] if len(order) > 4 else "Placed"
-                address = order[5] if len(order) > 5 else ""
-                payment = order[6] if len(order) > 6 else ""
-                contact = order[7] if len(order) > 7 else ""
-                
-                # Extract base order ID (removing the drug ID suffix)
-                order_id_parts = order_id.split('_')
-                base_order_id = '_'.join(order_id_parts[:-1]) if len(order_id_parts) > 2 else order_id
-                
-                if status_filter != "All" and status != status_filter:
-                    continue
-                    
-                item_price = 0
-                try:
-                    cursor = db_manager.get_cursor()
-                    if cursor:
-                        cursor.execute('SELECT D_id FROM Drugs WHERE D_Name = %s', (item_name,))
-                        drug_id = cursor.fetchone()
-                        if drug_id:
-                            item_price = get_drug_price(drug_id[0])
-                except:
-                    pass
+                status = order[4]
+                address = order[5] or ""
+                payment = order[6] or ""
+                contact = order[7] or ""
                     
-                if base_order_id not in grouped_orders:
-                    grouped_orders[base_order_id] = {
+                if order_id not in grouped_orders:
+                    grouped_orders[order_id] = {
                         'items': [],
                         'status': status,
                         'address': address,
                         'payment': payment,
                         'contact': contact,
-                        'date': order[8] if len(order) > 8 else "Unknown date",
-                        'status_update_time': order[9] if len(order) > 9 else "Unknown",
+                        'date': order[8],
+                        'status_update_time': order[9],
                         'total': 0
                     }
                     
-                grouped_orders[base_order_id]['items'].append({
+                grouped_orders[order_id]['items'].append({
                     'name': item_name,
                     'quantity': quantity,
-                    'price': item_price,
-                    'subtotal': item_price * quantity
+                    'price': order[11],
+                    'subtotal': order[12]
                 })
-                grouped_orders[base_order_id]['total'] += item_price * quantity
+            
+            for order_id, total in get_order_totals(list(grouped_orders)).items():
+                grouped_orders[order_id]['total'] = total
                 
             # Display grouped orders
-            for base_order_id, order_info in grouped_orders.items():
-                with st.expander(f"Order #{base_order_id}"):
+            for order_id, order_info in grouped_orders.items():
+                with st.expander(f"Order #{order_id}"):
                     st.write(f"**Status:** {order_info['status']}")
                     st.write(f"**Date:** {order_info['date']}")
                     
@@ -1051,9 +3169,9 @@ def customer_dashboard(username):
                             if cursor:
                                 cursor.execute('''
                                     SELECT DeliveryAgentName, DeliveryAgentPhone, DeliveryAgentBike 
-                                    FROM Orders 
-                                    WHERE O_id LIKE %s LIMIT 1
-                                ''', (f"{base_order_id}%",))
+                                    FROM OrderHeader 
+                                    WHERE OrderID = %s
+                                ''', (order_id,))
                                 agent_info = cursor.fetchone()
                                 if agent_info:
                                     st.write("**Delivery Agent Information:**")
@@ -1075,8 +3193,18 @@ def customer_dashboard(username):
                     if order_info['payment']:
                         st.write(f"**Payment Method:** {order_info['payment']}")
                     
-                    if st.button("🔄 Refresh Order Status", key=f"refresh_{base_order_id}"):
+                    if st.button("🔄 Refresh Order Status", key=f"refresh_{order_id}"):
                         st.rerun()
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                if len(page_cursors) > 1 and st.button("⬅️ Newer orders", key="orders_newer"):
+                    page_cursors.pop()
+                    st.rerun()
+            with col2:
+                if next_cursor and st.button("Older orders ➡️", key="orders_older"):
+                    page_cursors.append(next_cursor)
+                    st.rerun()
         else:
             st.info("No orders found")
 
@@ -1103,30 +3231,41 @@ def customer_dashboard(username):
             cursor = db_manager.get_cursor()
             if cursor:
                 try:
-                    cursor.execute('SELECT D_Name FROM Drugs')
-                    available_drugs = [drug[0] for drug in cursor.fetchall()]
-                    
                     st.markdown("**Add your prescription medicines:**")
-                    col1, col2, col3 = st.columns([2, 1, 1])
-                    
-                    with col1:
-                        selected_drug = st.selectbox("Select Medicine", available_drugs, key="drug_select")
-                    with col2:
-                        quantity = st.number_input("Quantity", min_value=1, value=1, key="drug_qty")
-                    with col3:
-                        refills = st.number_input("Refills", min_value=0, value=1, key="drug_refills")
+                    medicine_search = st.text_input("Find medicine", key="drug_select_search",
+                                                    placeholder="Type a name, typos are fine")
+                    if medicine_search.strip():
+                        matches = search_drugs(medicine_search) or fuzzy_find_drugs(medicine_search)
+                    else:
+                        matches = drug_view_all_data()
+                    available_drugs = {drug[4]: drug[0] for drug in matches}
                     
                     if 'selected_medicines' not in st.session_state:
                         st.session_state.selected_medicines = []
                     
-                    if st.button("Add Medicine", key="add_medicine"):
-                        new_medicine = {
-                            'name': selected_drug,
-                            'quantity': quantity,
-                            'refills': refills
-                        }
-                        st.session_state.selected_medicines.append(new_medicine)
-                        st.rerun()
+                    if not available_drugs:
+                        st.info("No medicines match")
+                    else:
+                        col1, col2, col3 = st.columns([2, 1, 1])
+                        
+                        with col1:
+                            selected_drug = st.selectbox("Select Medicine", list(available_drugs),
+                                                         format_func=lambda drug_id: available_drugs[drug_id],
+                                                         key="drug_select")
+                        with col2:
+                            quantity = st.number_input("Quantity", min_value=1, value=1, key="drug_qty")
+                        with col3:
+                            refills = st.number_input("Refills", min_value=0, value=1, key="drug_refills")
+                        
+                        if st.button("Add Medicine", key="add_medicine") and selected_drug is not None:
+                            new_medicine = {
+                                'drug_id': selected_drug,
+                                'name': available_drugs[selected_drug],
+                                'quantity': quantity,
+                                'refills': refills
+                            }
+                            st.session_state.selected_medicines.append(new_medicine)
+                            st.rerun()
                     
                     if st.session_state.selected_medicines:
                         st.markdown("**Selected Medicines:**")
@@ -1153,7 +3292,7 @@ def customer_dashboard(username):
                                     drugs_and_qtys = []
                                     for med in st.session_state.selected_medicines:
                                         drugs_and_qtys.append((
-                                            med['name'],
+                                            med['drug_id'],
                                             med['quantity'],
                                             med['refills']
                                         ))
@@ -1179,7 +3318,11 @@ def customer_dashboard(username):
         if drugs:
             # Search functionality
             search_term = st.text_input("Search medicines", key="drug_search")
-            filtered_drugs = [drug for drug in drugs if search_term.lower() in drug[0].lower()]
+            filtered_drugs = search_drugs(search_term) if search_term.strip() else drugs
+            if search_term.strip() and not filtered_drugs:
+                filtered_drugs = fuzzy_find_drugs(search_term)
+                if filtered_drugs:
+                    st.info(f"No exact matches for '{search_term}', showing the closest names.")
             
             if filtered_drugs:
                 for drug in filtered_drugs:
@@ -1373,22 +3516,18 @@ def customer_dashboard(username):
                 if cursor:
                     # Get total orders
                     cursor.execute('''
-                        SELECT COUNT(DISTINCT O_id) 
-                        FROM Orders 
+                        SELECT COUNT(*) 
+                        FROM OrderHeader 
                         WHERE O_Name = %s
                     ''', (username,))
                     total_orders = cursor.fetchone()[0]
                     
                     # Get total spent
                     cursor.execute('''
-                        SELECT SUM(O_Qty * (
-                            SELECT PricePerUnit 
-                            FROM Drug_Pricing dp 
-                            JOIN Drugs d ON dp.DrugID = d.D_id 
-                            WHERE d.D_Name = O_Items
-                        ))
-                        FROM Orders 
-                        WHERE O_Name = %s
+                        SELECT SUM(l.Subtotal)
+                        FROM OrderHeader h
+                        JOIN OrderLine l ON l.OrderID = h.OrderID
+                        WHERE h.O_Name = %s
                     ''', (username,))
                     total_spent = cursor.fetchone()[0] or 0
                     
@@ -1403,33 +3542,24 @@ def customer_dashboard(username):
             cursor = db_manager.get_cursor()
             if cursor:
                 # Get all delivered orders
-                cursor.execute('''
-                    SELECT O_id, O_Items, O_Qty, Status, OrderDate, DeliveryAddress, PaymentMethod, ContactNumber
-                    FROM Orders 
-                    WHERE O_Name = %s AND Status = 'Delivered'
-                    ORDER BY OrderDate DESC
-                ''', (username,))
+                cursor.execute(CUSTOMER_DELIVERED_ORDERS_QUERY, (username,))
                 orders = cursor.fetchall()
                 
                 if orders:
-                    # Group orders by base order ID
+                    # Group order lines by order ID
                     grouped_orders = {}
                     for order in orders:
                         order_id = order[0]
-                        item_name = order[1]
+                        item_name = order[1] or "Unknown drug"
                         quantity = order[2]
                         status = order[3]
                         date = order[4]
-                        address = order[5] if len(order) > 5 else ""
-                        payment = order[6] if len(order) > 6 else ""
-                        contact = order[7] if len(order) > 7 else ""
+                        address = order[5] or ""
+                        payment = order[6] or ""
+                        contact = order[7] or ""
                         
-                        # Extract base order ID (removing the drug ID suffix)
-                        order_id_parts = order_id.split('_')
-                        base_order_id = '_'.join(order_id_parts[:-1]) if len(order_id_parts) > 2 else order_id
-                        
-                        if base_order_id not in grouped_orders:
-                            grouped_orders[base_order_id] = {
+                        if order_id not in grouped_orders:
+                            grouped_orders[order_id] = {
                                 'items': [],
                                 'status': status,
                                 'date': date,
@@ -1439,23 +3569,15 @@ def customer_dashboard(username):
                                 'total': 0
                             }
                         
-                        # Get drug price
-                        price = 0
-                        try:
-                            cursor.execute('SELECT D_id FROM Drugs WHERE D_Name = %s', (item_name,))
-                            drug_id = cursor.fetchone()
-                            if drug_id:
-                                price = get_drug_price(drug_id[0])
-                        except:
-                            pass
-                        
-                        grouped_orders[base_order_id]['items'].append({
+                        grouped_orders[order_id]['items'].append({
                             'name': item_name,
                             'quantity': quantity,
-                            'price': price,
-                            'subtotal': price * quantity
+                            'price': order[8],
+                            'subtotal': order[9]
                         })
-                        grouped_orders[base_order_id]['total'] += price * quantity
+                    
+                    for order_id, total in get_order_totals(list(grouped_orders)).items():
+                        grouped_orders[order_id]['total'] = total
                     
                     # Display orders
                     for order_id, order_info in grouped_orders.items():
@@ -1550,6 +3672,39 @@ def customer_dashboard(username):
                 st.error(f"Error loading insurance options: {err}")
 
 # Admin Panel
+def drug_id_picker(key, page_size=20):
+    """Admin drug chooser: type an ID, search by name, or page through IDs. Returns a D_id or None."""
+    term = st.text_input("Drug ID or name", key=f"{key}_drug_search").strip()
+    if term.isdigit():
+        return int(term)
+
+    if term:
+        matches = search_drugs(term, page_size) or fuzzy_find_drugs(term, limit=page_size)
+        options = [(drug[4], drug[0]) for drug in matches]
+        has_more = False
+    else:
+        # Keyset pages over the primary key, one cursor per page visited
+        page_cursors = st.session_state.setdefault(f"{key}_drug_pages", [0])
+        options, has_more = get_drug_id_page(page_cursors[-1], page_size)
+
+    if not options:
+        st.info("No drugs found")
+        return None
+    labels = {drug_id: f"{drug_name} (ID {drug_id})" for drug_id, drug_name in options}
+    choice = st.selectbox("Select Drug", list(labels), format_func=labels.get, key=f"{key}_drug_choice")
+
+    if not term:
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(page_cursors) > 1 and st.button("⬅️ Previous IDs", key=f"{key}_drug_prev"):
+                page_cursors.pop()
+                st.rerun()
+        with col2:
+            if has_more and st.button("Next IDs ➡️", key=f"{key}_drug_next"):
+                page_cursors.append(options[-1][0])
+                st.rerun()
+    return choice
+
 def admin_panel():
     st.title("Pharmacy Admin Panel")
     
@@ -1575,11 +3730,14 @@ def admin_panel():
                 quantity = st.number_input("Quantity", min_value=0)
                 drug_id = st.text_input("Drug ID")
                 price = st.number_input("Price per Unit", min_value=0.0, step=0.1)
+                reorder_point = st.number_input("Reorder Point", min_value=0, value=50)
+                lot_number = st.text_input("Lot Number (optional)")
                 
                 submitted = st.form_submit_button("Add Drug")
                 if submitted:
                     if drug_name and exp_date and drug_use and quantity and drug_id:
-                        drug_add_data(drug_name, exp_date, drug_use, quantity, drug_id, price)
+                        drug_add_data(drug_name, exp_date, drug_use, quantity, drug_id, price, reorder_point,
+                                      lot_number.strip() or None)
                         st.success("Drug added successfully")
                     else:
                         st.warning("Please fill all required fields")
@@ -1588,197 +3746,215 @@ def admin_panel():
             drugs = drug_view_all_data()
             if drugs:
                 st.write(pd.DataFrame(drugs, columns=["Name", "Expiry Date", "Usage", "Quantity", "ID", "Price"]))
+                
+                # The lots behind one drug's stock, in the order orders draw from them
+                st.subheader("Stock Lots")
+                lot_drug_id = drug_id_picker("lots")
+                if lot_drug_id is not None:
+                    lots = get_drug_lots(lot_drug_id)
+                    if lots:
+                        st.dataframe(pd.DataFrame([lot[1:] for lot in lots],
+                                                  columns=["Lot Number", "Expiry Date", "Quantity", "Received"]),
+                                     use_container_width=True)
+                    else:
+                        st.info("No lots in stock for this drug")
             else:
                 st.info("No drugs found")
         
         elif action == "Update":
             st.subheader("Update Drug")
-            drugs = drug_view_all_data()
-            if drugs:
-                # First, let user enter drug ID and show current values
-                drug_id = st.text_input("Enter Drug ID to Update")
-                
-                if drug_id:
-                    try:
-                        # Convert drug_id to string for comparison
-                        drug_id = str(drug_id).strip()
+            drug_id = drug_id_picker("update")
+            
+            if drug_id is not None:
+                try:
+                    selected_drug = get_drug(drug_id)
+                    
+                    if selected_drug:
+                        # Get current values
+                        current_use = selected_drug[2]  # Usage is at index 2
+                        current_price = selected_drug[5]  # Price is at index 5
                         
-                        # Find the drug with the entered ID
-                        selected_drug = None
-                        for drug in drugs:
-                            if str(drug[4]).strip() == drug_id:  # Convert drug ID to string for comparison
-                                selected_drug = drug
-                                break
+                        # Show current drug information
+                        st.write(f"**Drug Name:** {selected_drug[0]}")
+                        st.write("**Current Price:**", f"₹{current_price:.2f}" if current_price else "Not set")
+                        st.write("**Current Usage:**", current_use)
                         
-                        if selected_drug:
-                            # Get current values
-                            current_use = selected_drug[2]  # Usage is at index 2
-                            current_price = selected_drug[5] if len(selected_drug) > 5 else None  # Price is at index 5
+                        # Create a form for updates
+                        with st.form(key="update_drug_form"):
+                            # Create two columns for price and usage updates
+                            col1, col2 = st.columns(2)
                             
-                            # Show current drug information
-                            st.write(f"**Drug Name:** {selected_drug[0]}")
-                            st.write("**Current Price:**", f"₹{current_price:.2f}" if current_price else "Not set")
-                            st.write("**Current Usage:**", current_use)
+                            with col1:
+                                new_price = st.number_input("New Price (Optional)", 
+                                                          min_value=0.0, 
+                                                          step=0.1,
+                                                          value=float(current_price) if current_price else 0.0)
                             
-                            # Create a form for updates
-                            with st.form(key="update_drug_form"):
-                                # Create two columns for price and usage updates
-                                col1, col2 = st.columns(2)
-                                
-                                with col1:
-                                    new_price = st.number_input("New Price (Optional)", 
-                                                              min_value=0.0, 
-                                                              step=0.1,
-                                                              value=float(current_price) if current_price else 0.0)
-                                
-                                with col2:
-                                    new_use = st.text_area("New Usage Instructions (Optional)", 
-                                                         value=current_use)
-                                
-                                # Add a note about optional updates
-                                st.info("💡 You can update either price or usage, or both. Leave unchanged if no update needed.")
-                                
-                                # Submit button
-                                submitted = st.form_submit_button("Update Drug")
-                                
-                                if submitted:
-                                    try:
-                                        # Update usage if changed and not empty
-                                        if new_use and new_use != current_use:
-                                            drug_update(new_use, drug_id)
-                                        
-                                        # Update price if changed and not zero
-                                        if new_price > 0 and new_price != current_price:
-                                            update_drug_price(drug_id, new_price)
-                                        
-                                        st.success("Drug updated successfully!")
-                                        st.rerun()
-                                    except Exception as e:
-                                        st.error(f"Error updating drug: {str(e)}")
-                        else:
-                            st.error("❌ Drug ID not found. Please enter a valid Drug ID.")
-                            # Show available drug IDs for reference
-                            st.write("Available Drug IDs:")
-                            drug_list = [(drug[0], drug[4]) for drug in drugs]  # (name, id)
-                            st.write(pd.DataFrame(drug_list, columns=['Drug Name', 'Drug ID']))
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
-            else:
-                st.info("No drugs found")
+                            with col2:
+                                new_use = st.text_area("New Usage Instructions (Optional)", 
+                                                     value=current_use)
+                            
+                            # Add a note about optional updates
+                            st.info("💡 You can update either price or usage, or both. Leave unchanged if no update needed.")
+                            
+                            # Submit button
+                            submitted = st.form_submit_button("Update Drug")
+                            
+                            if submitted:
+                                try:
+                                    # Update usage if changed and not empty
+                                    if new_use and new_use != current_use:
+                                        drug_update(new_use, drug_id)
+                                    
+                                    # Update price if changed and not zero
+                                    if new_price > 0 and new_price != current_price:
+                                        update_drug_price(drug_id, new_price)
+                                    
+                                    st.success("Drug updated successfully!")
+                                    st.rerun()
+                                except Exception as e:
+                                    st.error(f"Error updating drug: {str(e)}")
+                    else:
+                        st.error("❌ Drug ID not found. Please enter a valid Drug ID.")
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
         
         elif action == "Delete":
             st.subheader("Delete Drug")
-            drugs = drug_view_all_data()
-            if drugs:
-                # First, let user enter drug ID and show information
-                drug_id = st.text_input("Enter Drug ID to Delete")
-                
-                if drug_id:
-                    try:
-                        # Convert drug_id to string for comparison
-                        drug_id = str(drug_id).strip()
+            drug_id = drug_id_picker("delete")
+            
+            if drug_id is not None:
+                try:
+                    selected_drug = get_drug(drug_id)
+                    
+                    if selected_drug:
+                        # Get current values
+                        current_use = selected_drug[2]  # Usage is at index 2
+                        current_price = selected_drug[5]  # Price is at index 5
                         
-                        # Find the drug with the entered ID
-                        selected_drug = None
-                        for drug in drugs:
-                            if str(drug[4]).strip() == drug_id:  # Convert drug ID to string for comparison
-                                selected_drug = drug
-                                break
+                        # Show drug information
+                        st.warning("⚠️ Please review the drug information before deletion:")
+                        st.write(f"**Drug Name:** {selected_drug[0]}")
+                        st.write("**Current Price:**", f"₹{current_price:.2f}" if current_price else "Not set")
+                        st.write("**Current Usage:**", current_use)
+                        st.write("**Current Stock:**", selected_drug[3])  # Quantity is at index 3
                         
-                        if selected_drug:
-                            # Get current values
-                            current_use = selected_drug[2]  # Usage is at index 2
-                            current_price = selected_drug[5] if len(selected_drug) > 5 else None  # Price is at index 5
+                        # Create a form for deletion confirmation
+                        with st.form(key="delete_drug_form"):
+                            # Add warning message
+                            st.error("⚠️ Warning: This action cannot be undone!")
                             
-                            # Show drug information
-                            st.warning("⚠️ Please review the drug information before deletion:")
-                            st.write(f"**Drug Name:** {selected_drug[0]}")
-                            st.write("**Current Price:**", f"₹{current_price:.2f}" if current_price else "Not set")
-                            st.write("**Current Usage:**", current_use)
-                            st.write("**Current Stock:**", selected_drug[3])  # Quantity is at index 3
+                            # Confirmation checkbox
+                            confirm_delete = st.checkbox("I understand this will permanently delete the drug and related records")
                             
-                            # Create a form for deletion confirmation
-                            with st.form(key="delete_drug_form"):
-                                # Add warning message
-                                st.error("⚠️ Warning: This action cannot be undone!")
-                                
-                                # Confirmation checkbox
-                                confirm_delete = st.checkbox("I understand this will permanently delete the drug and related records")
-                                
-                                # Submit button
-                                submitted = st.form_submit_button("Delete Drug")
-                                
-                                if submitted:
-                                    if confirm_delete:
-                                        try:
-                                            if drug_delete(drug_id):
-                                                st.success("Drug deleted successfully!")
-                                                st.rerun()
-                                            else:
-                                                st.error("Failed to delete drug. Please try again.")
-                                        except Exception as e:
-                                            st.error(f"Error deleting drug: {str(e)}")
-                                    else:
-                                        st.error("Please confirm deletion by checking the checkbox")
-                        else:
-                            st.error("❌ Drug ID not found. Please enter a valid Drug ID.")
-                            # Show available drug IDs for reference
-                            st.write("Available Drug IDs:")
-                            drug_list = [(drug[0], drug[4]) for drug in drugs]  # (name, id)
-                            st.write(pd.DataFrame(drug_list, columns=['Drug Name', 'Drug ID']))
-                    except Exception as e:
-                        st.error(f"Error: {str(e)}")
-            else:
-                st.info("No drugs found")
+                            # Submit button
+                            submitted = st.form_submit_button("Delete Drug")
+                            
+                            if submitted:
+                                if confirm_delete:
+                                    try:
+                                        if drug_delete(drug_id):
+                                            st.success("Drug deleted successfully!")
+                                            st.rerun()
+                                        else:
+                                            st.error("Failed to delete drug. Please try again.")
+                                    except Exception as e:
+                                        st.error(f"Error deleting drug: {str(e)}")
+                                else:
+                                    st.error("Please confirm deletion by checking the checkbox")
+                    else:
+                        st.error("❌ Drug ID not found. Please enter a valid Drug ID.")
+                except Exception as e:
+                    st.error(f"Error: {str(e)}")
         
         elif action == "Low Stock":
             st.subheader("Low Stock Drugs")
-            drugs = drug_view_all_data()
-            if drugs:
-                # Filter drugs with quantity less than 50
-                low_stock_drugs = [drug for drug in drugs if drug[3] < 50]
-                
-                if low_stock_drugs:
-                    # Create a DataFrame for better display
-                    low_stock_df = pd.DataFrame(low_stock_drugs, 
-                                             columns=['Drug Name', 'Expiry Date', 'Usage', 'Quantity', 'Drug ID', 'Price'])
+            # Stack of keyset cursors, one per page visited
+            if 'low_stock_pages' not in st.session_state:
+                st.session_state.low_stock_pages = [None]
+            page_cursors = st.session_state.low_stock_pages
+            low_stock_drugs, next_cursor = get_low_stock_drugs(page_cursors[-1])
+            suggestions = reorder_suggestions()
+            
+            if low_stock_drugs:
+                # One form restocks the whole page in a single transaction
+                with st.form(key="batch_restock_form"):
+                    header = st.columns([3, 1, 1, 1, 1, 1, 1])
+                    for col, label in zip(header, ["Drug", "Stock", "Price", "Suggested", "Add Quantity", "Lot Expiry", "Reorder Point"]):
+                        col.markdown(f"**{label}**")
                     
-                    # Add a "Restock" button for each drug
-                    for idx, drug in low_stock_df.iterrows():
-                        col1, col2, col3 = st.columns([3, 2, 1])
+                    restock_inputs = []
+                    for drug_name, quantity, reorder_point, drug_id, price, _ in low_stock_drugs:
+                        col1, col2, col3, col4, col5, col6, col7 = st.columns([3, 1, 1, 1, 1, 1, 1])
                         with col1:
-                            st.write(f"**{drug['Drug Name']}**")
-                            st.write(f"Current Stock: {drug['Quantity']}")
+                            st.write(f"**{drug_name}** (ID {drug_id})")
                         with col2:
-                            # Create a form for each drug's restock
-                            with st.form(key=f"restock_form_{drug['Drug ID']}"):
-                                new_quantity = st.number_input(
-                                    "Add Quantity",
-                                    min_value=1,
-                                    max_value=1000,
-                                    value=50,
-                                    key=f"quantity_{drug['Drug ID']}"
-                                )
-                                submitted = st.form_submit_button("Quick Restock")
-                                if submitted:
-                                    try:
-                                        # Calculate total new quantity
-                                        total_quantity = drug['Quantity'] + new_quantity
-                                        # Update the drug quantity
-                                        if update_drug_quantity(drug['Drug ID'], total_quantity):
-                                            st.success(f"Successfully restocked {drug['Drug Name']} with {new_quantity} units!")
-                                            st.rerun()
-                                        else:
-                                            st.error("Failed to update quantity. Please try again.")
-                                    except Exception as e:
-                                        st.error(f"Error updating quantity: {str(e)}")
+                            st.write(f"{quantity} / {reorder_point}")
                         with col3:
-                            st.write(f"₹{drug['Price']:.2f}")
-                        st.markdown("---")
-                else:
-                    st.success("🎉 All drugs are well stocked! No low stock items.")
+                            st.write(f"₹{price:.2f}" if price is not None else "Not set")
+                        with col4:
+                            if suggestions is not None and drug_id in suggestions.index:
+                                suggestion = suggestions.loc[drug_id]
+                                cover = suggestion['days_of_cover']
+                                st.write(f"+{suggestion['reorder_qty']}")
+                                st.caption(f"{cover:.0f} days of cover" if np.isfinite(cover) else "No recent sales")
+                            else:
+                                st.write("-")
+                        with col5:
+                            added = st.number_input("Add Quantity", min_value=0, max_value=100000,
+                                                    value=0, key=f"restock_qty_{drug_id}",
+                                                    label_visibility="collapsed")
+                        with col6:
+                            lot_expiry = st.date_input("Lot Expiry", value=datetime.now().date() + timedelta(days=365),
+                                                       key=f"restock_expiry_{drug_id}",
+                                                       label_visibility="collapsed")
+                        with col7:
+                            new_reorder_point = st.number_input("Reorder Point", min_value=0,
+                                                                value=reorder_point, key=f"reorder_point_{drug_id}",
+                                                                label_visibility="collapsed")
+                        if added or new_reorder_point != reorder_point:
+                            restock_inputs.append((drug_id, added, new_reorder_point, lot_expiry))
+                    
+                    submitted = st.form_submit_button("Restock Selected")
+                    if submitted:
+                        if not restock_inputs:
+                            st.warning("Nothing to restock")
+                        elif restock_drugs(restock_inputs):
+                            st.success(f"Restocked {len(restock_inputs)} drug(s)")
+                            st.session_state.low_stock_pages = [None]
+                            st.rerun()
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if len(page_cursors) > 1 and st.button("⬅️ Previous page", key="low_stock_prev"):
+                        page_cursors.pop()
+                        st.rerun()
+                with col2:
+                    if next_cursor and st.button("Next page ➡️", key="low_stock_next"):
+                        page_cursors.append(next_cursor)
+                        st.rerun()
+            elif len(page_cursors) > 1:
+                st.session_state.low_stock_pages = [None]
+                st.rerun()
             else:
-                st.info("No drugs found")
+                st.success("🎉 All drugs are well stocked! No low stock items.")
+            
+            # Drugs whose forecast demand runs past current stock, whatever their reorder point
+            if suggestions is not None:
+                at_risk = suggestions[suggestions['reorder_qty'] > 0]
+                st.subheader("Forecast Reorder Suggestions")
+                st.caption(f"Covers {FORECAST_LEAD_TIME_DAYS} days lead time plus {FORECAST_REVIEW_DAYS} days "
+                           f"until the next review, based on the last {FORECAST_HISTORY_DAYS} days of orders.")
+                if at_risk.empty:
+                    st.success("Current stock covers forecast demand for every drug.")
+                else:
+                    st.dataframe(
+                        at_risk.head(50)[['D_Name', 'D_Qty', 'velocity', 'days_of_cover', 'safety_stock', 'reorder_qty']]
+                        .rename(columns={'D_Name': 'Drug', 'D_Qty': 'Stock', 'velocity': 'Units/Day',
+                                         'days_of_cover': 'Days of Cover', 'safety_stock': 'Safety Stock',
+                                         'reorder_qty': 'Suggested Reorder'})
+                        .round(1),
+                        use_container_width=True)
 
     elif admin_choice == "Customers":
         st.header("Customer Management")
@@ -1871,25 +4047,19 @@ def admin_panel():
                         key="admin_order_date_filter"
                     )
                 
-                # Get all orders grouped by base order ID
-                orders = order_view_all_data()
+                # Get all order lines, grouped by order ID below
+                orders = order_view_all_data(None if status_filter == "All" else status_filter)
                 
                 if orders:
-                    # Group orders by their base ID (removing the drug-specific suffix)
                     grouped_orders = {}
                     for order in orders:
-                        if len(order) < 4:  # Skip incomplete orders
-                            continue
-                        
-                        # Extract base order ID (removing the drug ID suffix)
-                        order_id_parts = order[3].split('_')
-                        base_order_id = '_'.join(order_id_parts[:-1]) if len(order_id_parts) > 2 else order[3]
+                        order_id = order[3]
                         
                         # Get the status of the order
-                        status = order[4] if len(order) > 4 else "Placed"
+                        status = order[4]
                         
                         # Get order date
-                        order_date = order[8] if len(order) > 8 else None
+                        order_date = order[8]
                         
                         # Skip if filtered by status and doesn't match
                         if status_filter != "All" and status != status_filter:
@@ -1901,37 +4071,29 @@ def admin_panel():
                             if order_date != date_filter:
                                 continue
                         
-                        if base_order_id not in grouped_orders:
-                            grouped_orders[base_order_id] = {
+                        if order_id not in grouped_orders:
+                            grouped_orders[order_id] = {
                                 'customer': order[0],
                                 'items': [],
                                 'status': status,
-                                'address': order[5] if len(order) > 5 else "",
-                                'payment': order[6] if len(order) > 6 else "",
-                                'contact': order[7] if len(order) > 7 else "",
-                                'date': order[8] if len(order) > 8 else "Unknown",
-                                'status_update_time': order[9] if len(order) > 9 else "Unknown",
+                                'address': order[5] or "",
+                                'payment': order[6] or "",
+                                'contact': order[7] or "",
+                                'date': order[8],
+                                'status_update_time': order[9],
                                 'total': 0
                             }
                         
-                        # Get drug price for this item
-                        price = 0
-                        try:
-                            cursor.execute('SELECT D_id FROM Drugs WHERE D_Name = %s', (order[1],))
-                            drug_id = cursor.fetchone()
-                            if drug_id:
-                                price = get_drug_price(drug_id[0])
-                        except:
-                            pass
-                        
-                        # Add item to the order group
-                        grouped_orders[base_order_id]['items'].append({
-                            'name': order[1],
+                        # Add item to the order group, priced as it was at checkout
+                        grouped_orders[order_id]['items'].append({
+                            'name': order[1] or "Unknown drug",
                             'quantity': order[2],
-                            'price': price,
-                            'subtotal': price * order[2]
+                            'price': order[11],
+                            'subtotal': order[12]
                         })
-                        grouped_orders[base_order_id]['total'] += price * order[2]
+                    
+                    for order_id, total in get_order_totals(list(grouped_orders)).items():
+                        grouped_orders[order_id]['total'] = total
                     
                     # Display each order in an expandable section
                     for order_id, order_data in sorted(grouped_orders.items(), key=lambda x: x[1]['date'], reverse=True):
@@ -2003,10 +4165,10 @@ def admin_panel():
 
     elif admin_choice == "Prescriptions":
         st.header("Prescription Management")
-        prescriptions = view_prescriptions()
-        if prescriptions:
-            st.write(pd.DataFrame(prescriptions, 
-                                columns=["ID", "Patient SSN", "Doctor ID", "Date", "Medications"]))
+        prescriptions = pd.DataFrame.from_records(iter_prescriptions(),
+                                                  columns=["ID", "Patient SSN", "Doctor ID", "Date", "Medications"])
+        if not prescriptions.empty:
+            st.write(prescriptions)
         else:
             st.info("No prescriptions found")
 
@@ -2109,94 +4271,41 @@ def admin_panel():
                     # 1. Key Performance Metrics
                     st.subheader("📈 Key Performance Metrics")
                     
-                    # Get current date and time
-                    current_date = datetime.now().date()
-                    current_month = current_date.month
-                    current_year = current_date.year
-                    
-                    # Get total customers
-                    cursor.execute('SELECT COUNT(*) FROM Customers')
-                    total_customers = cursor.fetchone()[0]
-                    cursor.fetchall()  # Clear any remaining results
-                    
-                    # Get today's active customers
-                    cursor.execute('''
-                        SELECT COUNT(DISTINCT O_Name) 
-                        FROM Orders 
-                        WHERE DATE(OrderDate) = CURDATE()
-                    ''')
-                    today_active = cursor.fetchone()[0]
-                    cursor.fetchall()  # Clear any remaining results
-                    
-                    # Get monthly active customers
-                    cursor.execute('''
-                        SELECT COUNT(DISTINCT O_Name) 
-                        FROM Orders 
-                        WHERE MONTH(OrderDate) = MONTH(CURDATE()) 
-                        AND YEAR(OrderDate) = YEAR(CURDATE())
-                    ''')
-                    monthly_active = cursor.fetchone()[0]
-                    cursor.fetchall()  # Clear any remaining results
-                    
-                    # Get revenue metrics
-                    cursor.execute('SELECT SUM(TotalAmount) FROM Billing')
-                    total_revenue = cursor.fetchone()[0] or 0
-                    cursor.fetchall()  # Clear any remaining results
-                    
-                    cursor.execute('''
-                        SELECT SUM(TotalAmount) 
-                        FROM Billing 
-                        WHERE DATE(BillDate) = CURDATE()
-                    ''')
-                    today_revenue = cursor.fetchone()[0] or 0
-                    cursor.fetchall()  # Clear any remaining results
-                    
-                    cursor.execute('''
-                        SELECT SUM(TotalAmount) 
-                        FROM Billing 
-                        WHERE MONTH(BillDate) = MONTH(CURDATE()) 
-                        AND YEAR(BillDate) = YEAR(CURDATE())
-                    ''')
-                    monthly_revenue = cursor.fetchone()[0] or 0
-                    cursor.fetchall()  # Clear any remaining results
+                    # Time spent in the database for this render, reported at the bottom
+                    query_seconds = 0.0
+                    start = time.perf_counter()
+                    kpis = get_performance_kpis()
+                    query_seconds += time.perf_counter() - start
+                    if kpis is None:
+                        return
+                    total_customers = kpis['total_customers']
                     
                     # Display metrics in a grid
                     col1, col2, col3 = st.columns(3)
                     
                     with col1:
                         st.metric("👥 Total Customers", total_customers)
-                        st.metric("📊 Today's Active", today_active)
-                        st.metric("📈 Monthly Active", monthly_active)
+                        st.metric("📊 Today's Active", kpis['today_active'])
+                        st.metric("📈 Monthly Active", kpis['monthly_active'])
                     
                     with col2:
-                        st.metric("💰 Total Revenue", f"₹{total_revenue:,.2f}")
-                        st.metric("💵 Today's Revenue", f"₹{today_revenue:,.2f}")
-                        st.metric("📊 Monthly Revenue", f"₹{monthly_revenue:,.2f}")
+                        st.metric("💰 Total Revenue", f"₹{kpis['total_revenue']:,.2f}")
+                        st.metric("💵 Today's Revenue", f"₹{kpis['today_revenue']:,.2f}")
+                        st.metric("📊 Monthly Revenue", f"₹{kpis['monthly_revenue']:,.2f}")
                     
                     with col3:
                         # Calculate and display average order value
-                        cursor.execute('SELECT COUNT(*) FROM Orders')
-                        total_orders = cursor.fetchone()[0] or 1
-                        cursor.fetchall()  # Clear any remaining results
-                        avg_order_value = total_revenue / total_orders
+                        avg_order_value = kpis['total_revenue'] / (kpis['total_orders'] or 1)
                         st.metric("💎 Average Order Value", f"₹{avg_order_value:,.2f}")
                         
                         # Calculate conversion rate
                         if total_customers > 0:
-                            conversion_rate = (monthly_active / total_customers) * 100
+                            conversion_rate = (kpis['monthly_active'] / total_customers) * 100
                             st.metric("🔄 Monthly Conversion", f"{conversion_rate:.1f}%")
                         
                         # Calculate repeat customer rate
-                        cursor.execute('''
-                            SELECT COUNT(DISTINCT O_Name) 
-                            FROM Orders 
-                            GROUP BY O_Name 
-                            HAVING COUNT(*) > 1
-                        ''')
-                        repeat_customers = cursor.fetchone()[0] or 0
-                        cursor.fetchall()  # Clear any remaining results
                         if total_customers > 0:
-                            repeat_rate = (repeat_customers / total_customers) * 100
+                            repeat_rate = (kpis['repeat_customers'] / total_customers) * 100
                             st.metric("🔄 Repeat Rate", f"{repeat_rate:.1f}%")
                     
                     st.markdown("---")
@@ -2204,18 +4313,10 @@ def admin_panel():
                     # 2. Monthly Revenue & Orders Trend
                     st.subheader("📊 Monthly Trends")
                     
-                    # Get last 6 months data
-                    cursor.execute('''
-                        SELECT 
-                            DATE_FORMAT(BillDate, '%Y-%m') as month,
-                            COUNT(DISTINCT b.BillID) as order_count,
-                            SUM(b.TotalAmount) as revenue
-                        FROM Billing b
-                        WHERE BillDate >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)
-                        GROUP BY DATE_FORMAT(BillDate, '%Y-%m')
-                        ORDER BY month
-                    ''')
+                    start = time.perf_counter()
+                    cursor.execute(MONTHLY_TRENDS_QUERY)
                     monthly_data = cursor.fetchall()
+                    query_seconds += time.perf_counter() - start
                     
                     if monthly_data:
                         # Create DataFrame for the chart
@@ -2239,21 +4340,10 @@ def admin_panel():
                     # 3. Top Performing Drugs
                     st.subheader("💊 Top Performing Drugs")
                     
-                    cursor.execute('''
-                        SELECT 
-                            d.D_Name,
-                            COUNT(DISTINCT o.O_id) as order_count,
-                            SUM(o.O_Qty) as total_quantity,
-                            COALESCE(SUM(o.O_Qty * dp.PricePerUnit), 0) as total_revenue
-                        FROM Drugs d
-                        JOIN Orders o ON d.D_Name = o.O_Items
-                        JOIN Drug_Pricing dp ON d.D_id = dp.DrugID
-                        WHERE o.Status = 'Delivered'
-                        GROUP BY d.D_Name
-                        ORDER BY total_revenue DESC
-                        LIMIT 5
-                    ''')
+                    start = time.perf_counter()
+                    cursor.execute(TOP_DRUGS_QUERY)
                     top_drugs = cursor.fetchall()
+                    query_seconds += time.perf_counter() - start
                     
                     if top_drugs:
                         df_top_drugs = pd.DataFrame(top_drugs, 
@@ -2266,38 +4356,83 @@ def admin_panel():
                     # 4. Inventory Alerts
                     st.subheader("⚠️ Inventory Alerts")
                     
-                    cursor.execute('''
-                        SELECT 
-                            D_Name,
-                            D_Qty,
-                            D_ExpDate,
-                            CASE 
-                                WHEN D_Qty < 50 THEN 'Low Stock'
-                                WHEN D_ExpDate <= DATE_ADD(CURDATE(), INTERVAL 30 DAY) THEN 'Expiring Soon'
-                                ELSE 'Normal'
-                            END as alert_type
-                        FROM Drugs
-                        WHERE D_Qty < 50 OR D_ExpDate <= DATE_ADD(CURDATE(), INTERVAL 30 DAY)
-                        ORDER BY 
-                            CASE 
-                                WHEN D_Qty < 50 THEN 1
-                                WHEN D_ExpDate <= DATE_ADD(CURDATE(), INTERVAL 30 DAY) THEN 2
-                                ELSE 3
-                            END,
-                            D_Qty ASC,
-                            D_ExpDate ASC
-                    ''')
-                    inventory_alerts = cursor.fetchall()
+                    start = time.perf_counter()
+                    cursor.execute(INVENTORY_ALERTS_QUERY)
+                    inventory_alerts = [row[:6] for row in cursor.fetchall()]
+                    query_seconds += time.perf_counter() - start
+                    df_alerts = pd.DataFrame(inventory_alerts, 
+                                           columns=['Drug Name', 'Current Stock', 'Expiry Date', 'Reorder Point', 'Alert Type', 'D_id'])
                     
-                    if inventory_alerts:
-                        df_alerts = pd.DataFrame(inventory_alerts, 
-                                               columns=['Drug Name', 'Current Stock', 'Expiry Date', 'Alert Type'])
-                        st.dataframe(df_alerts, use_container_width=True)
+                    # Forecast cover for the alerted drugs, plus drugs that will run out
+                    # within the lead time even though they are above their reorder point
+                    suggestions = reorder_suggestions()
+                    if suggestions is not None:
+                        at_risk = suggestions[(suggestions['days_of_cover'] < FORECAST_LEAD_TIME_DAYS)
+                                              & ~suggestions.index.isin(df_alerts['D_id'])]
+                        catalog = get_drug_catalog()
+                        df_risk = pd.DataFrame({
+                            'Drug Name': at_risk['D_Name'],
+                            'Current Stock': at_risk['D_Qty'],
+                            'Expiry Date': [catalog.get(drug_id)[1] for drug_id in at_risk.index],
+                            'Alert Type': 'Stockout Risk',
+                            'D_id': at_risk.index,
+                        })
+                        df_alerts = pd.concat([df_alerts, df_risk], ignore_index=True)
+                        cover = suggestions.reindex(df_alerts['D_id'])
+                        df_alerts['Days of Cover'] = cover['days_of_cover'].round(1).to_numpy()
+                        df_alerts['Suggested Reorder'] = cover['reorder_qty'].to_numpy()
+                    
+                    if not df_alerts.empty:
+                        st.dataframe(df_alerts.drop(columns='D_id'), use_container_width=True)
                     else:
                         st.success("✅ No inventory alerts at this time")
                     
+                    st.markdown("---")
+                    
+                    # 5. Order Stage Latency
+                    st.subheader("⏳ Order Stage Latency")
+                    
+                    start = time.perf_counter()
+                    # Kept up to date by `python file.py consume-events`
+                    stages = get_stage_latency(cursor)
+                    pending_events = pending_status_events(cursor)
+                    query_seconds += time.perf_counter() - start
+                    
+                    if stages:
+                        df_stages = pd.DataFrame(stages, columns=['From', 'To', 'Transitions', 'Avg (mins)',
+                                                                  'P50 (mins)', 'P90 (mins)', 'Max (mins)'])
+                        df_stages.insert(0, 'Stage', df_stages.pop('From') + " → " + df_stages.pop('To'))
+                        st.dataframe(df_stages.round(1), use_container_width=True)
+                        
+                        # Cancellations end an order rather than move it along
+                        forward = df_stages[~df_stages['Stage'].str.endswith("Cancelled")]
+                        if not forward.empty:
+                            slowest = forward.loc[forward['Avg (mins)'].idxmax()]
+                            st.warning(f"🐢 Bottleneck: {slowest['Stage']} takes {slowest['Avg (mins)']:.1f} mins "
+                                       f"on average (P90 {slowest['P90 (mins)']:.1f} mins)")
+                    else:
+                        st.info("No status changes recorded yet")
+                    if pending_events:
+                        st.caption(f"{pending_events} status changes are waiting for `python file.py consume-events`")
+                    
+                    st.markdown("---")
+                    
+                    # 6. Database Connections (this server process's pool)
+                    st.subheader("🔌 Database Connections")
+                    
+                    pool = db_manager.pool_stats()
+                    col1, col2, col3, col4 = st.columns(4)
+                    col1.metric("Pool Size", pool['pool_size'])
+                    col2.metric("In Use", pool['in_use'], help=f"{pool['open']} open, {pool['idle']} idle")
+                    col3.metric("Checkouts", pool['checkouts'])
+                    col4.metric("Waits", pool['waits'], help=f"{pool['wait_time_ms']:,.1f} ms spent waiting")
+                    if pool['waits']:
+                        st.caption("Sessions had to wait for a free connection; "
+                                   "consider raising PHARMACY_DB_POOL_SIZE")
+                    
                     # Add refresh button at the bottom
                     st.markdown("---")
+                    st.caption(f"⏱️ Dashboard queries took {query_seconds * 1000:.1f} ms")
                     if st.button("🔄 Refresh Dashboard"):
                         st.rerun()
                         
@@ -2311,168 +4446,134 @@ def admin_panel():
 
     elif admin_choice == "Delivery Agents":
         st.title("🚚 Delivery Agent Management")
+        refresh_seconds = st.selectbox("🔄 Auto-refresh", [0, 10, 30, 60, 300], index=2,
+                                       format_func=lambda seconds: f"Every {seconds} seconds" if seconds else "Off")
         
-        try:
-            cursor = db_manager.get_cursor()
-            if cursor:
-                # Overall Delivery Agent Metrics
-                st.subheader("📊 Overall Delivery Agent Metrics")
-                
-                # Get overall statistics
-                cursor.execute('''
-                    SELECT 
-                        COUNT(DISTINCT da.DA_Phone) as total_agents,
-                        COUNT(DISTINCT CASE WHEN o.Status = 'Delivered' THEN o.O_id END) as successful_deliveries,
-                        AVG(TIMESTAMPDIFF(MINUTE, o.OrderDate, o.StatusUpdateTime)) as avg_delivery_time,
-                        COUNT(DISTINCT CASE WHEN o.Status IN ('Placed', 'Confirmed', 'Shipped') THEN o.O_id END) as active_deliveries,
-                        COALESCE(SUM(
-                            CASE 
-                                WHEN o.Status = 'Delivered' 
-                                THEN o.O_Qty * (
-                                    SELECT PricePerUnit 
-                                    FROM Drug_Pricing dp 
-                                    JOIN Drugs d ON dp.DrugID = d.D_id 
-                                    WHERE d.D_Name = o.O_Items
-                                )
-                                ELSE 0 
-                            END
-                        ), 0) as total_revenue
-                    FROM DeliveryAgents da
-                    LEFT JOIN Orders o ON da.DA_Phone = o.DeliveryAgentPhone
-                ''')
-                overall_stats = cursor.fetchone()
-                
-                # Display metrics in cards
-                col1, col2, col3, col4, col5 = st.columns(5)
-                with col1:
-                    st.metric("👥 Total Agents", int(overall_stats[0] or 0))
-                with col2:
-                    st.metric("✅ Successful Deliveries", int(overall_stats[1] or 0))
-                with col3:
-                    avg_time = int(overall_stats[2] or 0)
-                    st.metric("⏱️ Avg Delivery Time", f"{avg_time} mins")
-                with col4:
-                    st.metric("📦 Active Deliveries", int(overall_stats[3] or 0))
-                with col5:
-                    revenue = float(overall_stats[4] or 0)
-                    st.metric("💰 Total Revenue", f"₹{revenue:,.2f}")
-
-                # Live Delivery Agent Status Board
-                st.subheader("📦 Live Delivery Agent Status")
-                
-                # Get agent statuses
-                cursor.execute('''
-                    SELECT 
-                        da.DA_Name,
-                        da.DA_Phone,
-                        da.DA_BikeNumber,
-                        da.DA_Status,
-                        o.O_id as current_order
-                    FROM DeliveryAgents da
-                    LEFT JOIN Orders o ON da.DA_Phone = o.DeliveryAgentPhone 
-                        AND o.Status IN ('Placed', 'Confirmed', 'Shipped')
-                ''')
-                agent_statuses = cursor.fetchall()
-                
-                # Create three columns for different statuses
-                col1, col2, col3 = st.columns(3)
-                
-                # Available Agents
-                with col1:
-                    st.markdown("### 🟢 Available")
-                    available_agents = [a for a in agent_statuses if a[3] == 'Available']
-                    if available_agents:
-                        for agent in available_agents:
-                            with st.expander(f"🚚 {agent[0]}"):
-                                st.write(f"**Phone:** {agent[1]}")
-                                st.write(f"**Bike:** {agent[2]}")
-                                if agent[4]:
-                                    st.write(f"**Current Order:** {agent[4]}")
-                    else:
-                        st.info("No available agents")
-                
-                # Busy Agents
-                with col2:
-                    st.markdown("### 🟠 Busy")
-                    busy_agents = [a for a in agent_statuses if a[3] == 'Busy']
-                    if busy_agents:
-                        for agent in busy_agents:
-                            with st.expander(f"🚚 {agent[0]}"):
-                                st.write(f"**Phone:** {agent[1]}")
-                                st.write(f"**Bike:** {agent[2]}")
-                                if agent[4]:
-                                    st.write(f"**Current Order:** {agent[4]}")
-                    else:
-                        st.info("No busy agents")
-                
-                # Offline Agents
-                with col3:
-                    st.markdown("### 🔴 Offline")
-                    offline_agents = [a for a in agent_statuses if a[3] == 'Offline']
-                    if offline_agents:
-                        for agent in offline_agents:
-                            with st.expander(f"🚚 {agent[0]}"):
-                                st.write(f"**Phone:** {agent[1]}")
-                                st.write(f"**Bike:** {agent[2]}")
-                                if agent[4]:
-                                    st.write(f"**Current Order:** {agent[4]}")
-                    else:
-                        st.info("No offline agents")
+        # The board reruns on its own as a fragment, so no script thread sleeps
+        # between refreshes. Each tick is one DataVersion lookup, the board is
+        # only queried again when a delivery write bumped the version.
+        @st.fragment(run_every=refresh_seconds or None)
+        def delivery_agent_board():
+            with db_manager.lease():
+                version = get_data_version(DELIVERY_AGENTS_SCOPE)
+                cached = st.session_state.get('delivery_agent_board')
+                if cached is None or version is None or cached[0] != version:
+                    board = get_delivery_agent_board()
+                    if board is None:
+                        return
+                    cached = st.session_state.delivery_agent_board = (version, board)
+            overall_stats, agent_statuses, agent_performance, delivery_percentiles = cached[1]
+            
+            # Overall Delivery Agent Metrics
+            st.subheader("📊 Overall Delivery Agent Metrics")
+            
+            # Display metrics in cards
+            col1, col2, col3, col4, col5 = st.columns(5)
+            with col1:
+                st.metric("👥 Total Agents", int(overall_stats[0] or 0))
+            with col2:
+                st.metric("✅ Successful Deliveries", int(overall_stats[1] or 0))
+            with col3:
+                avg_time = int(overall_stats[2] or 0)
+                st.metric("⏱️ Avg Delivery Time", f"{avg_time} mins")
+            with col4:
+                st.metric("📦 Active Deliveries", int(overall_stats[3] or 0))
+            with col5:
+                revenue = float(overall_stats[4] or 0)
+                st.metric("💰 Total Revenue", f"₹{revenue:,.2f}")
+            
+            # Delivery time percentiles across all agents
+            deliveries, overall_percentiles = delivery_percentiles[None]
+            if deliveries:
+                for col, q, minutes in zip(st.columns(len(DELIVERY_PERCENTILES)), DELIVERY_PERCENTILES, overall_percentiles):
+                    col.metric(f"⏱️ P{round(q * 100)} Delivery Time", f"{minutes:.0f} mins")
 
-                # Individual Agent Performance Table
-                st.subheader("👤 Individual Agent Performance")
-                
-                cursor.execute('''
-                    SELECT 
-                        da.DA_Name,
-                        da.DA_Phone,
-                        da.DA_BikeNumber,
-                        da.DA_Status,
-                        COUNT(DISTINCT o.O_id) as total_deliveries,
-                        COUNT(DISTINCT CASE WHEN o.Status = 'Delivered' THEN o.O_id END) as successful_deliveries,
-                        COUNT(DISTINCT CASE WHEN o.Status = 'Cancelled' THEN o.O_id END) as cancelled_deliveries,
-                        AVG(TIMESTAMPDIFF(MINUTE, o.OrderDate, o.StatusUpdateTime)) as avg_delivery_time
-                    FROM DeliveryAgents da
-                    LEFT JOIN Orders o ON da.DA_Phone = o.DeliveryAgentPhone
-                    GROUP BY da.DA_Phone, da.DA_Name, da.DA_BikeNumber, da.DA_Status
-                    ORDER BY total_deliveries DESC
-                ''')
-                agent_performance = cursor.fetchall()
-                
-                if agent_performance:
-                    # Create DataFrame for better display
-                    df = pd.DataFrame(agent_performance, columns=[
-                        "Agent Name", "Phone", "Bike No", "Status", 
-                        "Total Deliveries", "Delivered", "Cancelled", 
-                        "Avg Time (mins)"
-                    ])
-                    
-                    # Add status icons
-                    status_icons = {
-                        'Available': '🟢',
-                        'Busy': '🟠',
-                        'Offline': '🔴'
-                    }
-                    df['Status'] = df['Status'].map(lambda x: f"{status_icons.get(x, '⚪')} {x}")
-                    
-                    # Format average time
-                    df['Avg Time (mins)'] = df['Avg Time (mins)'].apply(lambda x: f"{int(x or 0)} mins")
-                    
-                    # Display the table
-                    st.dataframe(df, use_container_width=True)
+            # Live Delivery Agent Status Board
+            st.subheader("📦 Live Delivery Agent Status")
+
+            # Create three columns for different statuses
+            col1, col2, col3 = st.columns(3)
+
+            # Available Agents
+            with col1:
+                st.markdown("### 🟢 Available")
+                available_agents = [a for a in agent_statuses if a[3] == 'Available']
+                if available_agents:
+                    for agent in available_agents:
+                        with st.expander(f"🚚 {agent[0]}"):
+                            st.write(f"**Phone:** {agent[1]}")
+                            st.write(f"**Bike:** {agent[2]}")
+                            if agent[4]:
+                                st.write(f"**Current Order:** {agent[4]}")
                 else:
-                    st.info("No agent performance data available")
+                    st.info("No available agents")
 
-                # Add auto-refresh
-                st.markdown("---")
-                st.markdown("🔄 Auto-refreshing every 30 seconds")
-                time.sleep(30)
-                st.rerun()
+            # Busy Agents
+            with col2:
+                st.markdown("### 🟠 Busy")
+                busy_agents = [a for a in agent_statuses if a[3] == 'Busy']
+                if busy_agents:
+                    for agent in busy_agents:
+                        with st.expander(f"🚚 {agent[0]}"):
+                            st.write(f"**Phone:** {agent[1]}")
+                            st.write(f"**Bike:** {agent[2]}")
+                            if agent[4]:
+                                st.write(f"**Current Order:** {agent[4]}")
+                else:
+                    st.info("No busy agents")
 
-        except mysql.connector.Error as err:
-            st.error(f"Error accessing database: {err}")
-        except Exception as e:
-            st.error(f"An unexpected error occurred: {str(e)}")
+            # Offline Agents
+            with col3:
+                st.markdown("### 🔴 Offline")
+                offline_agents = [a for a in agent_statuses if a[3] == 'Offline']
+                if offline_agents:
+                    for agent in offline_agents:
+                        with st.expander(f"🚚 {agent[0]}"):
+                            st.write(f"**Phone:** {agent[1]}")
+                            st.write(f"**Bike:** {agent[2]}")
+                            if agent[4]:
+                                st.write(f"**Current Order:** {agent[4]}")
+                else:
+                    st.info("No offline agents")
+
+            # Individual Agent Performance Table
+            st.subheader("👤 Individual Agent Performance")
+
+            if agent_performance:
+                # Create DataFrame for better display
+                df = pd.DataFrame(agent_performance, columns=[
+                    "Agent Name", "Phone", "Bike No", "Status", 
+                    "Total Deliveries", "Delivered", "Cancelled", 
+                    "Avg Time (mins)"
+                ])
+
+                # Add status icons
+                status_icons = {
+                    'Available': '🟢',
+                    'Busy': '🟠',
+                    'Offline': '🔴'
+                }
+                df['Status'] = df['Status'].map(lambda x: f"{status_icons.get(x, '⚪')} {x}")
+
+                # Format average time
+                df['Avg Time (mins)'] = df['Avg Time (mins)'].apply(lambda x: f"{int(x or 0)} mins")
+                
+                # Delivery time percentiles from each agent's sketch
+                for index, q in enumerate(DELIVERY_PERCENTILES):
+                    df[f"P{round(q * 100)} (mins)"] = [
+                        f"{delivery_percentiles[phone][1][index]:.0f}" if phone in delivery_percentiles else "-"
+                        for phone in df['Phone']
+                    ]
+
+                # Display the table
+                st.dataframe(df, use_container_width=True)
+            else:
+                st.info("No agent performance data available")
+
+            st.markdown("---")
+            st.caption(f"🔄 Last checked for changes at {datetime.now():%H:%M:%S}")
+        
+        delivery_agent_board()
 
 # Add this after the create_tables function
 def create_delivery_agent_table():
@@ -2512,6 +4613,7 @@ def delivery_agent_add_data(name, phone, password, address):
         # Insert delivery agent without bike number
         cursor.execute('''INSERT INTO DeliveryAgents(DA_Name, DA_Phone, DA_Password, DA_Address) 
             VALUES (%s, %s, %s, %s)''', (name, phone, hashed_pass, address))
+        bump_data_version(cursor, DELIVERY_AGENTS_SCOPE)
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
@@ -2542,6 +4644,7 @@ def update_delivery_agent_profile(phone, bike_number=None, address=None):
         query = f"UPDATE DeliveryAgents SET {', '.join(update_fields)} WHERE DA_Phone = %s"
         
         cursor.execute(query, tuple(update_values))
+        bump_data_version(cursor, DELIVERY_AGENTS_SCOPE)
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
@@ -2570,19 +4673,25 @@ def delivery_agent_authenticate(phone, password):
         st.error(f"Authentication error: {err}")
         return False
 
+# Confirmed orders waiting for an agent, one row per order line
+CONFIRMED_ORDER_LINES_QUERY = '''
+    SELECT h.O_Name, d.D_Name, l.Quantity, h.OrderID, h.Status, 
+           h.DeliveryAddress, h.PaymentMethod, h.ContactNumber, h.OrderDate, h.StatusUpdateTime,
+           h.DeliveryAgentName, h.DeliveryAgentPhone, h.DeliveryAgentBike, l.D_id,
+           l.UnitPrice, l.Subtotal
+    FROM OrderHeader h
+    JOIN OrderLine l ON l.OrderID = h.OrderID
+    LEFT JOIN Drugs d ON d.D_id = l.D_id
+    WHERE h.Status = 'Confirmed'
+    ORDER BY h.OrderDate DESC, h.OrderID DESC
+'''
+
 def get_delivery_agent_orders(phone):
     try:
         cursor = db_manager.get_cursor()
         if not cursor:
             return []
-        cursor.execute('''
-            SELECT O_Name, O_Items, O_Qty, O_id, Status, 
-                   DeliveryAddress, PaymentMethod, ContactNumber, OrderDate,
-                   DeliveryAgentName, DeliveryAgentPhone, DeliveryAgentBike
-            FROM Orders
-            WHERE Status = 'Confirmed'
-            ORDER BY OrderDate DESC
-        ''')
+        cursor.execute(CONFIRMED_ORDER_LINES_QUERY)
         return cursor.fetchall() or []
     except mysql.connector.Error as err:
         st.error(f"Error retrieving orders: {err}")
@@ -2594,13 +4703,77 @@ def update_delivery_agent_status(phone, status):
         if not cursor:
             return False
         cursor.execute('UPDATE DeliveryAgents SET DA_Status = %s WHERE DA_Phone = %s', (status, phone))
+        bump_data_version(cursor, DELIVERY_AGENTS_SCOPE)
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
         st.error(f"Error updating status: {err}")
         return False
 
+def get_delivery_agent_board():
+    """(overall_stats, agent_statuses, agent_performance, delivery_percentiles) for the
+    admin Delivery Agents page, or None."""
+    try:
+        cursor = db_manager.get_cursor()
+        if not cursor:
+            return None
+        # Agents join their counters by primary key, see _record_agent_transition()
+        cursor.execute('''
+            SELECT 
+                COUNT(*) as total_agents,
+                COALESCE(SUM(s.DeliveredOrders), 0) as successful_deliveries,
+                SUM(s.DeliveryMinutes) / NULLIF(SUM(s.DeliveredOrders), 0) as avg_delivery_time,
+                COALESCE(SUM(s.ActiveOrders), 0) as active_deliveries,
+                COALESCE(SUM(s.DeliveredRevenue), 0) as total_revenue
+            FROM DeliveryAgents da
+            LEFT JOIN DeliveryAgentStats s ON s.DA_Phone = da.DA_Phone
+        ''')
+        overall_stats = cursor.fetchone()
+        cursor.execute('''
+            SELECT 
+                da.DA_Name,
+                da.DA_Phone,
+                da.DA_BikeNumber,
+                da.DA_Status,
+                o.OrderID as current_order
+            FROM DeliveryAgents da
+            LEFT JOIN OrderHeader o ON da.DA_Phone = o.DeliveryAgentPhone 
+                AND o.Status IN ('Placed', 'Confirmed', 'Shipped')
+        ''')
+        agent_statuses = cursor.fetchall()
+        cursor.execute('''
+            SELECT 
+                da.DA_Name,
+                da.DA_Phone,
+                da.DA_BikeNumber,
+                da.DA_Status,
+                COALESCE(s.TotalOrders, 0) as total_deliveries,
+                COALESCE(s.DeliveredOrders, 0) as successful_deliveries,
+                COALESCE(s.CancelledOrders, 0) as cancelled_deliveries,
+                s.DeliveryMinutes / NULLIF(s.DeliveredOrders, 0) as avg_delivery_time
+            FROM DeliveryAgents da
+            LEFT JOIN DeliveryAgentStats s ON s.DA_Phone = da.DA_Phone
+            ORDER BY total_deliveries DESC
+        ''')
+        agent_performance = cursor.fetchall()
+        return overall_stats, agent_statuses, agent_performance, get_delivery_time_percentiles(cursor)
+    except mysql.connector.Error as err:
+        st.error(f"Error accessing database: {err}")
+        return None
+
 # Add delivery agent dashboard
+AGENT_STATS_QUERY = '''
+    SELECT TotalOrders, DeliveredOrders, ActiveOrders
+    FROM DeliveryAgentStats
+    WHERE DA_Phone = %s
+'''
+AGENT_ORDERS_IN_PROGRESS_QUERY = '''
+    SELECT O_Name, OrderID, Status, DeliveryAddress, ContactNumber, OrderDate, StatusUpdateTime
+    FROM OrderHeader
+    WHERE Status = 'Shipped' AND DeliveryAgentPhone = %s
+    ORDER BY OrderDate DESC
+'''
+
 def delivery_agent_dashboard(phone):
     st.title("Delivery Agent Dashboard")
     
@@ -2622,16 +4795,10 @@ def delivery_agent_dashboard(phone):
             st.error("Agent information not found. Please contact support.")
             return
             
-        # Get delivery statistics
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_deliveries,
-                COUNT(CASE WHEN Status = 'Delivered' THEN 1 END) as completed_deliveries,
-                COUNT(CASE WHEN Status = 'Shipped' THEN 1 END) as in_progress_deliveries
-            FROM Orders 
-            WHERE DeliveryAgentPhone = %s
-        ''', (phone,))
-        stats = cursor.fetchone()
+        # Get delivery statistics (an agent holds an order from Shipped on, so
+        # the active orders are the ones in progress)
+        cursor.execute(AGENT_STATS_QUERY, (phone,))
+        stats = cursor.fetchone() or (0, 0, 0)
         
         # Profile Section
         st.subheader("Profile Information")
@@ -2714,45 +4881,33 @@ def delivery_agent_dashboard(phone):
         if orders:
             grouped_orders = {}
             for order in orders:
-                if len(order) < 4:
-                    continue
-                    
-                order_id_parts = order[3].split('_')
-                base_order_id = '_'.join(order_id_parts[:-1]) if len(order_id_parts) > 2 else order[3]
+                order_id = order[3]
                 
-                if base_order_id not in grouped_orders:
-                    grouped_orders[base_order_id] = {
+                if order_id not in grouped_orders:
+                    grouped_orders[order_id] = {
                         'customer': order[0],
                         'items': [],
-                        'status': order[4] if len(order) > 4 else "Placed",
-                        'address': order[5] if len(order) > 5 else "",
-                        'contact': order[7] if len(order) > 7 else "",
-                        'date': order[8] if len(order) > 8 else "Unknown",
-                        'status_update_time': order[9] if len(order) > 9 else "Unknown",
-                        'delivery_agent': order[10] if len(order) > 10 else None,
-                        'delivery_agent_phone': order[11] if len(order) > 11 else None,
-                        'delivery_agent_bike': order[12] if len(order) > 12 else None,
+                        'status': order[4],
+                        'address': order[5] or "",
+                        'contact': order[7] or "",
+                        'date': order[8],
+                        'status_update_time': order[9],
+                        'delivery_agent': order[10],
+                        'delivery_agent_phone': order[11],
+                        'delivery_agent_bike': order[12],
                         'total': 0
                     }
                 
-                # Get drug price for this item
-                price = 0
-                try:
-                    cursor.execute('SELECT D_id FROM Drugs WHERE D_Name = %s', (order[1],))
-                    drug_id = cursor.fetchone()
-                    if drug_id:
-                        price = get_drug_price(drug_id[0])
-                except:
-                    pass
-                
                 # Add item to the order group with price information
-                grouped_orders[base_order_id]['items'].append({
-                    'name': order[1],
+                grouped_orders[order_id]['items'].append({
+                    'name': order[1] or "Unknown drug",
                     'quantity': order[2],
-                    'price': price,
-                    'subtotal': price * order[2]
+                    'price': order[14],
+                    'subtotal': order[15]
                 })
-                grouped_orders[base_order_id]['total'] += price * order[2]
+            
+            for order_id, total in get_order_totals(list(grouped_orders)).items():
+                grouped_orders[order_id]['total'] = total
             
             # Show orders in two sections
             st.subheader("New Orders to Accept")
@@ -2787,29 +4942,21 @@ def delivery_agent_dashboard(phone):
             
             # Show orders in progress
             st.subheader("Orders in Progress")
-            cursor.execute('''
-                SELECT O_Name, O_Items, O_Qty, O_id, Status, 
-                       DeliveryAddress, PaymentMethod, ContactNumber, OrderDate,
-                       DeliveryAgentName, DeliveryAgentPhone, DeliveryAgentBike,
-                       StatusUpdateTime
-                FROM Orders
-                WHERE Status = 'Shipped' AND DeliveryAgentPhone = %s
-                ORDER BY OrderDate DESC
-            ''', (phone,))
+            cursor.execute(AGENT_ORDERS_IN_PROGRESS_QUERY, (phone,))
             in_progress_orders = cursor.fetchall()
             
             if in_progress_orders:
                 for order in in_progress_orders:
-                    with st.expander(f"Order #{order[3]} - {order[0]}"):
+                    with st.expander(f"Order #{order[1]} - {order[0]}"):
                         st.write(f"**Customer:** {order[0]}")
-                        st.write(f"**Status:** {order[4]}")
-                        st.write(f"**Order Date:** {order[8].strftime('%Y-%m-%d %H:%M:%S') if isinstance(order[8], datetime) else order[8]}")
-                        st.write(f"**Accepted On:** {order[12].strftime('%Y-%m-%d %H:%M:%S') if isinstance(order[12], datetime) else 'N/A'}")
-                        st.write(f"**Delivery Address:** {order[5]}")
-                        st.write(f"**Contact Number:** {order[7]}")
+                        st.write(f"**Status:** {order[2]}")
+                        st.write(f"**Order Date:** {order[5].strftime('%Y-%m-%d %H:%M:%S') if isinstance(order[5], datetime) else order[5]}")
+                        st.write(f"**Accepted On:** {order[6].strftime('%Y-%m-%d %H:%M:%S') if isinstance(order[6], datetime) else 'N/A'}")
+                        st.write(f"**Delivery Address:** {order[3]}")
+                        st.write(f"**Contact Number:** {order[4]}")
                         
-                        if st.button("Mark as Delivered", key=f"deliver_{order[3]}"):
-                            if update_order_status(order[3], "Delivered", phone):
+                        if st.button("Mark as Delivered", key=f"deliver_{order[1]}"):
+                            if update_order_status(order[1], "Delivered", phone):
                                 st.success("Order marked as delivered!")
                                 st.rerun()
                             else:
@@ -2821,6 +4968,8 @@ def delivery_agent_dashboard(phone):
     except Exception as e:
         st.error(f"An unexpected error occurred: {str(e)}")
 
+CUSTOMER_PASSWORD_RESET = 'UPDATE Customers SET C_Password = %s WHERE C_Number = %s'
+
 def reset_customer_password(phone, new_password):
     try:
         cursor = db_manager.get_cursor()
@@ -2838,8 +4987,7 @@ def reset_customer_password(phone, new_password):
         hashed_password = hash_password(new_password)
         
         # Update the password
-        cursor.execute('UPDATE Customers SET C_Password = %s WHERE C_Number = %s', 
-                      (hashed_password, phone))
+        cursor.execute(CUSTOMER_PASSWORD_RESET, (hashed_password, phone))
         db_manager.commit()
         return True
     except mysql.connector.Error as err:
@@ -2896,9 +5044,12 @@ def main():
         st.session_state.redirect = False
 
     try:
-        # Create tables and initialize sample data
-        create_tables()
-        initialize_sample_data()
+        # Apply pending schema migrations (once per process)
+        try:
+            ensure_schema()
+        except mysql.connector.Error as err:
+            st.error(f"Error applying schema migrations: {err}")
+            return
 
         # Show welcome screen if not logged in
         if not (st.session_state.logged_in or st.session_state.admin_logged_in or st.session_state.delivery_agent_logged_in):
@@ -3556,10 +5707,8 @@ def main():
                     phone = st.text_input("Customer Phone Number", placeholder="+91XXXXXXXXXX")
                     search_term = st.text_input("Search Medicine", placeholder="Enter medicine name")
 
-                    drugs = drug_view_all_data()
-                    filtered_drugs = [drug for drug in drugs 
-                                     if search_term.lower() in drug[0].lower() 
-                                     and drug[3] > 0]  # Only show available drugs
+                    drugs = search_drugs(search_term) if search_term.strip() else drug_view_all_data()
+                    filtered_drugs = [drug for drug in drugs if drug[3] > 0]  # Only show available drugs
 
                     qty_inputs = {}
                     if filtered_drugs:
@@ -3642,7 +5791,7 @@ def main():
                         total += item['subtotal']
                         if st.button(f"Remove {item['drug_name']}", key=f"remove_bill_{item['drug_id']}"):
                             del st.session_state.billing_cart[item['drug_id']]
-                            st.experimental_rerun()
+                            st.rerun()
                     st.write(f"**Total (Current Cart): ₹{total:.2f}")
 
                 st.markdown('</div>', unsafe_allow_html=True)
@@ -3652,5 +5801,493 @@ def main():
     finally:
         db_manager.close()
 
+# Index usage checks
+# The statement each data-access path runs and the managed index it must use,
+# verified with EXPLAIN by check_index_usage() / `python file.py check-indexes`.
+# Each entry names the query constant (or statement builder) the function itself
+# executes, so the check follows any change to the SQL.
+INDEX_USAGE_CHECKS = [
+    ("get_authenticate", CUSTOMER_PASSWORD_QUERY, ("probe",),
+     "idx_customers_name"),
+    ("reset_customer_password", CUSTOMER_PASSWORD_RESET, ("probe", "probe"),
+     "idx_customers_number"),
+    ("customer_dashboard (Profile orders)", CUSTOMER_DELIVERED_ORDERS_QUERY, ("probe",),
+     "idx_order_header_customer"),
+    ("get_customer_orders (status filter)",
+     _customer_orders_page_query(status=True, after=True), ("probe", "Placed", datetime(2024, 1, 1), datetime(2024, 1, 1), 0, 11),
+     "idx_order_header_customer_status"),
+    ("order_view_all_data (status filter)", ORDER_LINES_BY_STATUS_QUERY, ("Placed",),
+     "idx_order_header_status_date"),
+    ("get_delivery_agent_orders", CONFIRMED_ORDER_LINES_QUERY, (),
+     "idx_order_header_status_date"),
+    ("delivery_agent_dashboard (orders in progress)", AGENT_ORDERS_IN_PROGRESS_QUERY, ("probe",),
+     "idx_order_header_agent_status"),
+    ("delivery_agent_dashboard (statistics)", AGENT_STATS_QUERY, ("probe",),
+     "PRIMARY"),
+    ("order_add_data (stock decrement)", STOCK_DECREMENT, (1, 0, 1),
+     "PRIMARY"),
+    ("get_low_stock_drugs", LOW_STOCK_FIRST_PAGE_QUERY, (21,),
+     "idx_drugs_stock_gap"),
+    ("_allocate_lots (FEFO order)", _allocate_lots_statement(1), (0, 1),
+     "idx_drug_lot_fefo"),
+    ("admin Pharmacy Performance (low stock alerts)", INVENTORY_ALERTS_QUERY, (),
+     "idx_drugs_stock_gap"),
+    ("admin Pharmacy Performance (expiring lots)", INVENTORY_ALERTS_QUERY, (),
+     "idx_drug_lot_expiry"),
+    ("view_bills", CUSTOMER_BILLS_QUERY, ("probe",),
+     "idx_billing_customer_date"),
+    ("admin Pharmacy Performance (monthly trend)", MONTHLY_TRENDS_QUERY, (),
+     "PRIMARY"),
+    ("admin Pharmacy Performance (top drugs)", TOP_DRUGS_QUERY, (),
+     "idx_sales_by_drug_revenue"),
+    ("consume_status_events (previous event of the order)", STATUS_EVENT_BATCH_QUERY, (1000,),
+     "idx_order_status_event_order"),
+    ("get_performance_kpis (active customers)", PERFORMANCE_KPI_QUERY, (),
+     "idx_customer_stats_last_order"),
+]
+
+def check_index_usage():
+    """EXPLAIN every INDEX_USAGE_CHECKS query, returns (function, expected, used, ok) rows."""
+    conn = db_manager.connect()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    results = []
+    for function_name, query, params, expected_index in INDEX_USAGE_CHECKS:
+        cursor.execute(f"EXPLAIN {query}", params or None)
+        plan = cursor.fetchall()
+        used = [row['key'] for row in plan if row.get('key')]
+        results.append((function_name, expected_index, ", ".join(used) or "none", expected_index in used))
+    cursor.close()
+    return results
+
+
+# Command line entry points, e.g. `python file.py migrate`
+def cli_migrate(args):
+    with db_manager.lease():
+        applied = apply_migrations()
+    if applied:
+        print(f"Applied migrations: {', '.join(str(v) for v in applied)}")
+    else:
+        print(f"Schema is up to date (version {SCHEMA_VERSION})")
+    return 0
+
+def cli_bench_rerun(args):
+    # Compares the old per-rerun bootstrap (DDL + column probes + COUNT(*))
+    # against the cached ensure_schema() call reruns make now.
+    with db_manager.lease():
+        ensure_schema()
+
+        legacy = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            create_tables()
+            initialize_sample_data()
+            legacy.append(time.perf_counter() - start)
+        # The legacy DDL recreates the pre-split Orders table; drop the empty copy
+        db_manager.get_cursor().execute("DROP TABLE IF EXISTS Orders")
+
+        cached = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            ensure_schema()
+            cached.append(time.perf_counter() - start)
+
+    legacy_ms = sum(legacy) / len(legacy) * 1000
+    cached_ms = sum(cached) / len(cached) * 1000
+    print(f"Per-rerun schema bootstrap over {args.iterations} iterations")
+    print(f"  legacy create_tables + initialize_sample_data: {legacy_ms:9.3f} ms")
+    print(f"  cached ensure_schema:                           {cached_ms:9.3f} ms")
+    print(f"  saved per rerun:                                {legacy_ms - cached_ms:9.3f} ms")
+    return 0
+
+def _bench_scratch_drug(cursor, quantity):
+    cursor.execute("SELECT COALESCE(MAX(D_id), 0) + 1 FROM Drugs")
+    drug_id = cursor.fetchone()[0]
+    drug_name = f"bench_drug_{drug_id}"
+    expiry = datetime.now().date() + timedelta(days=365)
+    cursor.execute("INSERT INTO Drugs (D_Name, D_ExpDate, D_Use, D_Qty, D_id) VALUES (%s, %s, %s, %s, %s)",
+                   (drug_name, expiry, "benchmark", quantity, drug_id))
+    cursor.execute("INSERT INTO DrugLot (D_id, LotNumber, ExpDate, Qty) VALUES (%s, %s, %s, %s)",
+                   (drug_id, "BENCH", expiry, quantity))
+    cursor.execute("INSERT INTO Drug_Pricing VALUES (%s, %s)", (drug_id, 1))
+    db_manager.commit()
+    return drug_id, drug_name
+
+def _bench_cleanup(cursor, customer, drug_id, order_ids):
+    # `order_ids` went through the app's order paths and so into SalesDaily,
+    # take them back out before deleting (the drug's own rollups cascade)
+    for order_id in order_ids:
+        _rollup_order_counts(cursor, order_id, sign=-1)
+    cursor.execute("DELETE FROM CustomerOrderStats WHERE O_Name = %s", (customer,))
+    cursor.execute('''DELETE e, q FROM OrderStatusEvent e
+                      JOIN OrderHeader h ON h.OrderID = e.OrderID
+                      LEFT JOIN StageLatencyQueue q ON q.EventID = e.EventID
+                      WHERE h.O_Name = %s''', (customer,))
+    cursor.execute("DELETE FROM OrderHeader WHERE O_Name = %s", (customer,))
+    cursor.execute("DELETE FROM Drugs WHERE D_id = %s", (drug_id,))
+    db_manager.commit()
+
+def cli_bench_orders(args):
+    # Replays the statement sequence order_add_data used to issue per order
+    # (existence check, six SHOW COLUMNS probes, stock check, insert, update)
+    # against the current fast path.
+    def legacy_order_add(cursor, name, item, qty):
+        cursor.execute('SELECT OrderID FROM OrderHeader WHERE O_Name = %s AND OrderDate > NOW()', (name,))
+        cursor.fetchall()
+        for column in ("Status", "DeliveryAddress", "ContactNumber", "PaymentMethod", "OrderDate", "StatusUpdateTime"):
+            cursor.execute(f"SHOW COLUMNS FROM OrderHeader LIKE '{column}'")
+            cursor.fetchall()
+        db_manager.commit()
+        cursor.execute('SELECT D_Qty FROM Drugs WHERE D_Name = %s', (item,))
+        cursor.fetchall()
+        cursor.execute('''INSERT INTO OrderHeader (O_Name, Status, DeliveryAddress, PaymentMethod, ContactNumber)
+                      VALUES (%s, %s, %s, %s, %s)''',
+                     (name, "Placed", "", "", ""))
+        cursor.execute('''INSERT INTO OrderLine (OrderID, D_id, Quantity)
+                      SELECT %s, D_id, %s FROM Drugs WHERE D_Name = %s LIMIT 1''',
+                     (cursor.lastrowid, qty, item))
+        cursor.execute('UPDATE Drugs SET D_Qty = D_Qty - %s WHERE D_Name = %s', (qty, item))
+        db_manager.commit()
+
+    with db_manager.lease():
+        cursor = db_manager.get_cursor()
+        drug_id, drug_name = _bench_scratch_drug(cursor, args.orders * 2)
+        customer = f"bench_{int(time.time())}"
+        order_ids = []
+        try:
+            start = time.perf_counter()
+            for _ in range(args.orders):
+                legacy_order_add(cursor, customer, drug_name, 1)
+            legacy_elapsed = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.orders):
+                order_ids.append(order_add_data(customer, drug_id, 1))
+            fast_elapsed = time.perf_counter() - start
+        finally:
+            _bench_cleanup(cursor, customer, drug_id, [order_id for order_id in order_ids if order_id])
+
+    print(f"order_add_data throughput over {args.orders} orders")
+    print(f"  legacy (schema probing): {args.orders / legacy_elapsed:9.1f} orders/sec")
+    print(f"  fast path:               {args.orders / fast_elapsed:9.1f} orders/sec")
+    return 0
+
+def cli_bench_checkout(args):
+    # N workers race to check out one unit each of a drug with limited stock,
+    # first with the old check-then-decrement sequence (stock SELECT, header
+    # commit, then an unconditional per-item decrement) and then with
+    # place_order_with_cart. Any order accepted beyond the stock is an oversell.
+    def legacy_checkout(cursor, customer, drug_id, qty):
+        cursor.execute('SELECT D_Qty FROM Drugs WHERE D_id = %s', (drug_id,))
+        available_qty = cursor.fetchone()
+        db_manager.commit()
+        if not available_qty or available_qty[0] < qty:
+            return False
+        cursor.execute('''INSERT INTO OrderHeader (O_Name, Status, DeliveryAddress, PaymentMethod, ContactNumber)
+                      VALUES (%s, %s, %s, %s, %s)''', (customer, "Placed", "", "", ""))
+        order_id = cursor.lastrowid
+        db_manager.commit()
+        cursor.execute("START TRANSACTION")
+        cursor.execute('INSERT INTO OrderLine (OrderID, D_id, Quantity) VALUES (%s, %s, %s)', (order_id, drug_id, qty))
+        cursor.execute('UPDATE Drugs SET D_Qty = D_Qty - %s WHERE D_id = %s', (qty, drug_id))
+        db_manager.commit()
+        return True
+
+    def race(checkout):
+        accepted = []
+        lock = threading.Lock()
+
+        def worker():
+            with db_manager.lease():
+                cursor = db_manager.get_cursor()
+                ok = 0
+                for _ in range(args.checkouts):
+                    ok += bool(checkout(cursor))
+                with lock:
+                    accepted.append(ok)
+
+        threads = [threading.Thread(target=worker) for _ in range(args.workers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(accepted), time.perf_counter() - start
+
+    with db_manager.lease():
+        cursor = db_manager.get_cursor()
+        drug_id, drug_name = _bench_scratch_drug(cursor, args.stock)
+    customer = f"bench_{int(time.time())}"
+    cart = {drug_id: {'name': drug_name, 'quantity': 1, 'price': 1}}
+    order_ids = []
+
+    def checkout(cursor):
+        result = place_order_with_cart(customer, cart, "", "", "")
+        if result:
+            order_ids.append(result['order_id'])
+        return result
+
+    modes = [
+        ("legacy (check then decrement)", lambda cursor: legacy_checkout(cursor, customer, drug_id, 1)),
+        ("single transaction", checkout),
+    ]
+    attempts = args.workers * args.checkouts
+    print(f"{args.workers} workers x {args.checkouts} checkouts of 1 unit against stock {args.stock}")
+    try:
+        for label, checkout in modes:
+            with db_manager.lease():
+                cursor = db_manager.get_cursor()
+                cursor.execute("UPDATE Drugs SET D_Qty = %s WHERE D_id = %s", (args.stock, drug_id))
+                cursor.execute("UPDATE DrugLot SET Qty = %s WHERE D_id = %s", (args.stock, drug_id))
+                db_manager.commit()
+            accepted, elapsed = race(checkout)
+            with db_manager.lease():
+                cursor = db_manager.get_cursor()
+                cursor.execute("SELECT D_Qty FROM Drugs WHERE D_id = %s", (drug_id,))
+                final_qty = cursor.fetchone()[0]
+                db_manager.commit()
+            print(f"  {label:<30} {attempts / elapsed:9.1f} checkouts/sec, "
+                  f"accepted {accepted}, oversold {max(0, accepted - args.stock)}, final stock {final_qty}")
+    finally:
+        with db_manager.lease():
+            _bench_cleanup(db_manager.get_cursor(), customer, drug_id, order_ids)
+    return 0
+
+def cli_bench_search(args):
+    # Builds the Shop search index over a synthetic catalog (no database) and
+    # times ranked lookups for typical partial and multi-word queries.
+    rng = random.Random(42)
+    syllables = ["para", "ceta", "mol", "ibu", "pro", "fen", "amox", "cilin", "met", "for",
+                 "min", "ator", "vasta", "tin", "lo", "sar", "tan", "azi", "thro", "mycin"]
+    uses = ["pain relief", "fever", "infection", "diabetes", "blood pressure", "cholesterol", "allergy", "cough"]
+    rows = {}
+    for drug_id in range(1, args.skus + 1):
+        name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+        rows[drug_id] = (f"{name} {rng.choice([250, 500, 650])}mg", None, rng.choice(uses), 100, drug_id, 1)
+
+    class SyntheticCatalog(DrugCatalog):
+        def _load(self):
+            return dict(rows)
+
+    start = time.perf_counter()
+    index = DrugSearchIndex(SyntheticCatalog())
+    index.search("warm up")
+    build_ms = (time.perf_counter() - start) * 1000
+
+    queries = ["pa", "ibu", "amoxcilin", "metfor", "vasta 500", "pain", "mycin infection", "zzz"]
+    print(f"Search index over {args.skus} SKUs built in {build_ms:.1f} ms")
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            results = index.search(query)
+        per_query_ms = (time.perf_counter() - start) / args.iterations * 1000
+        print(f"  {query!r:<20} {per_query_ms:8.3f} ms  ({len(results)} results)")
+
+    start = time.perf_counter()
+    matcher = DrugNameMatcher(index.catalog)
+    matcher.lookup("warm up")
+    build_ms = (time.perf_counter() - start) * 1000
+    typos = ["paracetmol", "ibuprofn", "amoxcillin", "metfromin", "atorvastatn"]
+    words = set()
+    for row in rows.values():
+        words.update(DrugNameMatcher._words(row[0]))
+    print(f"Fuzzy name matcher over {len(words)} distinct words built in {build_ms:.1f} ms")
+    for query in typos:
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            results = matcher.lookup(query)
+        per_query_ms = (time.perf_counter() - start) / args.iterations * 1000
+        pattern = _edit_pattern(query)
+        start = time.perf_counter()
+        for word in words:
+            _edit_distance(pattern, word)
+        scan_ms = (time.perf_counter() - start) * 1000
+        closest = results[0][1][0] if results else "-"
+        print(f"  {query!r:<20} {per_query_ms:8.3f} ms, full scan {scan_ms:8.3f} ms  (closest: {closest})")
+    return 0
+
+def cli_bench_sketch(args):
+    # Per-agent t-digests against exact percentiles over synthetic log-normal
+    # delivery times: update and read cost, stored size and error. With
+    # --database it also times the stored sketches against the exact SQL
+    # recompute over the delivered orders.
+    rng = random.Random(42)
+    minutes = [rng.lognormvariate(3.5, 0.6) for _ in range(args.deliveries)]
+    labels = [f"P{round(q * 100)}" for q in DELIVERY_PERCENTILES]
+
+    digests = [TDigest() for _ in range(args.agents)]
+    start = time.perf_counter()
+    for i, value in enumerate(minutes):
+        digests[i % args.agents].add(value)
+    add_us = (time.perf_counter() - start) / len(minutes) * 1e6
+
+    # The delivery path: load the agent's digest, add one value, store it
+    sample = min(1000, len(minutes))
+    data = digests[0].to_bytes()
+    start = time.perf_counter()
+    for value in minutes[:sample]:
+        digest = TDigest.from_bytes(data)
+        digest.add(value)
+        data = digest.to_bytes()
+    persisted_us = (time.perf_counter() - start) / sample * 1e6
+
+    stored = [digest.to_bytes() for digest in digests]
+    start = time.perf_counter()
+    overall = TDigest()
+    for data in stored:
+        overall.merge(TDigest.from_bytes(data))
+    estimates = [overall.quantile(q) for q in DELIVERY_PERCENTILES]
+    sketch_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    ordered = sorted(minutes)
+    exact = [ordered[max(0, math.ceil(q * len(ordered)) - 1)] for q in DELIVERY_PERCENTILES]
+    exact_ms = (time.perf_counter() - start) * 1000
+
+    worst_agent_error = 0.0
+    for agent, digest in enumerate(digests):
+        agent_minutes = sorted(minutes[agent::args.agents])
+        for q in DELIVERY_PERCENTILES:
+            truth = agent_minutes[max(0, math.ceil(q * len(agent_minutes)) - 1)]
+            worst_agent_error = max(worst_agent_error, abs(digest.quantile(q) - truth) / truth)
+
+    print(f"{args.deliveries} synthetic deliveries across {args.agents} agents")
+    print(f"  sketch update:     {add_us:8.2f} us in memory, {persisted_us:8.2f} us load/add/store")
+    print(f"  stored size:       {sum(len(data) for data in stored):8d} bytes "
+          f"(raw values {8 * len(minutes)} bytes)")
+    print(f"  overall read:      {sketch_ms:8.2f} ms merging sketches, {exact_ms:8.2f} ms exact sort")
+    for label, estimate, truth in zip(labels, estimates, exact):
+        print(f"  {label:<4} sketch {estimate:8.2f}  exact {truth:8.2f}  error {abs(estimate - truth) / truth:6.2%}")
+    print(f"  worst per-agent error: {worst_agent_error:.2%}")
+
+    if args.database:
+        with db_manager.lease():
+            cursor = db_manager.get_cursor()
+            start = time.perf_counter()
+            deliveries, estimates = get_delivery_time_percentiles(cursor)[None]
+            sketch_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            cursor.execute(EXACT_DELIVERY_PERCENTILES_QUERY, DELIVERY_PERCENTILES)
+            *exact, delivered = cursor.fetchone()
+            exact_ms = (time.perf_counter() - start) * 1000
+            db_manager.commit()
+        print(f"Database: {deliveries} sketched and {delivered or 0} delivered orders")
+        print(f"  read:              {sketch_ms:8.2f} ms stored sketches, {exact_ms:8.2f} ms exact SQL")
+        if deliveries and delivered:
+            for label, estimate, truth in zip(labels, estimates, exact):
+                print(f"  {label:<4} sketch {estimate:8.2f}  exact {float(truth):8.2f}")
+    return 0
+
+def cli_check_indexes(args):
+    with db_manager.lease():
+        results = check_index_usage()
+    failures = 0
+    for function_name, expected_index, used, ok in results:
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {function_name:<48} expected {expected_index:<28} used {used}")
+    return 1 if failures or not results else 0
+
+def cli_rebuild_rollups(args):
+    with db_manager.lease():
+        cursor = db_manager.get_cursor()
+        start = time.perf_counter()
+        try:
+            rebuild_sales_rollups(cursor)
+            db_manager.commit()
+        except mysql.connector.Error:
+            db_manager.connection.rollback()
+            raise
+        elapsed = time.perf_counter() - start
+        counts = []
+        for table in ("SalesDaily", "SalesDailyDrug", "SalesByDrug", "CustomerOrderStats"):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            counts.append(f"{table} {cursor.fetchone()[0]}")
+        db_manager.commit()
+    print(f"Rebuilt sales rollups in {elapsed:.2f} s: {', '.join(counts)} rows")
+    return 0
+
+def cli_consume_events(args):
+    with db_manager.lease():
+        cursor = db_manager.get_cursor()
+        try:
+            if args.replay:
+                reset_stage_latency(cursor)
+                db_manager.commit()
+            while True:
+                start = time.perf_counter()
+                consumed = consume_status_events(cursor, args.batch_size)
+                print(f"Consumed {consumed} status events in {time.perf_counter() - start:.2f} s")
+                if not args.every:
+                    break
+                time.sleep(args.every)
+        except mysql.connector.Error:
+            db_manager.connection.rollback()
+            raise
+        except KeyboardInterrupt:
+            db_manager.connection.rollback()
+        stages = get_stage_latency(cursor)
+        db_manager.commit()
+    for from_status, to_status, transitions, average, p50, p90, longest in stages:
+        print(f"  {from_status + ' -> ' + to_status:<24} {transitions:8d} transitions  "
+              f"avg {average:8.1f}  p50 {p50:8.1f}  p90 {p90:8.1f}  max {longest:8.1f} mins")
+    return 0
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="file.py", description="Pharmacy Management System maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser("migrate", help="apply pending schema migrations")
+    migrate_parser.set_defaults(handler=cli_migrate)
+
+    bench_rerun_parser = subparsers.add_parser("bench-rerun", help="benchmark per-rerun schema bootstrap latency")
+    bench_rerun_parser.add_argument("--iterations", type=int, default=20)
+    bench_rerun_parser.set_defaults(handler=cli_bench_rerun)
+
+    bench_orders_parser = subparsers.add_parser("bench-orders", help="benchmark order_add_data orders/sec before and after")
+    bench_orders_parser.add_argument("--orders", type=int, default=500)
+    bench_orders_parser.set_defaults(handler=cli_bench_orders)
+
+    bench_checkout_parser = subparsers.add_parser("bench-checkout", help="stress concurrent checkouts of one drug, report throughput and oversells")
+    bench_checkout_parser.add_argument("--workers", type=int, default=8)
+    bench_checkout_parser.add_argument("--checkouts", type=int, default=25)
+    bench_checkout_parser.add_argument("--stock", type=int, default=100)
+    bench_checkout_parser.set_defaults(handler=cli_bench_checkout)
+
+    bench_search_parser = subparsers.add_parser("bench-search", help="time Shop search and fuzzy name lookups over a synthetic catalog")
+    bench_search_parser.add_argument("--skus", type=int, default=100000)
+    bench_search_parser.add_argument("--iterations", type=int, default=200)
+    bench_search_parser.set_defaults(handler=cli_bench_search)
+
+    check_indexes_parser = subparsers.add_parser("check-indexes", help="assert via EXPLAIN that hot queries use the managed indexes")
+    check_indexes_parser.set_defaults(handler=cli_check_indexes)
+
+    bench_sketch_parser = subparsers.add_parser("bench-sketch", help="compare delivery time sketches with exact percentiles")
+    bench_sketch_parser.add_argument("--deliveries", type=int, default=100000)
+    bench_sketch_parser.add_argument("--agents", type=int, default=20)
+    bench_sketch_parser.add_argument("--database", action="store_true",
+                                     help="also compare the stored sketches with an exact SQL recompute")
+    bench_sketch_parser.set_defaults(handler=cli_bench_sketch)
+
+    rebuild_rollups_parser = subparsers.add_parser("rebuild-rollups", help="recompute the sales rollup tables from orders and bills")
+    rebuild_rollups_parser.set_defaults(handler=cli_rebuild_rollups)
+
+    consume_events_parser = subparsers.add_parser("consume-events", help="fold new order status events into the stage latency aggregates")
+    consume_events_parser.add_argument("--batch-size", type=int, default=1000)
+    consume_events_parser.add_argument("--replay", action="store_true",
+                                       help="reset the aggregates and replay the whole event log")
+    consume_events_parser.add_argument("--every", type=float, default=0,
+                                       help="keep running, consuming again every this many seconds")
+    consume_events_parser.set_defaults(handler=cli_consume_events)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.handler(args)
+    finally:
+        db_manager.shutdown()
+
 if __name__ == '__main__':
+    # `streamlit run file.py` passes no extra arguments
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     main()
@@ -0,0 +1,53 @@
+"""Test fixtures. `file_module` is the app module itself; `app` also points it at
+a real MySQL database for tests of the data functions.
+
+Point PHARMACY_TEST_DATABASE (and optionally PHARMACY_TEST_HOST, PHARMACY_TEST_USER,
+PHARMACY_TEST_PASSWORD) at a scratch database; the tests are skipped without one.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def file_module():
+    """The app module, for tests of code that needs no database."""
+    pytest.importorskip("streamlit")
+    pytest.importorskip("mysql.connector")
+    import file
+    return file
+
+@pytest.fixture(scope="session")
+def app(file_module):
+    database = os.environ.get("PHARMACY_TEST_DATABASE")
+    if not database:
+        pytest.skip("PHARMACY_TEST_DATABASE is not set")
+    app = file_module
+    app.db_manager = app.DatabaseManager(
+        host=os.environ.get("PHARMACY_TEST_HOST", "localhost"),
+        user=os.environ.get("PHARMACY_TEST_USER", "root"),
+        password=os.environ.get("PHARMACY_TEST_PASSWORD", ""),
+        database=database,
+        pool_size=1
+    )
+    with app.db_manager.lease():
+        app.apply_migrations()
+    yield app
+    app.db_manager.shutdown()
+
+@pytest.fixture
+def cursor(app):
+    with app.db_manager.lease():
+        yield app.db_manager.get_cursor()
+
+@pytest.fixture
+def scratch_drug(app, cursor):
+    """(drug_id, customer) with 10 units in stock, removed with its orders afterwards."""
+    drug_id, _ = app._bench_scratch_drug(cursor, 10)
+    customer = f"test_customer_{drug_id}"
+    yield drug_id, customer
+    cursor.execute("SELECT OrderID FROM OrderHeader WHERE O_Name = %s", (customer,))
+    order_ids = [row[0] for row in cursor.fetchall()]
+    app._bench_cleanup(cursor, customer, drug_id, order_ids)
@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+def random_word(rng, alphabet, low, high):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(low, high)))
+
+def test_edit_distance_matches_dp(file_module):
+    rng = random.Random(11)
+    for _ in range(2000):
+        # Small alphabets give plenty of partial matches; long words cross 64 bits
+        alphabet = "abc" if rng.random() < 0.5 else "abcdefghij"
+        a = random_word(rng, alphabet, 0, 12 if rng.random() < 0.9 else 80)
+        b = random_word(rng, alphabet, 0, 12 if rng.random() < 0.9 else 80)
+        assert file_module.edit_distance(a, b) == levenshtein(a, b), (a, b)
+
+@pytest.fixture
+def catalog_rows():
+    rng = random.Random(5)
+    rows = {}
+    for drug_id in range(1, 401):
+        name = " ".join(random_word(rng, "aeiolmnprst", 2, 9) for _ in range(rng.randint(1, 3)))
+        rows[drug_id] = (name, None, "", 10, drug_id, 1)
+    return rows
+
+@pytest.fixture
+def catalog(file_module, catalog_rows):
+    class Catalog(file_module.DrugCatalog):
+        def _load(self):
+            return dict(catalog_rows)
+
+    return Catalog()
+
+def nearest(matcher_class, rows, term):
+    # {drug_id: [(query word, distance to its closest name word)]}, by comparing every pair
+    return {drug_id: [(word, min(levenshtein(word, name_word) for name_word in matcher_class._words(row[0])))
+                      for word in matcher_class._words(term)]
+            for drug_id, row in rows.items()}
+
+def brute_force(distances, max_distance):
+    scores = {}
+    for drug_id, words in distances.items():
+        allowed = [max_distance if max_distance is not None else 1 if len(word) <= 5 else 2 for word, _ in words]
+        if all(best <= limit for (_, best), limit in zip(words, allowed)):
+            scores[drug_id] = sum(best for _, best in words)
+    return scores
+
+def lookup_scores(matcher, term, max_distance):
+    return {row[4]: distance for distance, row in matcher.lookup(term, max_distance, limit=None)}
+
+def test_lookup_matches_brute_force(file_module, catalog, catalog_rows):
+    matcher = file_module.DrugNameMatcher(catalog)
+    rng = random.Random(3)
+    names = [row[0] for row in catalog_rows.values()]
+    for _ in range(100):
+        words = rng.choice(names).split()
+        # Typo each word by up to two edits, or use an unrelated word
+        term = " ".join(
+            "".join(c for c in word if rng.random() > 0.15) + random_word(rng, "aeiou", 0, 1)
+            for word in words)
+        if rng.random() < 0.2:
+            term = random_word(rng, "aeiolmnprst", 3, 8)
+        distances = nearest(file_module.DrugNameMatcher, catalog_rows, term)
+        for max_distance in (None, 0, 1, 2, 3):
+            assert lookup_scores(matcher, term, max_distance) == brute_force(distances, max_distance), \
+                (term, max_distance)
+
+def test_lookup_follows_catalog_changes(file_module, catalog, catalog_rows):
+    matcher = file_module.DrugNameMatcher(catalog)
+    matcher.lookup("warm up")
+    rows = dict(catalog_rows)
+    for drug_id in range(1, 401, 7):
+        name = f"renamed{drug_id} tablet"
+        catalog.patch(drug_id, name=name)
+        rows[drug_id] = (name,) + rows[drug_id][1:]
+    for drug_id in range(3, 401, 11):
+        catalog.remove(drug_id)
+        rows.pop(drug_id, None)
+    for term in ("tablet", "renamed15", "renamd22 tablt", rows[2][0], catalog_rows[3][0]):
+        distances = nearest(file_module.DrugNameMatcher, rows, term)
+        assert lookup_scores(matcher, term, None) == brute_force(distances, None), term
@@ -0,0 +1,20 @@
+def _stock(cursor, drug_id):
+    cursor.execute("SELECT D_Qty FROM Drugs WHERE D_id = %s", (drug_id,))
+    quantity = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(SUM(Qty), 0) FROM DrugLot WHERE D_id = %s", (drug_id,))
+    return quantity, cursor.fetchone()[0]
+
+def test_checkout_rolls_back_when_lots_fall_short(app, cursor, scratch_drug):
+    drug_id, customer = scratch_drug
+    # The drug claims 10 units but its lots have drifted down to 3
+    cursor.execute("UPDATE DrugLot SET Qty = 3 WHERE D_id = %s", (drug_id,))
+    app.db_manager.commit()
+
+    assert not app.order_add_data(customer, drug_id, 5)
+    cart = {drug_id: {'name': "test drug", 'quantity': 5}}
+    assert not app.place_order_with_cart(customer, cart, "Test Street", "9000000000", "Cash")
+    assert _stock(cursor, drug_id) == (10, 3)
+    app.db_manager.commit()
+
+    assert app.order_add_data(customer, drug_id, 3)
+    assert _stock(cursor, drug_id) == (7, 0)
@@ -0,0 +1,34 @@
+def _agent_stats(cursor, phone):
+    cursor.execute('''SELECT TotalOrders, ActiveOrders, DeliveredOrders, CancelledOrders
+                      FROM DeliveryAgentStats WHERE DA_Phone = %s''', (phone,))
+    row = cursor.fetchone()
+    return row or (0, 0, 0, 0)
+
+def _order_count(cursor):
+    cursor.execute("SELECT COALESCE(SUM(OrderCount), 0) FROM SalesDaily")
+    return cursor.fetchone()[0]
+
+def test_deleting_a_cancelled_order_twice_counts_it_once(app, cursor, scratch_drug):
+    drug_id, customer = scratch_drug
+    phone = f"9{drug_id:09d}"[-10:]
+    assert app.delivery_agent_add_data("Test Agent", phone, "secret", "Test Street")
+    try:
+        orders_before = _order_count(cursor)
+        order_id = app.order_add_data(customer, drug_id, 1)
+        assert order_id
+        assert app.update_order_status(order_id, "Confirmed")
+        assert app.update_order_status(order_id, "Shipped", phone)
+        assert app.update_order_status(order_id, "Cancelled")
+        assert _agent_stats(cursor, phone) == (1, 0, 0, 1)
+        app.db_manager.commit()
+
+        assert app.order_delete(order_id)
+        assert not app.order_delete(order_id)
+
+        assert _agent_stats(cursor, phone) == (0, 0, 0, 0)
+        assert _order_count(cursor) == orders_before
+        cursor.execute("SELECT COUNT(*) FROM CustomerOrderStats WHERE O_Name = %s", (customer,))
+        assert cursor.fetchone()[0] == 0
+    finally:
+        cursor.execute("DELETE FROM DeliveryAgents WHERE DA_Phone = %s", (phone,))
+        app.db_manager.commit()
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+QUERIES = ["ol", "pa", "o", "ol 5", "cet", "paracetamol", "mol 500", "in", "ibu pain", "zz", "fen fe"]
+
+@pytest.fixture(scope="module")
+def catalog_rows():
+    rng = random.Random(7)
+    syllables = ["para", "ceta", "mol", "ibu", "pro", "fen", "amox", "cilin", "met", "for", "min", "lo"]
+    uses = ["pain relief", "fever", "infection", "diabetes", "allergy"]
+    rows = {1: ("Paracetamol 500mg", None, "fever", 10, 1, 1)}
+    for drug_id in range(2, 301):
+        name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+        rows[drug_id] = (f"{name} {rng.choice([250, 500])}mg", None, rng.choice(uses), 10, drug_id, 1)
+    return rows
+
+@pytest.fixture
+def index(file_module, catalog_rows):
+    class Catalog(file_module.DrugCatalog):
+        def _load(self):
+            return dict(catalog_rows)
+
+    return file_module.DrugSearchIndex(Catalog())
+
+@pytest.mark.parametrize("term", QUERIES)
+def test_search_keeps_substring_matches(index, catalog_rows, term):
+    found = {row[4] for row in index.search(term, limit=None)}
+    # Everything the Shop's old `term in name` filter found is still found...
+    assert {d for d, row in catalog_rows.items() if term.lower() in row[0].lower()} <= found
+    # ...and every result contains each query word in its name or use
+    words = term.lower().split()
+    assert found == {d for d, row in catalog_rows.items()
+                     if all(word in f"{row[0]} {row[2]}".lower() for word in words)}
+
+def test_short_word_finds_paracetamol(index):
+    assert "Paracetamol 500mg" in [row[0] for row in index.search("ol", limit=None)]
+
+def test_limit_keeps_best_matches_first(index):
+    full = index.search("pa", limit=None)
+    assert index.search("pa", limit=5) == full[:5]
@@ -0,0 +1,57 @@
+import bisect
+import math
+import random
+
+import pytest
+
+def _exact(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+def _rank(values, estimate):
+    # Fraction of the values at or below `estimate`
+    ordered = sorted(values)
+    return bisect.bisect_right(ordered, estimate) / len(ordered)
+
+@pytest.mark.parametrize("size", [1000, 50000])
+def test_quantiles_track_exact_percentiles(file_module, size):
+    rng = random.Random(size)
+    values = [rng.lognormvariate(3.5, 0.6) for _ in range(size)]
+    digest = file_module.TDigest()
+    for value in values:
+        digest.add(value)
+    assert digest.count == size
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        assert abs(_rank(values, digest.quantile(q)) - q) <= 0.005
+    if size >= 10000:
+        for q in (0.5, 0.9, 0.99):
+            assert digest.quantile(q) == pytest.approx(_exact(values, q), rel=0.01)
+
+def test_bytes_round_trip_keeps_quantiles(file_module):
+    rng = random.Random(7)
+    digest = file_module.TDigest()
+    for _ in range(5000):
+        digest.add(rng.expovariate(1 / 30))
+    restored = file_module.TDigest.from_bytes(digest.to_bytes())
+    assert restored.count == digest.count
+    assert (restored.min, restored.max) == (digest.min, digest.max)
+    for q in (0.01, 0.5, 0.9, 0.99):
+        assert restored.quantile(q) == pytest.approx(digest.quantile(q), rel=1e-4)
+
+def test_merged_digests_match_one_digest_of_everything(file_module):
+    rng = random.Random(3)
+    values = [rng.lognormvariate(3.5, 0.6) for _ in range(20000)]
+    parts = [file_module.TDigest() for _ in range(20)]
+    for i, value in enumerate(values):
+        parts[i % 20].add(value)
+    merged = file_module.TDigest()
+    for part in parts:
+        merged.merge(file_module.TDigest.from_bytes(part.to_bytes()))
+    assert merged.count == len(values)
+    for q in (0.5, 0.9, 0.99):
+        assert merged.quantile(q) == pytest.approx(_exact(values, q), rel=0.02)
+
+def test_empty_digest(file_module):
+    digest = file_module.TDigest.from_bytes(file_module.TDigest().to_bytes())
+    assert digest.count == 0
+    assert digest.quantile(0.5) is None